@@ -0,0 +1,194 @@
+import os
+import time
+import traceback
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import perfonitor.calculations as calculations
+import perfonitor.data_treatment as data_treatment
+import perfonitor.file_names as file_names
+import perfonitor.instrumentation as instrumentation
+import perfonitor.operation_hours as operation_hours
+
+logger = instrumentation.get_logger(__name__)
+
+
+# <editor-fold desc="Site pipeline">
+
+def run_site(site_input):
+    """Runs the PR and failure pipeline of one site. site_input is a dictionary with:
+        'Inverter List', 'Power Data' (all_inverter_power_data_dict), 'Site Info', 'General Info' for PR
+        'Operation Hours' (df_operation_hours), optional, for units in operation
+        'Incidents' and 'Components to Analyse', optional, for the events summary
+
+    Returns a dictionary with 'PR' and 'Production' ({granularity: {pr_type: Dataframe}}), and, with operation
+    hours, 'Units', 'Incidents', 'Events Summary' and 'Unit Failure'. run_sites adds the 'Metrics' (spans) of the
+    site"""
+
+    site_results = {}
+
+    if 'Power Data' in site_input:
+        site_results['PR'], site_results['Production'] = calculations.calculate_all_pr_inverters(
+            site_input['Inverter List'], site_input['Power Data'], site_input['Site Info'],
+            site_input.get('General Info'))
+
+    if 'Operation Hours' in site_input:
+        df_operation_hours = site_input['Operation Hours']
+        operation_hours_index = operation_hours.OperationHoursIndex(df_operation_hours)
+
+        inverter_operation = data_treatment.get_all_units_from_operation_hours(df_operation_hours)
+        site_results['Units'] = inverter_operation
+
+        if 'Incidents' in site_input:
+            incidents = data_treatment.complete_dataset_inverterops_data(
+                site_input['Incidents'].copy(), inverter_operation, df_operation_hours, operation_hours_index)
+            _, unit_failure_dict, all_events_summary = calculations.get_events_summary_per_fault_component(
+                site_input['Components to Analyse'], incidents, inverter_operation, df_operation_hours,
+                operation_hours_index)
+
+            site_results['Incidents'] = incidents
+            site_results['Events Summary'] = all_events_summary
+            site_results['Unit Failure'] = unit_failure_dict
+
+    return site_results
+
+
+def _run_site_to_file(site, site_input, output_directory):
+    """Loads (if site_input is a loader), runs and saves one site in the worker, so that only the status is sent
+    back. Any error, including sys.exit() in the calculations, fails only this site"""
+
+    start = time.perf_counter()
+    output_file = os.path.join(output_directory, file_names.get_safe_name(site) + '.pkl')
+    try:
+        # Spans of the site are saved with its results, the parent process does not see them
+        with instrumentation.record_metrics() as recorder:
+            with instrumentation.span('run_site', site=site):
+                if callable(site_input):
+                    site_input = site_input()
+                site_results = run_site(site_input)
+        site_results['Metrics'] = recorder.spans
+
+        temporary_file = output_file + '.tmp'
+        pd.to_pickle(site_results, temporary_file)
+        os.replace(temporary_file, output_file)
+
+        return {'Site': site, 'Status': 'Done', 'Output File': output_file, 'Error': "",
+                'Duration': time.perf_counter() - start}
+
+    except (Exception, SystemExit) as error:
+        return {'Site': site, 'Status': 'Failed', 'Output File': "",
+                'Error': repr(error) + "\n" + traceback.format_exc(), 'Duration': time.perf_counter() - start}
+
+# </editor-fold>
+
+# <editor-fold desc="Batch of sites">
+
+def run_sites(site_inputs, output_directory, workers: int = None, max_pending: int = None, executor=None):
+    """Runs the pipeline of many sites in a process pool. site_inputs is {site: site input}, each site input as in
+    run_site or a picklable function without arguments that loads it, so that the data is only loaded in the
+    worker. At most max_pending sites (default: number of workers) are submitted at a time, to bound memory.
+
+    Results of each site are saved to <output_directory>/<site>.pkl as soon as it finishes and its status is
+    appended to <output_directory>/batch_summary.csv. Site names giving the same file name (e.g. 'A/B' and 'A_B')
+    raise a ValueError before any site runs. A failed site does not stop the batch. If a worker process
+    dies, the sites of the pool are run again, one at a time, and only a site that also dies alone fails.
+    workers=0 runs the sites one at a time in this process. Returns the status of all sites as a Dataframe"""
+
+    os.makedirs(output_directory, exist_ok=True)
+    summary_file = os.path.join(output_directory, 'batch_summary.csv')
+    statuses = []
+
+    def save_status(status):
+        statuses.append(status)
+        log = logger.info if status['Status'] == 'Done' else logger.error
+        log(str(status['Site']) + ': ' + status['Status'] + ' in ' + str(round(status['Duration'], 1)) + ' s')
+        pd.DataFrame([status]).to_csv(summary_file, mode='a', index=False,
+                                      header=not os.path.exists(summary_file))
+
+    # Sites whose names only differ in characters not allowed in file names would overwrite each other's results
+    name_collisions = file_names.get_name_collisions(site_inputs)
+    if name_collisions:
+        raise ValueError('Site names with the same output file: ' + str(name_collisions))
+
+    sites = list(site_inputs.items())
+
+    if workers == 0 and executor is None:
+        for site, site_input in sites:
+            save_status(_run_site_to_file(site, site_input, output_directory))
+        return pd.DataFrame(statuses)
+
+    pool = executor if executor is not None else ProcessPoolExecutor(max_workers=workers)
+    if max_pending is None:
+        max_pending = getattr(pool, '_max_workers', None) or os.cpu_count() or 1
+
+    def save_failure(site, error):
+        save_status({'Site': site, 'Status': 'Failed', 'Output File': "", 'Error': error, 'Duration': 0.0})
+
+    def collect(futures):
+        """Saves the status of finished sites, returns whether the pool broke"""
+
+        pool_broken = False
+        for future in futures:
+            site, site_input, retry = pending.pop(future)
+            try:
+                save_status(future.result())
+            except BrokenProcessPool as error:
+                # A worker process died (e.g. out of memory or os._exit) and all sites of the pool fail with it, so
+                # each one is retried once. It fails only if it breaks the pool again when running alone
+                pool_broken = True
+                if retry:
+                    save_failure(site, repr(error))
+                else:
+                    retries.append((site, site_input, True))
+            except Exception as error:
+                save_failure(site, repr(error))
+        return pool_broken
+
+    try:
+        # Sites to submit as (site, site input, retry), retries first
+        queue = [(site, site_input, False) for site, site_input in sites]
+        pending = {}
+        while queue or pending:
+            retries = []
+            pool_broken = False
+            while queue and len(pending) < max_pending and not (pending and queue[0][2]) and \
+                    not any(retry for _, _, retry in pending.values()):
+                site, site_input, retry = queue.pop(0)
+                try:
+                    future = pool.submit(_run_site_to_file, site, site_input, output_directory)
+                except Exception as error:
+                    if isinstance(error, BrokenProcessPool) and executor is None:
+                        # The pool broke after the last sites finished, the site goes to the next pool
+                        queue.insert(0, (site, site_input, retry))
+                        pool_broken = True
+                        break
+                    # The pool takes no more sites (e.g. a broken executor of the caller), the rest of the batch fails
+                    for failed_site, _, _ in [(site, site_input, retry)] + queue:
+                        save_failure(failed_site, repr(error))
+                    queue = []
+                    break
+                pending[future] = (site, site_input, retry)
+
+            if pending and not pool_broken:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pool_broken = collect(done)
+
+            if pool_broken and executor is None:
+                # Other sites of the broken pool fail too, they are collected before the pool is replaced
+                collect(wait(pending)[0])
+                pool.shutdown()
+                pool = ProcessPoolExecutor(max_workers=workers)
+            queue = retries + queue
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+    return pd.DataFrame(statuses)
+
+
+def load_site_results(output_directory, site):
+    """Reads the results of a site saved by run_sites"""
+
+    return pd.read_pickle(os.path.join(output_directory, file_names.get_safe_name(site) + '.pkl'))
+
+# </editor-fold>
@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import pandas as pd
+import numpy as np
+import perfonitor.calculations as calculations
+import perfonitor.data_treatment as data_treatment
+import perfonitor.site_calendar as site_calendar
+
+
+# <editor-fold desc="Synthetic inputs">
+
+benchmark_scales = {'small': {'n_inverters': 10, 'n_days': 30, 'n_incidents': 200},
+                    'medium': {'n_inverters': 100, 'n_days': 365, 'n_incidents': 2000},
+                    'large': {'n_inverters': 1000, 'n_days': 365, 'n_incidents': 20000}}
+
+fault_components = ['IGBT', 'Fan', 'Capacitor', 'Control Board', 'Phase Fuse', 'Unknown', 'IGBT;Fan',
+                    'Capacitor;Control Board']
+failure_modes = ['Overheating', 'Communication Loss', 'Isolation Fault', 'Grid Fault']
+
+
+def generate_power_data(n_inverters: int = 10, n_days: int = 30, start_date='2022-01-01', seed=None,
+                        freq='15min'):
+    """Returns inverter_list, all_inverter_power_data_dict and site_info of a synthetic site with data every freq
+    (15 minutes by default): per inverter a Dataframe with Timestamp, AC, Expected and Ideal power and Irradiance,
+    clipped at Capacity AC, with some outages (AC 0) and missing values, and site_info with Days, Months and
+    Component Info"""
+
+    rng = np.random.default_rng(seed)
+    datapoints_per_day = pd.Timedelta(days=1) // pd.Timedelta(freq)
+    timestamps = pd.date_range(start_date, periods=n_days * datapoints_per_day, freq=freq)
+    hours = np.asarray(timestamps.hour + timestamps.minute / 60)
+    day_of_year = np.asarray(timestamps.dayofyear)
+
+    # Clear sky shape by time of day and season, times a daily cloudiness
+    clear_sky = np.clip(np.sin((hours - 6) / 12 * np.pi), 0, None) * (0.75 + 0.25 * np.cos(
+        (day_of_year - 172) / 365 * 2 * np.pi))
+    daily_clouds = rng.uniform(0.3, 1, n_days).repeat(datapoints_per_day)
+
+    inverter_list = ['Inverter ' + str(i + 1).zfill(len(str(n_inverters))) for i in range(n_inverters)]
+    capacities = rng.choice([100.0, 110.0, 125.0, 150.0], n_inverters)
+    blocks = ['Block ' + str(i // 10 + 1) for i in range(n_inverters)]
+
+    all_inverter_power_data_dict = {}
+    for inverter, capacity in zip(inverter_list, capacities):
+        irradiance = 1000 * clear_sky * daily_clouds * rng.uniform(0.9, 1, len(timestamps))
+        ideal_power = irradiance / 1000 * capacity * 1.2
+        expected_power = ideal_power * 0.95
+        ac_power = np.minimum(expected_power * rng.uniform(0.85, 1, len(timestamps)), capacity)
+
+        outages = rng.random(n_days) < 0.02
+        ac_power[outages.repeat(datapoints_per_day)] = 0
+        ac_power[rng.random(len(timestamps)) < 0.001] = np.nan
+
+        power_data = pd.DataFrame({'Timestamp': timestamps, inverter + ' AC Power': ac_power,
+                                   inverter + ' Expected Power': expected_power,
+                                   inverter + ' Ideal Power': ideal_power,
+                                   inverter + ' POA Irradiance': irradiance})
+        all_inverter_power_data_dict[inverter] = {'Power Data': power_data}
+
+    site_info = {'Days': list(dict.fromkeys(timestamps.date)),
+                 'Months': list(dict.fromkeys(timestamps.strftime('%m-%Y'))),
+                 'Component Info': pd.DataFrame({'Component': inverter_list, 'Capacity AC': capacities,
+                                                 'Block': blocks})}
+
+    return inverter_list, all_inverter_power_data_dict, site_info
+
+
+def generate_operation_hours(inverter_list, n_days: int = 30, start_date='2022-01-01', replacement_rate=0.1,
+                             seed=None, freq='15min'):
+    """Returns df_operation_hours of the inverters, a reading every freq: hours counters increasing during daylight,
+    reset to 0 when the inverter is replaced (replacement_rate of the inverters), with gaps of missing readings"""
+
+    rng = np.random.default_rng(seed)
+    datapoints_per_day = pd.Timedelta(days=1) // pd.Timedelta(freq)
+    timestamps = pd.date_range(start_date, periods=n_days * datapoints_per_day, freq=freq)
+    hours = np.asarray(timestamps.hour + timestamps.minute / 60)
+    in_operation = ((hours >= 6) & (hours < 20)).astype(float) * (pd.Timedelta(freq) / pd.Timedelta(hours=1))
+
+    operation_hours = {'Timestamp': timestamps}
+    for inverter in inverter_list:
+        counter = rng.uniform(1000, 20000) + np.cumsum(in_operation)
+        if rng.random() < replacement_rate:
+            replacement = rng.integers(len(timestamps) // 10, len(timestamps) - len(timestamps) // 10)
+            counter[replacement:] = np.cumsum(in_operation[replacement:]) + 1
+            counter[replacement - 4:replacement] = np.nan
+
+        counter[rng.random(len(timestamps)) < 0.01] = np.nan
+        operation_hours[inverter] = counter
+
+    return pd.DataFrame(operation_hours)
+
+
+def generate_incidents(inverter_list, n_incidents: int = 200, n_days: int = 30, start_date='2022-01-01', seed=None):
+    """Returns an incidents table with Related Component (mostly inverters, some blocks, combiner boxes and site
+    incidents), Event Start Time, Fault Component (some ';'-joined) and Failure Mode"""
+
+    rng = np.random.default_rng(seed)
+    other_components = ['Block 1', 'CB 1.1', 'String 1.1.1', 'LSBP']
+    components = np.where(rng.random(n_incidents) < 0.9, rng.choice(inverter_list, n_incidents),
+                          rng.choice(other_components, n_incidents))
+
+    start_times = pd.Timestamp(start_date) + pd.to_timedelta(rng.integers(60, (n_days * 96 - 4) * 15, n_incidents),
+                                                            unit='min')
+
+    return pd.DataFrame({'Related Component': components,
+                         'Event Start Time': start_times,
+                         'Fault Component': rng.choice(fault_components, n_incidents),
+                         'Failure Mode': rng.choice(failure_modes, n_incidents)}).sort_values(
+        'Event Start Time').reset_index(drop=True)
+
+
+def generate_site(n_inverters: int = 10, n_days: int = 30, n_incidents: int = 200, replacement_rate=0.1, seed=0,
+                  freq='15min'):
+    """Returns all synthetic inputs of a site as a dictionary, as used by batch.run_site"""
+
+    inverter_list, all_inverter_power_data_dict, site_info = generate_power_data(n_inverters, n_days, seed=seed,
+                                                                                 freq=freq)
+    df_operation_hours = generate_operation_hours(inverter_list, n_days, replacement_rate=replacement_rate,
+                                                  seed=seed + 1, freq=freq)
+    incidents = generate_incidents(inverter_list, n_incidents, n_days, seed=seed + 2)
+
+    return {'Inverter List': inverter_list, 'Power Data': all_inverter_power_data_dict, 'Site Info': site_info,
+            'General Info': None, 'Operation Hours': df_operation_hours, 'Incidents': incidents,
+            'Components to Analyse': ['IGBT', 'Fan', 'Capacitor', 'Control Board']}
+
+# </editor-fold>
+
+# <editor-fold desc="Benchmarks">
+
+def _clear_caches():
+    site_calendar.clear_calendar_indexes()
+
+
+def time_function(function, repeat: int = 3):
+    """Runs the function repeat times, with cold caches, returns the wall times and the last result"""
+
+    times = []
+    result = None
+    for _ in range(repeat):
+        _clear_caches()
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    return times, result
+
+
+def run_benchmarks(scale='small', repeat: int = 3, seed=0, **site_parameters):
+    """Times the PR calculation for every PR type and granularity, the units from operation hours, the completion
+    of the incidents and the events summaries on a synthetic site. scale is one of benchmark_scales, site_parameters
+    (n_inverters, n_days, n_incidents, replacement_rate, freq) override it. Returns a Dataframe with one row per
+    benchmark"""
+
+    parameters = {**benchmark_scales[scale], **site_parameters}
+    site_input = generate_site(seed=seed, **parameters)
+
+    inverter_list = site_input['Inverter List']
+    all_inverter_power_data_dict = site_input['Power Data']
+    site_info = site_input['Site Info']
+    df_operation_hours = site_input['Operation Hours']
+    components_to_analyse = site_input['Components to Analyse']
+
+    benchmarks = {}
+    for pr_type in ['raw', 'corrected', 'corrected_DCfocus']:
+        for granularity in ['daily', 'monthly']:
+            benchmarks['calculate_pr_inverters ' + pr_type + ' ' + granularity] = \
+                lambda pr_type=pr_type, granularity=granularity: calculations.calculate_pr_inverters(
+                    inverter_list, all_inverter_power_data_dict, site_info, None, pr_type, granularity)
+
+    benchmarks['calculate_all_pr_inverters'] = lambda: calculations.calculate_all_pr_inverters(
+        inverter_list, all_inverter_power_data_dict, site_info, None)
+    benchmarks['get_all_units_from_operation_hours'] = lambda: data_treatment.get_all_units_from_operation_hours(
+        df_operation_hours)
+
+    _, inverter_operation = time_function(benchmarks['get_all_units_from_operation_hours'], 1)
+    benchmarks['complete_dataset_inverterops_data'] = lambda: data_treatment.complete_dataset_inverterops_data(
+        site_input['Incidents'].copy(), inverter_operation, df_operation_hours)
+
+    _, incidents = time_function(benchmarks['complete_dataset_inverterops_data'], 1)
+    benchmarks['get_events_summary_per_fault_component'] = \
+        lambda: calculations.get_events_summary_per_fault_component(components_to_analyse, incidents,
+                                                                    inverter_operation, df_operation_hours)
+    benchmarks['get_events_summary_per_failure_mode'] = \
+        lambda: calculations.get_events_summary_per_failure_mode(components_to_analyse, incidents,
+                                                                 inverter_operation, df_operation_hours)
+
+    results = []
+    for benchmark, function in benchmarks.items():
+        times, _ = time_function(function, repeat)
+        results.append({'Benchmark': benchmark, 'Scale': scale, 'Inverters': parameters['n_inverters'],
+                        'Days': parameters['n_days'], 'Incidents': parameters['n_incidents'],
+                        'Best (s)': min(times), 'Median (s)': float(np.median(times)), 'Repeat': repeat})
+
+    return pd.DataFrame(results)
+
+
+def save_benchmarks(benchmark_results, output_file):
+    """Saves benchmark results to a JSON file with the versions of Python, NumPy and pandas"""
+
+    report = {'Date': pd.Timestamp.now().isoformat(timespec='seconds'),
+              'Python': platform.python_version(), 'NumPy': np.__version__, 'pandas': pd.__version__,
+              'Results': benchmark_results.to_dict(orient='records')}
+
+    directory = os.path.dirname(output_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(output_file, 'w') as file:
+        json.dump(report, file, indent=2)
+
+
+def load_benchmarks(benchmark_file):
+    with open(benchmark_file) as file:
+        return pd.DataFrame(json.load(file)['Results'])
+
+
+def compare_benchmarks(baseline_file, current_file):
+    """Compares the best times of two saved runs, Speedup above 1 means the current run is faster"""
+
+    baseline = load_benchmarks(baseline_file).set_index(['Benchmark', 'Scale'])['Best (s)']
+    current = load_benchmarks(current_file).set_index(['Benchmark', 'Scale'])['Best (s)']
+
+    comparison = pd.DataFrame({'Baseline (s)': baseline, 'Current (s)': current})
+    comparison['Speedup'] = comparison['Baseline (s)'] / comparison['Current (s)']
+
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the PR and failure calculations on synthetic data')
+    parser.add_argument('--scale', default='small', choices=list(benchmark_scales))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None, help='JSON file to save the results')
+    parser.add_argument('--compare', default=None, help='JSON file of a previous run to compare with')
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmarks(arguments.scale, arguments.repeat)
+    print(benchmark_results.to_string(index=False))
+
+    if arguments.output:
+        save_benchmarks(benchmark_results, arguments.output)
+        if arguments.compare:
+            print(compare_benchmarks(arguments.compare, arguments.output).to_string())
+
+    sys.exit(0)
+
+# </editor-fold>
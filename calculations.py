@@ -3,9 +3,12 @@ import sys
 import pandas as pd
 import numpy as np
 import perfonitor.data_treatment as data_treatment
-import perfonitor.data_acquisition as data_acquisition
-import perfonitor.inputs as inputs
-import perfonitor.visuals as visuals
+import perfonitor.instrumentation as instrumentation
+import perfonitor.operation_hours as operation_hours
+import perfonitor.parallel as parallel
+import perfonitor.sampling as sampling
+import perfonitor.schema as data_schema
+import perfonitor.site_calendar as site_calendar
 import calendar
 from datetime import datetime
 import timeit
@@ -13,728 +16,693 @@ import math
 import time
 import datetime as dt
 
+logger = instrumentation.get_logger(__name__)
+
 
 
 # <editor-fold desc="PR Calculation">
 
+# Suffix of each inverter's PR column, per granularity and PR type
+pr_column_suffixes = {'daily': {'raw': ' PR %', 'corrected': ' Corrected PR %',
+                                'corrected_DCfocus': ' - DC focus - Corrected PR %'},
+                      'monthly': {'raw': ' Raw Monthly PR %',
+                                  'corrected': ' Corrected (w/clipping) Monthly PR %',
+                                  'corrected_DCfocus': ' Corrected (w/clipping) Monthly PR %'}}
 
-def calculate_daily_raw_pr(inverter_data, days_under_analysis, inverter):
-    """From Inverter data (Power AC and Expected Power) calculates Raw PR
-    Also uses irradiance to complete Dataframe"""
+
+def get_period_codes(period_labels, periods_under_analysis):
+    """From the period label of each datapoint (e.g. the 'Day' or 'Month' column) and the periods under analysis
+    returns the integer code of each datapoint's period (-1 if outside the analysis) and the unique periods"""
+
+    periods = pd.Index(list(dict.fromkeys(periods_under_analysis)))
+    period_codes = periods.get_indexer(pd.Index(period_labels))
+
+    return period_codes, periods
+
+
+def sum_per_period(values, period_codes, n_periods, weights=None):
+    """Sums each column of values per period code in a single pass, datapoints with code -1 are ignored.
+    NaN values are skipped, like in a pandas sum. With weights (one per datapoint, or per datapoint and column) the
+    weighted values are summed, e.g. power times interval hours for energy"""
+
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+
+    in_analysis = period_codes >= 0
+    codes = period_codes[in_analysis]
+    values = np.nan_to_num(values[in_analysis], nan=0.0)
+    if weights is not None:
+        weights = np.asarray(weights, dtype=float)[in_analysis]
+        values = values * (weights[:, np.newaxis] if weights.ndim == 1 else weights)
+
+    sums = np.zeros((n_periods, values.shape[1]))
+    if len(codes) == 0:
+        return sums
+
+    # Datapoints of the same period are made contiguous (timestamps are usually sorted already), so that all
+    # columns are summed with one reduceat
+    if np.any(codes[1:] < codes[:-1]):
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        values = values[order]
+
+    period_starts = np.concatenate(([0], np.flatnonzero(codes[1:] != codes[:-1]) + 1))
+    sums[codes[period_starts]] = np.add.reduceat(values, period_starts, axis=0)
+
+    return sums
+
+
+def clip_to_export_capacity(power, maxexport_capacity_ac):
+    """Returns power clipped to the max export capacity as a new array, NaN values are kept"""
+
+    return np.minimum(np.asarray(power, dtype=float), maxexport_capacity_ac)
+
+
+def get_clipped_power(inverter_data, maxexport_capacity_ac, expected_power_column, ideal_power_column):
+    """Returns Expected and Ideal power of the inverter clipped to the max export capacity, without changing
+    inverter_data"""
+
+    clipped_expected_power = clip_to_export_capacity(inverter_data[expected_power_column], maxexport_capacity_ac)
+    clipped_ideal_power = clip_to_export_capacity(inverter_data[ideal_power_column], maxexport_capacity_ac)
+
+    return clipped_expected_power, clipped_ideal_power
+
+
+def stack_pr_type_values(values, maxexport_capacity_ac, clipped_power=None):
+    """From the AC, Expected, Ideal and Irradiance values of each datapoint returns the values used by each PR type,
+    side by side: raw, corrected (Expected and Ideal clipped to the max export capacity) and DC focus (corrected,
+    zero where AC power is not above 0). clipped_power, as (Expected, Ideal), avoids clipping again.
+    values can also have more dimensions with the quantities last, e.g. (timestamps, inverters, quantities) with one
+    max export capacity per inverter, the PR type values are then stacked on the last axis"""
+
+    ac_power, expected_power, ideal_power, irradiance = np.moveaxis(np.asarray(values, dtype=float), -1, 0)
+
+    if clipped_power is None:
+        clipped_power = (clip_to_export_capacity(expected_power, maxexport_capacity_ac),
+                         clip_to_export_capacity(ideal_power, maxexport_capacity_ac))
+    clipped_expected_power, clipped_ideal_power = clipped_power
+    dc_focus = ac_power > 0
+
+    pr_type_values = np.stack([ac_power, expected_power, ideal_power, irradiance,
+                               ac_power, clipped_expected_power, clipped_ideal_power, irradiance,
+                               np.where(dc_focus, ac_power, 0), np.where(dc_focus, clipped_expected_power, 0),
+                               np.where(dc_focus, clipped_ideal_power, 0), np.where(dc_focus, irradiance, 0)], axis=-1)
+
+    return pr_type_values
+
+
+def calculate_energy_per_period(inverter_data, period_column, periods_under_analysis, power_columns,
+                                clipped_power=None, datapoints_mask=None, calendar_index=None, interval_hours=None):
+    """From Inverter data calculates the energy of each power column (and irradiation) per period under analysis,
+    with one aggregation over all periods instead of one scan of the data per period.
+    clipped_power, as {column: array}, replaces the values of those columns and datapoints outside
+    datapoints_mask are not counted. With a calendar_index (CalendarIndex of the data timestamps) the periods come
+    from the index, otherwise from the period_column of inverter_data.
+    Power is integrated with the hours of each datapoint, from its Timestamp if interval_hours is not given (see
+    sampling.get_interval_hours), so any sampling interval works, also irregular"""
+
+    if calendar_index is not None:
+        period_codes, periods = calendar_index.get_period_codes(period_column, periods_under_analysis)
+    else:
+        period_codes, periods = get_period_codes(inverter_data[period_column], periods_under_analysis)
+
+    if interval_hours is None:
+        interval_hours = calendar_index.get_interval_hours() if calendar_index is not None else \
+            sampling.get_interval_hours(inverter_data['Timestamp'])
+
+    if datapoints_mask is not None:
+        period_codes = np.where(np.asarray(datapoints_mask), period_codes, -1)
+
+    if clipped_power is None:
+        values = inverter_data[power_columns].to_numpy(dtype=float)
+    else:
+        values = np.column_stack([clipped_power[column] if column in clipped_power else
+                                  inverter_data[column].to_numpy(dtype=float) for column in power_columns])
+
+    energy = sum_per_period(values, period_codes, len(periods), interval_hours)
+
+    energy_df = pd.DataFrame(energy, index=periods, columns=power_columns)
+
+    return energy_df
+
+
+def get_power_columns(inverter_data, inverter=None, schema=None):
+    """Returns the AC power, Expected power, Ideal power and Irradiance columns of the inverter data, from the schema
+    if given or else by name matching"""
+
+    if schema is not None:
+        return schema.get_columns(inverter, inverter_data)
 
     ac_power_column = inverter_data.columns[inverter_data.columns.str.contains('AC')].values[0]
     expected_power_column = inverter_data.columns[inverter_data.columns.str.contains('Expected')].values[0]
     ideal_power_column = inverter_data.columns[inverter_data.columns.str.contains('Ideal')].values[0]
     irradiance_column = inverter_data.columns[inverter_data.columns.str.contains('Irradiance')].values[0]
 
-    daily_pr_inverter = {}
-    for day in days_under_analysis:
-        data_day = inverter_data.loc[inverter_data['Day'] == day]
-        actual_power_day = data_day[ac_power_column].sum() / 4
-        expected_power_day = data_day[expected_power_column].sum() / 4
-        ideal_power_day = data_day[ideal_power_column].sum() / 4
+    return ac_power_column, expected_power_column, ideal_power_column, irradiance_column
 
-        irradiance_day = data_day[irradiance_column].sum() / 4
 
-        pr_day = actual_power_day / ideal_power_day
-        daily_pr_inverter[day] = (pr_day, irradiance_day)
+def calculate_daily_raw_pr(inverter_data, days_under_analysis, inverter, schema=None, calendar_index=None):
+    """From Inverter data (Power AC and Expected Power) calculates Raw PR
+    Also uses irradiance to complete Dataframe"""
+
+    ac_power_column, expected_power_column, ideal_power_column, irradiance_column = \
+        get_power_columns(inverter_data, inverter, schema)
 
-        # print(day, ": ", actual_power_day, " / " , expected_power_day, " / ", pr_day, " / ")
+    energy_df = calculate_energy_per_period(inverter_data, 'Day', days_under_analysis,
+                                            [ac_power_column, expected_power_column, ideal_power_column,
+                                             irradiance_column],
+                                            calendar_index=calendar_index)
 
-    daily_pr_df = pd.DataFrame.from_dict(daily_pr_inverter, orient='index',
-                                         columns=[str(inverter) + ' PR %', irradiance_column])
+    daily_pr_df = pd.DataFrame({str(inverter) + ' PR %': energy_df[ac_power_column] / energy_df[ideal_power_column],
+                                irradiance_column: energy_df[irradiance_column]})
     # print(df)
 
     return daily_pr_df, irradiance_column
 
 
-def calculate_daily_corrected_pr(inverter_data, days_under_analysis, inverter, maxexport_capacity_ac):
+def calculate_daily_corrected_pr(inverter_data, days_under_analysis, inverter, maxexport_capacity_ac, schema=None,
+                                 calendar_index=None, clipped_power=None):
     '''From Inverter data (Power AC, Expected Power and Max export capacity ) calculates Corrected PR
     Corrected PR, in this case, is the correction for max export capacity.
         Also uses irradiance to complete Dataframe'''
 
-    ac_power_column = inverter_data.columns[inverter_data.columns.str.contains('AC')].values[0]
-    expected_power_column = inverter_data.columns[inverter_data.columns.str.contains('Expected')].values[0]
-    ideal_power_column = inverter_data.columns[inverter_data.columns.str.contains('Ideal')].values[0]
-    irradiance_column = inverter_data.columns[inverter_data.columns.str.contains('Irradiance')].values[0]
-
-    corrected_power_data = inverter_data
-    corrected_power_data[expected_power_column] = [maxexport_capacity_ac if power > maxexport_capacity_ac else power for
-                                                   power in
-                                                   corrected_power_data[expected_power_column]]
-    corrected_power_data[ideal_power_column] = [maxexport_capacity_ac if power > maxexport_capacity_ac else power for
-                                                power in
-                                                corrected_power_data[ideal_power_column]]
-    corrected_daily_pr_dict = {}
-
-    for day in days_under_analysis:
-        corrected_data_day = corrected_power_data.loc[corrected_power_data['Day'] == day]
-        corrected_actual_power_day = corrected_data_day[ac_power_column].sum() / 4
-        corrected_expected_power_day = corrected_data_day[expected_power_column].sum() / 4
-        corrected_ideal_power_day = corrected_data_day[ideal_power_column].sum() / 4
-
-        irradiance_day = corrected_data_day[irradiance_column].sum() / 4
-
-        corrected_pr_day = corrected_actual_power_day / corrected_ideal_power_day
-        corrected_daily_pr_dict[day] = (corrected_pr_day, irradiance_day)
-
-    corrected_daily_pr_df = pd.DataFrame.from_dict(corrected_daily_pr_dict, orient='index',
-                                                   columns=[str(inverter) + ' Corrected PR %',
-                                                            irradiance_column])
+    ac_power_column, expected_power_column, ideal_power_column, irradiance_column = \
+        get_power_columns(inverter_data, inverter, schema)
+
+    if clipped_power is None:
+        clipped_power = get_clipped_power(inverter_data, maxexport_capacity_ac, expected_power_column,
+                                          ideal_power_column)
+    clipped_expected_power, clipped_ideal_power = clipped_power
+
+    corrected_energy_df = calculate_energy_per_period(inverter_data, 'Day', days_under_analysis,
+                                                      [ac_power_column, expected_power_column, ideal_power_column,
+                                                       irradiance_column],
+                                                      clipped_power={expected_power_column: clipped_expected_power,
+                                                                     ideal_power_column: clipped_ideal_power},
+                                                      calendar_index=calendar_index)
+
+    corrected_daily_pr_df = pd.DataFrame(
+        {str(inverter) + ' Corrected PR %': corrected_energy_df[ac_power_column] / corrected_energy_df[
+            ideal_power_column],
+         irradiance_column: corrected_energy_df[irradiance_column]})
     # print(corrected_daily_pr_df)
 
     return corrected_daily_pr_df, irradiance_column
 
 
-def calculate_daily_corrected_pr_focusDC(inverter_data, days_under_analysis, inverter, maxexport_capacity_ac):
+def calculate_daily_corrected_pr_focusDC(inverter_data, days_under_analysis, inverter, maxexport_capacity_ac,
+                                         schema=None, calendar_index=None, clipped_power=None):
     """From Inverter data (Power AC, Expected Power and Max export capacity ) calculates Corrected PR
     Corrected PR, in this case, is the correction for inverter failures (focus on DC side) and with max export capacity in place
         Also uses irradiance to complete Dataframe"""
 
-    ac_power_column = inverter_data.columns[inverter_data.columns.str.contains('AC')].values[0]
-    expected_power_column = inverter_data.columns[inverter_data.columns.str.contains('Expected')].values[0]
-    ideal_power_column = inverter_data.columns[inverter_data.columns.str.contains('Ideal')].values[0]
-    irradiance_column = inverter_data.columns[inverter_data.columns.str.contains('Irradiance')].values[0]
-
-    corrected_power_data = inverter_data.loc[inverter_data[ac_power_column] > 0]
-    corrected_power_data[expected_power_column] = [maxexport_capacity_ac if power > maxexport_capacity_ac else power for
-                                                   power in
-                                                   corrected_power_data[expected_power_column]]
-    corrected_power_data[ideal_power_column] = [maxexport_capacity_ac if power > maxexport_capacity_ac else power for
-                                                power in
-                                                corrected_power_data[ideal_power_column]]
-    corrected_daily_pr_dict = {}
-
-    for day in days_under_analysis:
-        corrected_data_day = corrected_power_data.loc[corrected_power_data['Day'] == day]
-        corrected_actual_power_day = corrected_data_day[ac_power_column].sum() / 4
-        corrected_expected_power_day = corrected_data_day[expected_power_column].sum() / 4
-        corrected_ideal_power_day = corrected_data_day[ideal_power_column].sum() / 4
-
-        irradiance_day = corrected_data_day[irradiance_column].sum() / 4
-
-        corrected_pr_day = corrected_actual_power_day / corrected_ideal_power_day
-        corrected_daily_pr_dict[day] = (corrected_pr_day, irradiance_day)
-
-    corrected_df = pd.DataFrame.from_dict(corrected_daily_pr_dict, orient='index',
-                                          columns=[str(inverter) + ' - DC focus - Corrected PR %',
-                                                   irradiance_column])
+    ac_power_column, expected_power_column, ideal_power_column, irradiance_column = \
+        get_power_columns(inverter_data, inverter, schema)
+
+    if clipped_power is None:
+        clipped_power = get_clipped_power(inverter_data, maxexport_capacity_ac, expected_power_column,
+                                          ideal_power_column)
+    clipped_expected_power, clipped_ideal_power = clipped_power
+
+    corrected_energy_df = calculate_energy_per_period(inverter_data, 'Day', days_under_analysis,
+                                                      [ac_power_column, expected_power_column, ideal_power_column,
+                                                       irradiance_column],
+                                                      clipped_power={expected_power_column: clipped_expected_power,
+                                                                     ideal_power_column: clipped_ideal_power},
+                                                      datapoints_mask=inverter_data[ac_power_column] > 0,
+                                                      calendar_index=calendar_index)
+
+    corrected_df = pd.DataFrame(
+        {str(inverter) + ' - DC focus - Corrected PR %': corrected_energy_df[ac_power_column] / corrected_energy_df[
+            ideal_power_column],
+         irradiance_column: corrected_energy_df[irradiance_column]})
     # print(df)
 
     return corrected_df, irradiance_column
 
 
-def calculate_monthly_raw_pr(inverter_data, months_under_analysis, inverter):
+def calculate_monthly_raw_pr(inverter_data, months_under_analysis, inverter, schema=None, calendar_index=None):
     """From Inverter data (Power AC, Expected Power and Max export capacity ) calculates Corrected PR
         Corrected PR, in this case, is the correction for inverter failures (focus on DC side) and with max export capacity in place
         Also uses irradiance to complete Dataframe"""
 
-    ac_power_column = inverter_data.columns[inverter_data.columns.str.contains('AC')].values[0]
-    expected_power_column = inverter_data.columns[inverter_data.columns.str.contains('Expected')].values[0]
-    ideal_power_column = inverter_data.columns[inverter_data.columns.str.contains('Ideal')].values[0]
-    irradiance_column = inverter_data.columns[inverter_data.columns.str.contains('Irradiance')].values[0]
-
-    raw_monthly_pr_dict = {}
-    raw_powers_dict_forsite = {}
-
-    for month in months_under_analysis:
-        raw_data_month = inverter_data.loc[inverter_data['Month'] == month]
-        raw_actual_power_month = raw_data_month[ac_power_column].sum() / 4
-        raw_expected_power_month = raw_data_month[expected_power_column].sum() / 4
-        raw_ideal_power_month = raw_data_month[ideal_power_column].sum() / 4
+    ac_power_column, expected_power_column, ideal_power_column, irradiance_column = \
+        get_power_columns(inverter_data, inverter, schema)
 
-        irradiance_month = raw_data_month[irradiance_column].sum() / 4
+    raw_energy_df = calculate_energy_per_period(inverter_data, 'Month', months_under_analysis,
+                                                [ac_power_column, expected_power_column, ideal_power_column,
+                                                 irradiance_column],
+                                                calendar_index=calendar_index)
 
-        raw_pr_month = raw_actual_power_month / raw_ideal_power_month
-        raw_monthly_pr_dict[month] = (raw_pr_month, irradiance_month)
-        raw_powers_dict_forsite[month] = (raw_actual_power_month, raw_expected_power_month, raw_ideal_power_month)
-
-    raw_monthly_pr_df = pd.DataFrame.from_dict(raw_monthly_pr_dict, orient='index', columns=[
-        str(inverter) + ' Raw Monthly PR %', irradiance_column])
-    raw_monthly_production_df = pd.DataFrame.from_dict(raw_powers_dict_forsite,
-                                                       orient='index',
-                                                       columns=[ac_power_column, expected_power_column,
-                                                                ideal_power_column])
+    raw_monthly_pr_df = pd.DataFrame(
+        {str(inverter) + ' Raw Monthly PR %': raw_energy_df[ac_power_column] / raw_energy_df[ideal_power_column],
+         irradiance_column: raw_energy_df[irradiance_column]})
+    raw_monthly_production_df = raw_energy_df[[ac_power_column, expected_power_column, ideal_power_column]]
     # print(df)
 
     return raw_monthly_pr_df, raw_monthly_production_df, irradiance_column
 
 
 def calculate_monthly_corrected_pr_and_production_focusDC(inverter_data, months_under_analysis, inverter,
-                                                          maxexport_capacity_ac):
+                                                          maxexport_capacity_ac, schema=None, calendar_index=None,
+                                                          clipped_power=None):
     """From Inverter data (Power AC, Expected Power and Max export capacity ) calculates Corrected PR
         Corrected PR, in this case, is the correction for inverter failures (focus on DC side) and with max export capacity in place
         Also uses irradiance to complete Dataframe"""
 
-    ac_power_column = inverter_data.columns[inverter_data.columns.str.contains('AC')].values[0]
-    expected_power_column = inverter_data.columns[inverter_data.columns.str.contains('Expected')].values[0]
-    ideal_power_column = inverter_data.columns[inverter_data.columns.str.contains('Ideal')].values[0]
-    irradiance_column = inverter_data.columns[inverter_data.columns.str.contains('Irradiance')].values[0]
-
-    corrected_power_data = inverter_data.loc[inverter_data[ac_power_column] > 0]
-    corrected_power_data[expected_power_column] = [maxexport_capacity_ac if power > maxexport_capacity_ac else power for
-                                                   power in
-                                                   corrected_power_data[expected_power_column]]
-    corrected_power_data[ideal_power_column] = [maxexport_capacity_ac if power > maxexport_capacity_ac else power for
-                                                power in corrected_power_data[ideal_power_column]]
-
-    corrected_monthly_pr_dict = {}
-    corrected_powers_dict_forsite = {}
-
-    for month in months_under_analysis:
-        corrected_data_month = corrected_power_data.loc[corrected_power_data['Month'] == month]
-        corrected_actual_power_month = corrected_data_month[ac_power_column].sum() / 4
-        corrected_expected_power_month = corrected_data_month[expected_power_column].sum() / 4
-        corrected_ideal_power_month = corrected_data_month[ideal_power_column].sum() / 4
-
-        irradiance_month = corrected_data_month[irradiance_column].sum() / 4
-
-        corrected_pr_month = corrected_actual_power_month / corrected_ideal_power_month
-        corrected_monthly_pr_dict[month] = (corrected_pr_month, irradiance_month)
-        corrected_powers_dict_forsite[month] = (
-            corrected_actual_power_month, corrected_expected_power_month, corrected_ideal_power_month)
-
-    corrected_monthly_pr_df = pd.DataFrame.from_dict(corrected_monthly_pr_dict, orient='index', columns=[
-        str(inverter) + ' Corrected (w/clipping) Monthly PR %', irradiance_column])
-    corrected_monthly_production_df = pd.DataFrame.from_dict(corrected_powers_dict_forsite, orient='index',
-                                                             columns=[ac_power_column,
-                                                                      expected_power_column, ideal_power_column])
+    ac_power_column, expected_power_column, ideal_power_column, irradiance_column = \
+        get_power_columns(inverter_data, inverter, schema)
+
+    if clipped_power is None:
+        clipped_power = get_clipped_power(inverter_data, maxexport_capacity_ac, expected_power_column,
+                                          ideal_power_column)
+    clipped_expected_power, clipped_ideal_power = clipped_power
+
+    corrected_energy_df = calculate_energy_per_period(inverter_data, 'Month', months_under_analysis,
+                                                      [ac_power_column, expected_power_column, ideal_power_column,
+                                                       irradiance_column],
+                                                      clipped_power={expected_power_column: clipped_expected_power,
+                                                                     ideal_power_column: clipped_ideal_power},
+                                                      datapoints_mask=inverter_data[ac_power_column] > 0,
+                                                      calendar_index=calendar_index)
+
+    corrected_monthly_pr_df = pd.DataFrame(
+        {str(inverter) + ' Corrected (w/clipping) Monthly PR %': corrected_energy_df[ac_power_column] /
+                                                                 corrected_energy_df[ideal_power_column],
+         irradiance_column: corrected_energy_df[irradiance_column]})
+    corrected_monthly_production_df = corrected_energy_df[[ac_power_column, expected_power_column,
+                                                           ideal_power_column]]
     # print(df)
 
     return corrected_monthly_pr_df, corrected_monthly_production_df, irradiance_column
 
 
-def calculate_monthly_corrected_pr_and_production(inverter_data, months_under_analysis, inverter, capacity_ac):
+def calculate_monthly_corrected_pr_and_production(inverter_data, months_under_analysis, inverter, capacity_ac,
+                                                  schema=None, calendar_index=None, clipped_power=None):
     """From Inverter data (Power AC, Expected Power and Max export capacity ) calculates Corrected PR
         Corrected PR, in this case, is the correction for inverter failures (focus on DC side) and with max export capacity in place
         Also uses irradiance to complete Dataframe"""
 
-    ac_power_column = inverter_data.columns[inverter_data.columns.str.contains('AC')].values[0]
-    expected_power_column = inverter_data.columns[inverter_data.columns.str.contains('Expected')].values[0]
-    ideal_power_column = inverter_data.columns[inverter_data.columns.str.contains('Ideal')].values[0]
-    irradiance_column = inverter_data.columns[inverter_data.columns.str.contains('Irradiance')].values[0]
-
-    corrected_power_data = inverter_data
-    corrected_power_data[expected_power_column] = [capacity_ac if power > capacity_ac else power for power in
-                                                   corrected_power_data[expected_power_column]]
-    corrected_power_data[ideal_power_column] = [capacity_ac if power > capacity_ac else power for power in
-                                                corrected_power_data[ideal_power_column]]
-
-    corrected_monthly_pr_dict = {}
-    corrected_powers_dict_forsite = {}
-
-    for month in months_under_analysis:
-        corrected_data_month = corrected_power_data.loc[corrected_power_data['Month'] == month]
-        corrected_actual_power_month = corrected_data_month[ac_power_column].sum() / 4
-        corrected_expected_power_month = corrected_data_month[expected_power_column].sum() / 4
-        corrected_ideal_power_month = corrected_data_month[ideal_power_column].sum() / 4
-
-        irradiance_month = corrected_data_month[irradiance_column].sum() / 4
-
-        corrected_pr_month = corrected_actual_power_month / corrected_ideal_power_month
-        corrected_monthly_pr_dict[month] = (corrected_pr_month, irradiance_month)
-        corrected_powers_dict_forsite[month] = (
-            corrected_actual_power_month, corrected_expected_power_month, corrected_ideal_power_month)
-
-    corrected_monthly_pr_df = pd.DataFrame.from_dict(corrected_monthly_pr_dict, orient='index', columns=[
-        str(inverter) + ' Corrected (w/clipping) Monthly PR %', irradiance_column])
-    corrected_monthly_production_df = pd.DataFrame.from_dict(corrected_powers_dict_forsite,
-                                                             orient='index',
-                                                             columns=[ac_power_column, expected_power_column,
-                                                                      ideal_power_column])
+    ac_power_column, expected_power_column, ideal_power_column, irradiance_column = \
+        get_power_columns(inverter_data, inverter, schema)
+
+    if clipped_power is None:
+        clipped_power = get_clipped_power(inverter_data, capacity_ac, expected_power_column, ideal_power_column)
+    clipped_expected_power, clipped_ideal_power = clipped_power
+
+    corrected_energy_df = calculate_energy_per_period(inverter_data, 'Month', months_under_analysis,
+                                                      [ac_power_column, expected_power_column, ideal_power_column,
+                                                       irradiance_column],
+                                                      clipped_power={expected_power_column: clipped_expected_power,
+                                                                     ideal_power_column: clipped_ideal_power},
+                                                      calendar_index=calendar_index)
+
+    corrected_monthly_pr_df = pd.DataFrame(
+        {str(inverter) + ' Corrected (w/clipping) Monthly PR %': corrected_energy_df[ac_power_column] /
+                                                                 corrected_energy_df[ideal_power_column],
+         irradiance_column: corrected_energy_df[irradiance_column]})
+    corrected_monthly_production_df = corrected_energy_df[[ac_power_column, expected_power_column,
+                                                           ideal_power_column]]
     # print(df)
 
     return corrected_monthly_pr_df, corrected_monthly_production_df, irradiance_column
 
 
+def calculate_pr_inverter(power_data, inverter, site_info, pr_type: str = 'raw', granularity: str = 'daily',
+                          schema=None, calendar_index=None):
+    """Calculates PR of one inverter for the chosen PR type and granularity.
+    Returns the PR Dataframe, the production Dataframe (None for daily granularity) and the irradiance column"""
+
+    days_under_analysis = site_info['Days']
+    months_under_analysis = site_info['Months']
+
+    # Inverters with the same timestamps share one calendar index, no Day/Month columns are added to power_data
+    if calendar_index is None:
+        calendar_index = site_calendar.get_calendar_index(power_data['Timestamp'])
+
+    if pr_type != 'raw':
+        maxexport_capacity_ac = float(
+            site_info['Component Info'].loc[site_info['Component Info']['Component'] == inverter][
+                'Capacity AC'].values) * 1.001
+
+        # Clipped once per call from the current power data, shared by the corrected PR functions
+        _, expected_power_column, ideal_power_column, _ = get_power_columns(power_data, inverter, schema)
+        clipped_power = get_clipped_power(power_data, maxexport_capacity_ac, expected_power_column,
+                                          ideal_power_column)
+
+    powers_df_forsite_inv = None
+
+    with instrumentation.span('calculate_pr_inverter', inverter=inverter, rows=len(power_data),
+                              pr_type=pr_type, granularity=granularity):
+        if pr_type == 'raw' and granularity == 'daily':
+            logger.debug('Calculating raw daily PR of ' + str(inverter))
+            pr_df_inverter, irradiance_column = calculate_daily_raw_pr(power_data, days_under_analysis, inverter,
+                                                                       schema, calendar_index)
+
+        elif pr_type == 'corrected' and granularity == 'daily':
+            logger.debug('Max export capacity AC of ' + str(inverter) + ': ' + str(maxexport_capacity_ac))
+            pr_df_inverter, irradiance_column = calculate_daily_corrected_pr(power_data, days_under_analysis, inverter,
+                                                                             maxexport_capacity_ac, schema,
+                                                                             calendar_index, clipped_power)
+
+        elif pr_type == 'corrected_DCfocus' and granularity == 'daily':
+            pr_df_inverter, irradiance_column = calculate_daily_corrected_pr_focusDC(power_data, days_under_analysis,
+                                                                                     inverter, maxexport_capacity_ac,
+                                                                                     schema, calendar_index,
+                                                                                     clipped_power)
+
+        elif pr_type == 'raw' and granularity == 'monthly':
+            pr_df_inverter, powers_df_forsite_inv, irradiance_column = calculate_monthly_raw_pr(power_data,
+                                                                                                months_under_analysis,
+                                                                                                inverter, schema,
+                                                                                                calendar_index)
+
+        elif pr_type == 'corrected' and granularity == 'monthly':
+            pr_df_inverter, powers_df_forsite_inv, irradiance_column = \
+                calculate_monthly_corrected_pr_and_production(power_data, months_under_analysis, inverter,
+                                                              maxexport_capacity_ac, schema, calendar_index,
+                                                              clipped_power)
+
+        else:
+            pr_df_inverter, powers_df_forsite_inv, irradiance_column = \
+                calculate_monthly_corrected_pr_and_production_focusDC(power_data, months_under_analysis, inverter,
+                                                                      maxexport_capacity_ac, schema, calendar_index,
+                                                                      clipped_power)
+
+    return pr_df_inverter, powers_df_forsite_inv, irradiance_column
+
+
 def calculate_pr_inverters(inverter_list, all_inverter_power_data_dict, site_info, general_info,
-                           pr_type: str = 'raw', granularity: str = 'daily'):
+                           pr_type: str = 'raw', granularity: str = 'daily', workers: int = None, executor=None,
+                           schema=None, energy_cache=None):
+    """Calculates PR of all inverters in inverter_list, and site PR for monthly granularity.
+    With workers or an executor, inverters are calculated in a process pool with their power data in shared memory,
+    results are the same as the serial calculation and keep the order of inverter_list.
+    schema (PowerDataSchema) gives the power data columns, if None they are resolved once by name matching.
+    With an energy_cache (EnergyCache) the energy sums of months already calculated are read from disk"""
+
     possible_prs = ['raw', 'corrected', 'corrected_DCfocus']
     possible_gran = ['daily', 'monthly']
 
     if pr_type not in possible_prs:
-        print('Possible PR types: ' + str(possible_prs) + "\n Your input: " + str(pr_type))
-        print('Please try again. :)')
+        logger.error('Possible PR types: ' + str(possible_prs) + ", your input: " + str(pr_type))
         sys.exit()
 
     if granularity not in possible_gran:
-        print('Possible PR types: ' + str(possible_gran) + "\n Your input: " + str(granularity))
-        print('Please try again. :)')
+        logger.error('Possible granularities: ' + str(possible_gran) + ", your input: " + str(granularity))
         sys.exit()
 
-    days_under_analysis = site_info['Days']
-    months_under_analysis = site_info['Months']
-
-    if pr_type == 'raw' and granularity == 'daily':
-        for inverter in inverter_list:
-            print(inverter)
-            power_data = all_inverter_power_data_dict[inverter]['Power Data']
-            power_data['Day'] = pd.to_datetime(power_data['Timestamp']).dt.date
-            power_data['Month'] = pd.to_datetime(power_data['Timestamp']).dt.month
+    with instrumentation.span('calculate_pr_inverters', inverters=len(inverter_list), pr_type=pr_type,
+                              granularity=granularity, workers=workers):
+        if schema is None:
+            schema = data_schema.PowerDataSchema.from_power_data_dict(inverter_list, all_inverter_power_data_dict)
+
+        if energy_cache is not None:
+            energy, periods = energy_cache.get_site_energy(inverter_list, all_inverter_power_data_dict, site_info,
+                                                           pr_type, granularity, schema)
+            power_columns = {inverter: schema.get_columns(inverter) for inverter in inverter_list}
+
+            return build_pr_tables(energy, periods, inverter_list, power_columns, pr_type, granularity)
+
+        if workers is None and executor is None:
+            inverter_results = [calculate_pr_inverter(all_inverter_power_data_dict[inverter]['Power Data'], inverter,
+                                                      site_info, pr_type, granularity, schema)
+                                for inverter in inverter_list]
+        else:
+            inverter_results = parallel.calculate_pr_inverters_in_pool(inverter_list, all_inverter_power_data_dict,
+                                                                       site_info, pr_type, granularity, workers,
+                                                                       executor, schema)
+
+        # Results of each inverter are joined once, the first inverter keeps the irradiance column
+        pr_dfs_inverters = []
+        powers_dfs_forsite = []
+        for pr_df_inverter, powers_df_forsite_inv, irradiance_column in inverter_results:
+            if pr_dfs_inverters:
+                pr_df_inverter = pr_df_inverter.drop(columns=irradiance_column)
+            pr_dfs_inverters.append(pr_df_inverter)
+            powers_dfs_forsite.append(powers_df_forsite_inv)
+
+        pr_df = pd.concat(pr_dfs_inverters, axis=1)
+
+        if granularity == 'daily':
+            return pr_df
 
-            maxexport_capacity_ac = float(
-                site_info['Component Info'].loc[site_info['Component Info']['Component'] == inverter][
-                    'Capacity AC'].values) * 1.001
+        # Add site wide results
+        powers_df_forsite = pd.concat(powers_dfs_forsite, axis=1)
+        pr_df = add_site_pr(pr_df, powers_df_forsite, schema.get_site_columns('ac', inverter_list),
+                            schema.get_site_columns('ideal', inverter_list))
 
-            daily_pr_df_inverter, irradiance_column = calculate_daily_raw_pr(power_data, days_under_analysis, inverter)
+        if pr_type == 'corrected_DCfocus':
+            return pr_df, powers_df_forsite
 
-            try:
-                df_to_add = daily_pr_df_inverter.drop(columns=irradiance_column)
-                daily_pr_df = pd.concat([daily_pr_df, df_to_add], axis=1)
+        return pr_df
 
-            except NameError:
-                daily_pr_df = daily_pr_df_inverter
 
-        return daily_pr_df
+def add_site_pr(pr_df, powers_df_forsite, ac_power_columns, ideal_power_columns):
+    """Adds Site PR, from the sum of the production of all inverters, before the last column of the PR Dataframe"""
 
-    elif pr_type == 'corrected' and granularity == 'daily':
-        for inverter in inverter_list:
-            # print(inverter)
-            power_data = all_inverter_power_data_dict[inverter]['Power Data']
-            power_data['Day'] = pd.to_datetime(power_data['Timestamp']).dt.date
-            power_data['Month'] = pd.to_datetime(power_data['Timestamp']).dt.month
+    ac_power_results = powers_df_forsite.loc[:, powers_df_forsite.columns.isin(ac_power_columns)]
+    ideal_power_results = powers_df_forsite.loc[:, powers_df_forsite.columns.isin(ideal_power_columns)]
 
-            maxexport_capacity_ac = float(
-                site_info['Component Info'].loc[site_info['Component Info']['Component'] == inverter][
-                    'Capacity AC'].values) * 1.001
-            print(maxexport_capacity_ac)
-            daily_corrected_pr_df_inverter, irradiance_column = calculate_daily_corrected_pr(power_data,
-                                                                                             days_under_analysis,
-                                                                                             inverter,
-                                                                                             maxexport_capacity_ac)
+    site_pr = ac_power_results.sum(axis=1) / ideal_power_results.sum(axis=1)
+    pr_df.insert(len(pr_df.columns) - 1, 'Site PR %', site_pr)
 
-            try:
-                corrected_df_to_add = daily_corrected_pr_df_inverter.drop(columns=irradiance_column)
-                corrected_daily_pr_df = pd.concat([corrected_daily_pr_df, corrected_df_to_add], axis=1)
+    return pr_df
 
-            except NameError:
-                corrected_daily_pr_df = daily_corrected_pr_df_inverter
 
-        return corrected_daily_pr_df
+def build_pr_tables(energy, periods, inverter_list, power_columns, pr_type: str = 'raw',
+                    granularity: str = 'daily'):
+    """From the energy of all inverters per period, as an array with shape (periods, inverters, quantities) with
+    quantities AC, Expected, Ideal and Irradiance, builds the same tables as calculate_pr_inverters.
+    power_columns has the (ac, expected, ideal, irradiance) columns of each inverter"""
 
-    elif pr_type == 'corrected_DCfocus' and granularity == 'daily':
-        for inverter in inverter_list:
-            # print(inverter)
-            power_data = all_inverter_power_data_dict[inverter]['Power Data']
-            power_data['Day'] = pd.to_datetime(power_data['Timestamp']).dt.date
-            power_data['Month'] = pd.to_datetime(power_data['Timestamp']).dt.month
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pr_inverters = energy[:, :, 0] / energy[:, :, 2]
 
-            maxexport_capacity_ac = float(
-                site_info['Component Info'].loc[site_info['Component Info']['Component'] == inverter][
-                    'Capacity AC'].values) * 1.001
-
-            dcfocus_corrected_df, irradiance_column = calculate_daily_corrected_pr_focusDC(power_data,
-                                                                                           days_under_analysis,
-                                                                                           inverter,
-                                                                                           maxexport_capacity_ac)
+    # Same layout as calculate_pr_inverters, the irradiance of the first inverter follows its PR
+    pr_columns = {}
+    for i, inverter in enumerate(inverter_list):
+        pr_columns[str(inverter) + pr_column_suffixes[granularity][pr_type]] = pr_inverters[:, i]
+        if i == 0:
+            pr_columns[power_columns[inverter][3]] = energy[:, 0, 3]
 
-            try:
-                dcfocus_corrected_df_to_add = dcfocus_corrected_df.drop(columns=irradiance_column)
-                dcfocus_corrected_daily_pr_df = pd.concat([dcfocus_corrected_daily_pr_df, dcfocus_corrected_df_to_add],
-                                                          axis=1)
+    pr_df = pd.DataFrame(pr_columns, index=periods)
 
-            except NameError:
-                dcfocus_corrected_daily_pr_df = dcfocus_corrected_df
-        return dcfocus_corrected_daily_pr_df
-    elif pr_type == 'raw' and granularity == 'monthly':
+    if granularity == 'daily':
+        return pr_df
 
-        for inverter in inverter_list:
-            # print(inverter)
-            power_data = all_inverter_power_data_dict[inverter]['Power Data']
-            power_data['Day'] = pd.to_datetime(power_data['Timestamp']).dt.date
-            power_data['Month'] = pd.to_datetime(power_data['Timestamp']).apply(lambda x: x.strftime('%m-%Y'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        site_pr = energy[:, :, 0].sum(axis=1) / energy[:, :, 2].sum(axis=1)
+    pr_df.insert(len(pr_df.columns) - 1, 'Site PR %', site_pr)
 
-            raw_df_month, raw_powers_df_forsite_inv, irradiance_column = calculate_monthly_raw_pr(power_data,
-                                                                                                  months_under_analysis,
-                                                                                                  inverter)
+    if pr_type == 'corrected_DCfocus':
+        production_columns = [column for inverter in inverter_list for column in power_columns[inverter][:3]]
+        powers_df_forsite = pd.DataFrame(energy[:, :, :3].reshape(len(periods), -1), index=periods,
+                                         columns=production_columns)
 
-            try:
-                dcfocus_corrected_df_to_add = raw_df_month.drop(columns=irradiance_column)
-                raw_daily_pr_df = pd.concat([raw_daily_pr_df, dcfocus_corrected_df_to_add],
-                                            axis=1)
+        return pr_df, powers_df_forsite
 
-            except NameError:
-                raw_daily_pr_df = raw_df_month
+    return pr_df
 
-            try:
-                raw_powers_df_forsite = pd.concat(
-                    [raw_powers_df_forsite, raw_powers_df_forsite_inv], axis=1)
 
-            except NameError:
-                print('Creating dataframe with all inverters')
-                raw_powers_df_forsite = raw_powers_df_forsite_inv
+def calculate_all_pr_inverters(inverter_list, all_inverter_power_data_dict, site_info, general_info, schema=None):
+    """Calculates raw, corrected and DC focus corrected PR, daily and monthly, with one pass over the power data
+    of each inverter. Timestamps are parsed once, Expected and Ideal power are clipped once and all energy sums of
+    a granularity come from a single aggregation. The input data is not changed.
 
-        # Add site wide results
-        ac_power_results = raw_powers_df_forsite.loc[:, raw_powers_df_forsite.columns.str.contains('Inverter AC')]
-        ac_power_results['Site'] = [ac_power_results.loc[i, :].sum() for i in ac_power_results.index]
+    Returns two dictionaries, PR and production, as {granularity: {pr_type: Dataframe}}. PR tables are the same as
+    returned by calculate_pr_inverters for each pr_type and granularity (monthly tables include Site PR %)"""
 
-        ideal_power_results = raw_powers_df_forsite.loc[:, raw_powers_df_forsite.columns.str.contains('Ideal')]
-        ideal_power_results['Site'] = [ideal_power_results.loc[i, :].sum() for i in
-                                       ideal_power_results.index]
+    pr_types = ['raw', 'corrected', 'corrected_DCfocus']
+    periods_under_analysis = {'daily': site_info['Days'], 'monthly': site_info['Months']}
 
-        site_pr = ac_power_results['Site'] / ideal_power_results['Site']
+    pr_tables = {granularity: {pr_type: [] for pr_type in pr_types} for granularity in periods_under_analysis}
+    production_tables = {granularity: {pr_type: [] for pr_type in pr_types} for granularity in periods_under_analysis}
 
-        raw_daily_pr_df.insert(len(raw_daily_pr_df.columns) - 1, 'Site PR %',
-                               site_pr)
+    if schema is None:
+        schema = data_schema.PowerDataSchema.from_power_data_dict(inverter_list, all_inverter_power_data_dict)
 
-        return raw_daily_pr_df
+    for inverter in inverter_list:
+        power_data = all_inverter_power_data_dict[inverter]['Power Data']
 
-    elif pr_type == 'corrected' and granularity == 'monthly':
-        for inverter in inverter_list:
-            # print(inverter)
-            power_data = all_inverter_power_data_dict[inverter]['Power Data']
-            power_data['Day'] = pd.to_datetime(power_data['Timestamp']).dt.date
-            power_data['Month'] = pd.to_datetime(power_data['Timestamp']).apply(lambda x: x.strftime('%m-%Y'))
+        with instrumentation.span('calculate_all_pr_inverter', inverter=inverter, rows=len(power_data)):
+            ac_power_column, expected_power_column, ideal_power_column, irradiance_column = \
+                schema.get_columns(inverter, power_data)
 
             maxexport_capacity_ac = float(
                 site_info['Component Info'].loc[site_info['Component Info']['Component'] == inverter][
-                    'Capacity AC'].values) * 1.001
+                    'Capacity AC'].values[0]) * 1.001
 
-            corrected_df_month, corrected_powers_df_forsite_inv, irradiance_column = \
-                calculate_monthly_corrected_pr_and_production(power_data, months_under_analysis,
-                                                              inverter, maxexport_capacity_ac)
+            calendar_index = site_calendar.get_calendar_index(power_data['Timestamp'])
+            interval_hours = calendar_index.get_interval_hours()
+            period_columns = {'daily': 'Day', 'monthly': 'Month'}
 
-            try:
-                corrected_df_to_add_month = corrected_df_month.drop(columns=irradiance_column)
-                corrected_monthly_pr_df = pd.concat(
-                    [corrected_monthly_pr_df, corrected_df_to_add_month], axis=1)
+            clipped_power = get_clipped_power(power_data, maxexport_capacity_ac, expected_power_column,
+                                              ideal_power_column)
+            values = power_data[[ac_power_column, expected_power_column, ideal_power_column,
+                                 irradiance_column]].to_numpy(dtype=float)
 
-            except NameError:
-                corrected_monthly_pr_df = corrected_df_month
+            # Columns of all PR types: raw, corrected (clipped) and DC focus (clipped, only where AC > 0)
+            all_values = stack_pr_type_values(values, maxexport_capacity_ac, clipped_power)
 
-            try:
-                corrected_powers_df_forsite = pd.concat(
-                    [corrected_powers_df_forsite, corrected_powers_df_forsite_inv], axis=1)
+            for granularity, periods in periods_under_analysis.items():
+                period_codes, unique_periods = calendar_index.get_period_codes(period_columns[granularity], periods)
+                all_energy = sum_per_period(all_values, period_codes, len(unique_periods), interval_hours)
 
-            except NameError:
-                print('Creating dataframe with all inverters')
-                corrected_powers_df_forsite = corrected_powers_df_forsite_inv
+                for i, pr_type in enumerate(pr_types):
+                    energy_df = pd.DataFrame(all_energy[:, 4 * i:4 * i + 4], index=unique_periods,
+                                             columns=[ac_power_column, expected_power_column, ideal_power_column,
+                                                      irradiance_column])
 
-            # Add site wide results
-        ac_power_results = corrected_powers_df_forsite.loc[
-                           :, corrected_powers_df_forsite.columns.str.contains('Inverter AC')]
+                    pr_df = pd.DataFrame(
+                        {str(inverter) + pr_column_suffixes[granularity][pr_type]: energy_df[ac_power_column] /
+                                                                                   energy_df[ideal_power_column],
+                         irradiance_column: energy_df[irradiance_column]})
 
-        ac_power_results['Site'] = [ac_power_results.loc[i, :].sum() for i in ac_power_results.index]
+                    if pr_tables[granularity][pr_type]:
+                        pr_df = pr_df.drop(columns=irradiance_column)
 
-        ideal_power_results = corrected_powers_df_forsite.loc[
-                              :, corrected_powers_df_forsite.columns.str.contains('Ideal')]
+                    pr_tables[granularity][pr_type].append(pr_df)
+                    production_tables[granularity][pr_type].append(
+                        energy_df[[ac_power_column, expected_power_column, ideal_power_column]])
 
-        ideal_power_results['Site'] = [ideal_power_results.loc[i, :].sum() for i in ideal_power_results.index]
+    all_pr_results = {}
+    all_production_results = {}
+    for granularity in periods_under_analysis:
+        all_pr_results[granularity] = {}
+        all_production_results[granularity] = {}
 
-        site_pr = ac_power_results['Site'] / ideal_power_results['Site']
+        for pr_type in pr_types:
+            pr_df = pd.concat(pr_tables[granularity][pr_type], axis=1)
+            powers_df_forsite = pd.concat(production_tables[granularity][pr_type], axis=1)
 
-        corrected_monthly_pr_df.insert(len(corrected_monthly_pr_df.columns) - 1, 'Site PR %',
-                                       site_pr)
+            if granularity == 'monthly':
+                pr_df = add_site_pr(pr_df, powers_df_forsite, schema.get_site_columns('ac', inverter_list),
+                                    schema.get_site_columns('ideal', inverter_list))
 
-        return corrected_monthly_pr_df
+            all_pr_results[granularity][pr_type] = pr_df
+            all_production_results[granularity][pr_type] = powers_df_forsite
 
-    elif pr_type == 'corrected_DCfocus' and granularity == 'monthly':
-        for inverter in inverter_list:
-            # print(inverter)
-            power_data = all_inverter_power_data_dict[inverter]['Power Data']
-            power_data['Day'] = pd.to_datetime(power_data['Timestamp']).dt.date
-            power_data['Month'] = pd.to_datetime(power_data['Timestamp']).apply(lambda x: x.strftime('%m-%Y'))
-
-            maxexport_capacity_ac = float(
-                site_info['Component Info'].loc[site_info['Component Info']['Component'] == inverter][
-                    'Capacity AC'].values) * 1.001
-
-            dcfocus_corrected_df_month, dcfocus_corrected_powers_df_forsite_inv, irradiance_column = \
-                calculate_monthly_corrected_pr_and_production_focusDC(power_data, months_under_analysis,
-                                                                      inverter, maxexport_capacity_ac)
-
-            try:
-                dcfocus_corrected_df_to_add_month = dcfocus_corrected_df_month.drop(columns=irradiance_column)
-                dcfocus_corrected_monthly_pr_df = pd.concat(
-                    [dcfocus_corrected_monthly_pr_df, dcfocus_corrected_df_to_add_month], axis=1)
-
-            except NameError:
-                dcfocus_corrected_monthly_pr_df = dcfocus_corrected_df_month
-
-            try:
-                dcfocus_corrected_powers_df_forsite = pd.concat(
-                    [dcfocus_corrected_powers_df_forsite, dcfocus_corrected_powers_df_forsite_inv], axis=1)
-
-            except NameError:
-                dcfocus_corrected_powers_df_forsite = dcfocus_corrected_powers_df_forsite_inv
-
-        # Add site wide results
-        ac_power_results = dcfocus_corrected_powers_df_forsite.loc[:,
-                           dcfocus_corrected_powers_df_forsite.columns.str.contains('Inverter AC')]
-        ac_power_results['Site'] = [ac_power_results.loc[i, :].sum() for i in ac_power_results.index]
-
-        ideal_power_results = dcfocus_corrected_powers_df_forsite.loc[:, dcfocus_corrected_powers_df_forsite.
-                                                                             columns.str.contains('Ideal')]
-        ideal_power_results['Site'] = [ideal_power_results.loc[i, :].sum() for i in
-                                       ideal_power_results.index]
-
-        site_pr = ac_power_results['Site'] / ideal_power_results['Site']
-
-        dcfocus_corrected_monthly_pr_df.insert(len(dcfocus_corrected_monthly_pr_df.columns) - 1, 'Site PR %',
-                                               site_pr)
-
-        return dcfocus_corrected_monthly_pr_df, dcfocus_corrected_powers_df_forsite
-
-    else:
-        print('Combination of PR type and granularity not possible')
-        sys.exit()
-
-    return
+    return all_pr_results, all_production_results
 
 # </editor-fold>
 
 # <editor-fold desc="Summaries">
 
-def get_events_summary_per_fault_component(components_to_analyse, inverter_incidents_site, inverter_operation,
-                                           df_operation_hours):
-    unit_failure_dict = {}
-    events_summary_dict = {}
-    count = 0
-
-    for unit in inverter_operation.keys():
-
-        # From unit get component, aka, Inv 01.r2 --> Inv 01
-        try:
-            component = unit.replace(re.search(r'\.r\d*', unit).group(), "")
-        except AttributeError:
-            component = unit
-
-        # Get unit incidents
-        unit_incidents = inverter_incidents_site.loc[inverter_incidents_site['Unit Component'] == unit]
-        # print(unit_incidents)
-
-        unit_age = \
-            df_operation_hours.loc[df_operation_hours['Timestamp'] == inverter_operation[unit][1]][component].values[0]
-        # print(unit, unit_age)
-
-        # Get last time of operation from timestamp, if time empty, look for last datapoint
-        changed = False
-        while np.isnan(unit_age):
-            rounded_incident_time = rounded_incident_time - pd.Timedelta(minutes=15)
-            incident_operation_time = \
-                df_operation_hours.loc[df_operation_hours['Timestamp'] == rounded_incident_time][component].values[0]
-            changed = True
-        if changed is True:
-            print("Changed rounded time to forward timestamp because backward was NaN, new timestamp: ",
-                  rounded_incident_time)
-
-        # From original dataframe, reduce to dataframe with required data
-        components_failed = list(set(unit_incidents['Fault Component']))
-        events_summary = unit_incidents[['Unit Component', 'Fault Component', 'Event Start Time', 'Operation Time']]
-        events_summary['Time to Failure'] = ""
-        events_summary['Failure'] = "Yes"
-
-        # Add last entries of dataframe, aka, hours of operation at the last point of analysis
-        end_of_analysis_entries = pd.DataFrame({'Unit Component': [unit] * len(components_to_analyse),
-                                                'Fault Component': components_to_analyse,
-                                                'Event Start Time': [inverter_operation[unit][1]] * len(
-                                                    components_to_analyse),
-                                                'Operation Time': [unit_age] * len(components_to_analyse),
-                                                'Time to Failure': [""] * len(components_to_analyse),
-                                                'Failure': ['No'] * len(components_to_analyse)})
-
-        # Get complete events summary
-        events_summary = pd.concat([events_summary, end_of_analysis_entries]).sort_values(
-            by=['Event Start Time', 'Fault Component']).reset_index(None, drop=True)
-        events_summary = events_summary.loc[
-            ~(events_summary['Fault Component'] == "Phase Fuse") & ~(events_summary['Fault Component'] == "Unknown")]
-
-        print(events_summary)
-        print("\n")
-
-        print(components_failed)
-        # Separate multiple components incidents to calculate spare parts
-        for failed_component in components_failed:
-            if ";" in failed_component:
-                incidents_to_split = events_summary.loc[events_summary['Fault Component'] == failed_component]
-                index_incidents_to_split = incidents_to_split.index
-                actual_components = failed_component.split(';')
-                n_repeats = len(actual_components)
-
-                splitted_incidents = pd.concat([incidents_to_split] * len(actual_components))
-                splitted_incidents['Fault Component'] = actual_components * len(incidents_to_split)
-                splitted_incidents = splitted_incidents.sort_values(
-                    by=['Event Start Time', 'Fault Component']).reset_index(None, drop=True)
-
-                events_summary = pd.concat(
-                    [events_summary.drop(index=index_incidents_to_split), splitted_incidents]).sort_values(
-                    by=['Event Start Time', 'Fault Component']).reset_index(None, drop=True)
-
-                """print(events_summary)
-                print(splitted_incidents)
-                print(new_events_summary)"""
+excluded_fault_components = ["Phase Fuse", "Unknown"]
 
-        # Add time to failure
-        for fault_component in components_to_analyse:
 
-            fc_events_summary = events_summary.loc[events_summary['Fault Component'] == fault_component]
-            n_incidents = len(fc_events_summary)
+def get_unit_ages(inverter_operation, operation_hours_index):
+    """Returns the operation hours of every unit at the end of its operation, from the last valid reading of its
+    component (Inv 01.r2 --> Inv 01)"""
 
-            if n_incidents == 1:
-                index_of_incident = int(fc_events_summary.index.values)
-                events_summary.loc[index_of_incident, "Time to Failure"] = fc_events_summary['Operation Time'][
-                    index_of_incident]
+    units = list(inverter_operation.keys())
+    components = [re.sub(r'\.r\d*', "", unit, count=1) for unit in units]
+    end_times = pd.DatetimeIndex([inverter_operation[unit][1] for unit in units])
 
-            else:
-                op_time = list(fc_events_summary['Operation Time'])
-                op_time_2 = list(fc_events_summary['Operation Time'])
-                op_time_2.insert(0, 0)
-                del op_time_2[-1]
+    unit_ages, _ = operation_hours_index.get_component_readings_at(components, end_times)
 
-                fc_events_summary['Time to Failure'] = [op_time_i - op_time_2_i for op_time_i, op_time_2_i in
-                                                        zip(op_time, op_time_2)]
+    return dict(zip(units, unit_ages))
 
-                for index, row in fc_events_summary.iterrows():
-                    events_summary.loc[index, "Time to Failure"] = row['Time to Failure']
 
-            fr_calc_events_summary = events_summary.loc[events_summary['Fault Component'] == fault_component]
-            n_incidents = len(fr_calc_events_summary.loc[fr_calc_events_summary['Failure'] == 'Yes'])
-            n_hours = sum(fr_calc_events_summary['Time to Failure'])
-            failure_rate = (n_incidents / n_hours) * 1000
+def get_events_summary(components_to_analyse, inverter_incidents_site, inverter_operation, df_operation_hours,
+                       operation_hours_index=None, summary_columns=None):
+    """Builds the events summary of all units at once: incidents of each unit plus one censored end of analysis
+    entry per component to analyse (Failure 'No', operation hours at the end of operation of the unit), multiple
+    component faults (e.g. 'Fan;IGBT') split into one entry per component, and Time to Failure as the operation
+    hours since the previous entry of the same unit and fault component.
 
-            # print(unit,fault_component, n_incidents, n_hours, failure_rate)
+    Returns events_summary_dict ({unit: events summary}), unit_failure_dict ({unit: {'Incidents', 'Unit Age',
+    'Events Summary'}}) and all_events_summary"""
 
-        try:
-            all_events_summary = pd.concat([all_events_summary, events_summary])
-            # sort_values(by = ['Event Start Time', 'Fault Component']).reset_index(None, drop=True)
-        except NameError:
-            all_events_summary = events_summary
+    if operation_hours_index is None:
+        operation_hours_index = operation_hours.OperationHoursIndex(df_operation_hours)
+    if summary_columns is None:
+        summary_columns = ['Unit Component', 'Fault Component', 'Event Start Time', 'Operation Time']
 
-        # print(events_summary)
+    with instrumentation.span('get_events_summary', incidents=len(inverter_incidents_site)) as summary_span:
+        units = list(inverter_operation.keys())
+        unit_ages = get_unit_ages(inverter_operation, operation_hours_index)
+        components_to_analyse = list(components_to_analyse)
 
-        # print(unit, components_failed)
+        # Incidents of the units, in the order of the units
+        unit_codes = pd.Index(units).get_indexer(inverter_incidents_site['Unit Component'])
+        in_units = unit_codes >= 0
+        unit_incidents = inverter_incidents_site.loc[in_units]
+        incident_entries = unit_incidents[summary_columns].copy()
+        incident_entries['Failure'] = "Yes"
 
-        unit_failure_dict[unit] = {'Incidents': unit_incidents, 'Unit Age': unit_age, 'Events Summary': events_summary}
-        events_summary_dict[unit] = events_summary
+        # Censored entries, one per unit and component to analyse
+        n_components = len(components_to_analyse)
+        end_of_analysis_entries = pd.DataFrame({column: [""] * (len(units) * n_components)
+                                                for column in summary_columns})
+        end_of_analysis_entries['Unit Component'] = np.repeat(units, n_components)
+        end_of_analysis_entries['Fault Component'] = components_to_analyse * len(units)
+        end_of_analysis_entries['Event Start Time'] = np.repeat(
+            pd.DatetimeIndex([inverter_operation[unit][1] for unit in units]), n_components)
+        end_of_analysis_entries['Operation Time'] = np.repeat([unit_ages[unit] for unit in units], n_components)
+        end_of_analysis_entries['Failure'] = "No"
 
-    return events_summary_dict, unit_failure_dict, all_events_summary
+        entry_unit_codes = np.concatenate([unit_codes[in_units], np.repeat(np.arange(len(units)), n_components)])
+        all_events_summary = pd.concat([incident_entries, end_of_analysis_entries], ignore_index=True)
+        all_events_summary['Unit Code'] = entry_unit_codes
 
+        all_events_summary = all_events_summary.loc[
+            ~all_events_summary['Fault Component'].isin(excluded_fault_components)]
 
-def get_events_summary_per_failure_mode(components_to_analyse, inverter_incidents_site, inverter_operation,
-                                        df_operation_hours):
-    unit_failure_dict = {}
-    events_summary_dict = {}
-    count = 0
-
-    for unit in inverter_operation.keys():
-
-        # From unit get component, aka, Inv 01.r2 --> Inv 01
-        try:
-            component = unit.replace(re.search(r'\.r\d*', unit).group(), "")
-        except AttributeError:
-            component = unit
-
-        # Get unit incidents
-        unit_incidents = inverter_incidents_site.loc[inverter_incidents_site['Unit Component'] == unit]
-        # print(unit_incidents)
-
-        unit_age = \
-            df_operation_hours.loc[df_operation_hours['Timestamp'] == inverter_operation[unit][1]][component].values[0]
-        # print(unit, unit_age)
-
-        # Get last time of operation from timestamp, if time empty, look for last datapoint
-        changed = False
-        while np.isnan(unit_age):
-            rounded_incident_time = rounded_incident_time - pd.Timedelta(minutes=15)
-            incident_operation_time = \
-                df_operation_hours.loc[df_operation_hours['Timestamp'] == rounded_incident_time][component].values[0]
-            changed = True
-        if changed == True:
-            print("Changed rounded time to forward timestamp because backward was NaN, new timestamp: ",
-                  rounded_incident_time)
-
-        # From original dataframe, reduce to dataframe with required data
-        components_failed = list(set(unit_incidents['Fault Component']))
-        events_summary = unit_incidents[
-            ['Unit Component', 'Fault Component', 'Failure Mode', 'Event Start Time', 'Operation Time']]
-        events_summary['Time to Failure'] = ""
-        events_summary['Failure'] = "Yes"
-
-        # Add last entries of dataframe, aka, hours of operation at the last point of analysis
-        end_of_analysis_entries = pd.DataFrame({'Unit Component': [unit] * len(components_to_analyse),
-                                                'Fault Component': components_to_analyse,
-                                                'Failure Mode': [""] * len(components_to_analyse),
-                                                'Event Start Time': [inverter_operation[unit][1]] * len(
-                                                    components_to_analyse),
-                                                'Operation Time': [unit_age] * len(components_to_analyse),
-                                                'Time to Failure': [""] * len(components_to_analyse),
-                                                'Failure': ['No'] * len(components_to_analyse)})
-
-        # Get complete events summary
-        events_summary = pd.concat([events_summary, end_of_analysis_entries]).sort_values(
-            by=['Event Start Time', 'Fault Component']).reset_index(None, drop=True)
-        events_summary = events_summary.loc[
-            ~(events_summary['Fault Component'] == "Phase Fuse") & ~(events_summary['Fault Component'] == "Unknown")]
-
-        print(events_summary)
-        print("\n")
-
-        print(components_failed)
         # Separate multiple components incidents to calculate spare parts
-        for failed_component in components_failed:
-            if ";" in failed_component:
-                incidents_to_split = events_summary.loc[events_summary['Fault Component'] == failed_component]
-                index_incidents_to_split = incidents_to_split.index
-                actual_components = failed_component.split(';')
-                n_repeats = len(actual_components)
-
-                splitted_incidents = pd.concat([incidents_to_split] * len(actual_components))
-                splitted_incidents['Fault Component'] = actual_components * len(incidents_to_split)
-                splitted_incidents = splitted_incidents.sort_values(
-                    by=['Event Start Time', 'Fault Component']).reset_index(None, drop=True)
-
-                events_summary = pd.concat(
-                    [events_summary.drop(index=index_incidents_to_split), splitted_incidents]).sort_values(
-                    by=['Event Start Time', 'Fault Component']).reset_index(None, drop=True)
-
-                """print(events_summary)
-                print(splitted_incidents)
-                print(new_events_summary)"""
+        all_events_summary = all_events_summary.assign(
+            **{'Fault Component': all_events_summary['Fault Component'].astype(str).str.split(';')}).explode(
+            'Fault Component')
+        all_events_summary = all_events_summary.sort_values(
+            by=['Unit Code', 'Event Start Time', 'Fault Component'], kind='mergesort').reset_index(drop=True)
 
-        # Add time to failure
-        for fault_component in components_to_analyse:
+        # Time to failure, operation time since the previous entry of the same unit and fault component
+        operation_time = pd.to_numeric(all_events_summary['Operation Time'], errors='coerce')
+        unit_fault_components = operation_time.groupby(
+            [all_events_summary['Unit Code'], all_events_summary['Fault Component']], sort=False)
+        previous_operation_time = unit_fault_components.shift(1).where(unit_fault_components.cumcount() > 0, 0)
 
-            fc_events_summary = events_summary.loc[events_summary['Fault Component'] == fault_component]
-            n_incidents = len(fc_events_summary)
+        time_to_failure = pd.Series("", index=all_events_summary.index, dtype=object)
+        analysed = all_events_summary['Fault Component'].isin(components_to_analyse)
+        time_to_failure[analysed] = (operation_time - previous_operation_time)[analysed]
 
-            if n_incidents == 1:
-                index_of_incident = int(fc_events_summary.index.values)
-                events_summary.loc[index_of_incident, "Time to Failure"] = fc_events_summary['Operation Time'][
-                    index_of_incident]
+        all_events_summary.insert(len(summary_columns), 'Time to Failure', time_to_failure)
 
-            else:
-                op_time = list(fc_events_summary['Operation Time'])
-                op_time_2 = list(fc_events_summary['Operation Time'])
-                op_time_2.insert(0, 0)
-                del op_time_2[-1]
+        # Split per unit, indexes restart in each unit as in the events summary of each unit
+        entry_unit_codes = all_events_summary.pop('Unit Code').to_numpy()
+        all_events_summary.index = pd.Series(entry_unit_codes).groupby(entry_unit_codes).cumcount().to_numpy()
+        unit_starts = np.searchsorted(entry_unit_codes, np.arange(len(units) + 1))
 
-                fc_events_summary['Time to Failure'] = [op_time_i - op_time_2_i for op_time_i, op_time_2_i in
-                                                        zip(op_time, op_time_2)]
+        incidents_per_unit = dict(list(unit_incidents.groupby('Unit Component', sort=False)))
+        no_incidents = inverter_incidents_site.iloc[0:0]
 
-                for index, row in fc_events_summary.iterrows():
-                    events_summary.loc[index, "Time to Failure"] = row['Time to Failure']
+        unit_failure_dict = {}
+        events_summary_dict = {}
+        for i, unit in enumerate(units):
+            events_summary = all_events_summary.iloc[unit_starts[i]:unit_starts[i + 1]]
 
-            fr_calc_events_summary = events_summary.loc[events_summary['Fault Component'] == fault_component]
-            n_incidents = len(fr_calc_events_summary.loc[fr_calc_events_summary['Failure'] == 'Yes'])
-            n_hours = sum(fr_calc_events_summary['Time to Failure'])
-            failure_rate = (n_incidents / n_hours) * 1000
+            unit_failure_dict[unit] = {'Incidents': incidents_per_unit.get(unit, no_incidents),
+                                       'Unit Age': unit_ages[unit], 'Events Summary': events_summary}
+            events_summary_dict[unit] = events_summary
 
-            # print(unit,fault_component, n_incidents, n_hours, failure_rate)
+        summary_span.update(units=len(units), rows=len(all_events_summary))
 
-        try:
-            all_events_summary = pd.concat([all_events_summary,
-                                            events_summary])  # .sort_values(by = ['Event Start Time', 'Fault Component']).reset_index(None, drop=True)
-        except NameError:
-            all_events_summary = events_summary
+        return events_summary_dict, unit_failure_dict, all_events_summary
 
-        # print(events_summary)
 
-        # print(unit, components_failed)
-
-        unit_failure_dict[unit] = {'Incidents': unit_incidents, 'Unit Age': unit_age, 'Events Summary': events_summary}
-        events_summary_dict[unit] = events_summary
+def get_events_summary_per_fault_component(components_to_analyse, inverter_incidents_site, inverter_operation,
+                                           df_operation_hours, operation_hours_index=None):
+    return get_events_summary(components_to_analyse, inverter_incidents_site, inverter_operation,
+                              df_operation_hours, operation_hours_index)
 
-    return events_summary_dict, unit_failure_dict, all_events_summary
 
+def get_events_summary_per_failure_mode(components_to_analyse, inverter_incidents_site, inverter_operation,
+                                        df_operation_hours, operation_hours_index=None):
+    return get_events_summary(components_to_analyse, inverter_incidents_site, inverter_operation,
+                              df_operation_hours, operation_hours_index,
+                              summary_columns=['Unit Component', 'Fault Component', 'Failure Mode',
+                                               'Event Start Time', 'Operation Time'])
 
 # </editor-fold>
\ No newline at end of file
@@ -1,129 +1,241 @@
 import pandas as pd
 from datetime import datetime
 import re
-import PySimpleGUI as sg
 import math
-import perfonitor.inputs as inputs
 import numpy as np
 import os
-import openpyxl
 import sys
+import perfonitor.instrumentation as instrumentation
+import perfonitor.operation_hours as operation_hours
+
+logger = instrumentation.get_logger(__name__)
 
 
 
 # <editor-fold desc="Dataframe completion">
 
 def get_all_units_from_operation_hours(df_operation_hours):
-    inverters = df_operation_hours.columns.drop('Timestamp')
-    inverter_operation = {}
-
-    for inverter in inverters:
-        # print(inverter)
-        df_inverter = df_operation_hours[['Timestamp', inverter]].dropna().reset_index(None, drop=True)
-        df_inverter_first_hour = df_inverter.loc[df_inverter[inverter] == 1]['Timestamp'][0]
-        df_inverter_last_hour = df_inverter['Timestamp'][len(df_inverter) - 1]
-
-        list_1 = list(df_inverter[inverter])
-        list_2 = list(df_inverter[inverter])
-        list_1.pop(0)
-        list_2.pop(len(list_2) - 1)
-
-        df_inverter['Diff'] = list(np.subtract(np.array(list_1), np.array(list_2))).insert(len(list_2), 0)
-        df_change = df_inverter.loc[df_inverter['Diff'] < 0]
-        first_hour_timestamp = df_inverter.loc[df_inverter[inverter] == 1]
-
-        if len(df_change) == 0:
-            inverter_operation[inverter] = [df_inverter_first_hour, df_inverter_last_hour]
-
-        elif len(df_change) == 1:
-            inverter_operation[inverter] = [df_inverter_first_hour, list(df_change['Timestamp'])[0]]
-
-            inverter_name = inverter + ".r" + str(2)
-            inverter_operation[inverter_name] = [list(df_change['Timestamp'])[0], df_inverter_last_hour]
-
+    """From the operation hours of each inverter finds replacements (resets of the hours counter) and returns the
+    operation period of every unit as {unit: [start, end]}. Replaced units are named with .rN, e.g. Inv 01.r2.
+    A unit starts at the first reading of 1 hour (or the first reading) or at the last reading before a reset and
+    ends at the last reading before the next reset (or the last reading).
+    All inverter columns are processed at once with array operations"""
+
+    with instrumentation.span('get_all_units_from_operation_hours', rows=len(df_operation_hours),
+                              inverters=len(df_operation_hours.columns) - 1) as units_span:
+        inverters = df_operation_hours.columns.drop('Timestamp')
+        inverter_operation = {}
+
+        timestamps = df_operation_hours['Timestamp'].reset_index(drop=True)
+        operation_hours = df_operation_hours[inverters].to_numpy(dtype=float)
+
+        # Readings without timestamp are dropped, NaN readings are never part of a comparison
+        valid_timestamps = timestamps.notna().to_numpy()
+        if not valid_timestamps.all():
+            operation_hours = operation_hours.copy()
+            operation_hours[~valid_timestamps] = np.nan
+        valid = ~np.isnan(operation_hours)
+
+        has_data = valid.any(axis=0)
+        first_reading_rows = valid.argmax(axis=0)
+        first_hour = operation_hours == 1
+        first_hour_rows = np.where(first_hour.any(axis=0), first_hour.argmax(axis=0), first_reading_rows)
+        last_reading_rows = len(valid) - 1 - valid[::-1].argmax(axis=0)
+
+        # A reset is a reading lower than the previous reading, found for all inverters at once. The change time is
+        # the last reading before the reset
+        consecutive_resets = operation_hours[1:] < operation_hours[:-1]
+        reset_rows, reset_columns = _get_true_cells(consecutive_resets)
+        reset_rows = reset_rows + 1
+        change_rows = reset_rows - 1
+
+        # Readings after a gap (NaN) are compared with the last reading before the gap. Only the rows where a column
+        # turns valid or invalid are looked at: in column then time order, the last valid row before each gap is
+        # carried forward with a running maximum of column * rows + row, so it never passes to the next column
+        transition_rows, transition_columns = _get_true_cells(valid[1:] != valid[:-1])
+        transition_order = np.lexsort((transition_rows, transition_columns))
+        transition_rows = transition_rows[transition_order]
+        transition_columns = transition_columns[transition_order]
+
+        gap_ends = valid[transition_rows + 1, transition_columns]
+        column_offsets = transition_columns.astype(np.int64) * len(valid)
+        last_valid_rows = np.maximum.accumulate(np.where(gap_ends, column_offsets - 1,
+                                                         column_offsets + transition_rows)) - column_offsets
+
+        gap_end_rows = transition_rows[gap_ends] + 1
+        gap_end_columns = transition_columns[gap_ends]
+        previous_rows = last_valid_rows[gap_ends]
+        is_reset = (previous_rows >= 0) & (operation_hours[gap_end_rows, gap_end_columns] <
+                                           operation_hours[previous_rows, gap_end_columns])
+
+        reset_rows = np.concatenate([reset_rows, gap_end_rows[is_reset]])
+        reset_columns = np.concatenate([reset_columns, gap_end_columns[is_reset]])
+        change_rows = np.concatenate([change_rows, previous_rows[is_reset]])
+
+        # Resets in column order, then time order
+        reset_order = np.lexsort((reset_rows, reset_columns))
+        reset_columns = reset_columns[reset_order]
+        change_rows = change_rows[reset_order]
+
+        column_change_starts = np.searchsorted(reset_columns, np.arange(len(inverters) + 1))
+
+        for i, inverter in enumerate(inverters):
+            if not has_data[i]:
+                continue
+
+            change_timestamps = list(timestamps.iloc[change_rows[column_change_starts[i]:column_change_starts[i + 1]]])
+            if len(change_timestamps) > 1:
+                logger.info("Found " + str(len(change_timestamps)) + " changes on " + str(inverter))
+
+            # The first hour of the original unit is before its replacement, the new counter also starts at 1
+            column_change_rows = change_rows[column_change_starts[i]:column_change_starts[i + 1]]
+            first_row = first_hour_rows[i]
+            if len(column_change_rows) and first_row > column_change_rows[0]:
+                first_hour_before_change = first_hour[:column_change_rows[0] + 1, i]
+                first_row = first_hour_before_change.argmax() if first_hour_before_change.any() \
+                    else first_reading_rows[i]
+
+            unit_limits = [timestamps[first_row]] + change_timestamps + [timestamps[last_reading_rows[i]]]
+            for n_unit in range(len(unit_limits) - 1):
+                unit = inverter if n_unit == 0 else inverter + ".r" + str(n_unit + 1)
+                inverter_operation[unit] = [unit_limits[n_unit], unit_limits[n_unit + 1]]
+
+        units_span['units'] = len(inverter_operation)
+
+        return inverter_operation
+
+
+def _get_true_cells(mask):
+    """Rows and columns of the True cells of a mostly False 2D mask, only the rows with a True cell are scanned"""
+
+    rows = np.flatnonzero(mask.any(axis=1))
+    cell_rows, cell_columns = np.nonzero(mask[rows])
+
+    return rows[cell_rows], cell_columns
+
+
+def get_units_in_operation(component_numbers, incident_times, inverter_operation):
+    """Returns the unit in operation at each incident time (None if no unit), from the unit lifetimes in
+    inverter_operation. Candidate units of an incident are the ones with its component number in the name, among them
+    the unit whose (start, end) interval contains the incident time"""
+
+    units_in_operation = np.full(len(incident_times), None, dtype=object)
+    incident_times = pd.DatetimeIndex(incident_times)
+    units = list(inverter_operation.keys())
+
+    for component_number in pd.unique(component_numbers[pd.notna(component_numbers)]):
+        incidents = np.flatnonzero(component_numbers == component_number)
+        candidate_units = [unit for unit in units if str(component_number) in unit]
+        if not candidate_units:
+            continue
+
+        unit_lifetimes = pd.IntervalIndex.from_arrays(
+            pd.DatetimeIndex([inverter_operation[unit][0] for unit in candidate_units]),
+            pd.DatetimeIndex([inverter_operation[unit][1] for unit in candidate_units]), closed='neither')
+
+        if not unit_lifetimes.is_overlapping:
+            unit_positions = unit_lifetimes.get_indexer(incident_times[incidents])
+            in_operation = unit_positions >= 0
+            units_in_operation[incidents[in_operation]] = np.array(candidate_units, dtype=object)[
+                unit_positions[in_operation]]
         else:
-            n_changes = len(df_change)
-            print("Found " + str(n_changes) + " changes on ", inverter)
-
-            for i in range(n_changes):
-                # print(i)
-                if i == 0:
-                    inverter_operation[inverter] = [df_inverter_first_hour, list(df_change['Timestamp'])[i]]
-
-                elif i == n_changes:
-                    inverter_name = inverter + ".r" + str(i + 1)
-                    inverter_operation[inverter_name] = [list(df_change['Timestamp'])[i], df_inverter_last_hour]
-                else:
-                    inverter_name = inverter + ".r" + str(i + 1)
-                    inverter_operation[inverter_name] = [list(df_change['Timestamp'])[i],
-                                                         list(df_change['Timestamp'])[i + 1]]
-
-    return inverter_operation
-
-def complete_dataset_inverterops_data(incidents_site, inverter_operation, df_operation_hours):
-    for index, row in incidents_site.iterrows():
-        component = row['Related Component']
-        incident_time = row['Event Start Time']
-        # print(component, incident_time)
+            # Overlapping lifetimes (e.g. Inv 1 and Inv 11 for number 1), the last matching unit is kept
+            for unit, lifetime in zip(candidate_units, unit_lifetimes):
+                in_operation = (incident_times[incidents] > lifetime.left) & \
+                               (incident_times[incidents] < lifetime.right)
+                units_in_operation[incidents[in_operation]] = unit
 
-        # Type of component
-        if "Block" in component:
-            # print('here')
-            incidents_site.loc[index, 'Component Type'] = "Inverter Block"
-            incidents_site.loc[index, 'Unit Component'] = "N/A"
-            incidents_site.loc[index, 'Operation Time'] = "N/A"
-
-        elif "LSBP" in component:
-            incidents_site.loc[index, 'Component Type'] = "Site"
-            incidents_site.loc[index, 'Unit Component'] = "N/A"
-            incidents_site.loc[index, 'Operation Time'] = "N/A"
-
-        elif "CB" in component or "String" in component:
-            incidents_site.loc[index, 'Component Type'] = "Combiner Box"
-            incidents_site.loc[index, 'Unit Component'] = "N/A"
-            incidents_site.loc[index, 'Operation Time'] = "N/A"
-
-        else:
-            incidents_site.loc[index, 'Component Type'] = "Inverter"
-
-            component_number = re.search(r'\d.*', component).group()
+    return units_in_operation
 
-            inverter_operation_time_info = [inverter for inverter in inverter_operation if
-                                            str(component_number) in inverter]
 
-            for unit in inverter_operation_time_info:
-                stime = inverter_operation[unit][0]
-                etime = inverter_operation[unit][1]
+def complete_dataset_inverterops_data(incidents_site, inverter_operation, df_operation_hours,
+                                      operation_hours_index=None):
+    """Adds Component Type, Unit Component (unit in operation at the time of the incident) and Operation Time
+    (operation hours of the unit at the incident, rounded to the sampling interval of the operation hours) to the
+    incidents, for all incidents at once.
+    The operation hours index is built from df_operation_hours if not given"""
 
-                if incident_time > stime and incident_time < etime:
-                    incidents_site.loc[index, 'Unit Component'] = unit
-                    rounded_incident_time = incident_time.round('15min', 'shift_backward')
+    with instrumentation.span('complete_dataset_inverterops_data', rows=len(incidents_site)):
+        if operation_hours_index is None:
+            operation_hours_index = operation_hours.OperationHoursIndex(df_operation_hours)
 
-                    # print(incident_time, rounded_incident_time)
+        components = incidents_site['Related Component'].astype(str)
+        incident_times = pd.DatetimeIndex(incidents_site['Event Start Time'])
 
-                    incident_operation_time = \
-                        df_operation_hours.loc[df_operation_hours['Timestamp'] == rounded_incident_time][
-                            component].values[
-                            0]
-
-                    changed = False
-                    while np.isnan(incident_operation_time):
-                        rounded_incident_time = rounded_incident_time - pd.Timedelta(minutes=15)
-                        incident_operation_time = \
-                            df_operation_hours.loc[df_operation_hours['Timestamp'] == rounded_incident_time][
-                                component].values[0]
-                        changed = True
-                    if changed == True:
-                        print("Changed rounded time to forward timestamp because backward was NaN, new timestamp: ",
-                              rounded_incident_time)
-
-                    incidents_site.loc[index, 'Operation Time'] = float(incident_operation_time)
-                else:
-                    continue
-
-    return incidents_site
+        # Type of component
+        is_block = components.str.contains('Block', regex=False).to_numpy()
+        is_site = components.str.contains('LSBP', regex=False).to_numpy()
+        is_combiner_box = (components.str.contains('CB', regex=False) |
+                           components.str.contains('String', regex=False)).to_numpy()
+        component_type = np.select([is_block, is_site, is_combiner_box], ["Inverter Block", "Site", "Combiner Box"],
+                                   default="Inverter")
+        is_inverter = component_type == "Inverter"
+
+        # Columns keep values already in the dataset for inverter incidents without unit in operation
+        unit_component = incidents_site['Unit Component'].to_numpy(dtype=object).copy() \
+            if 'Unit Component' in incidents_site.columns else np.full(len(incidents_site), np.nan, dtype=object)
+        operation_time = incidents_site['Operation Time'].to_numpy(dtype=object).copy() \
+            if 'Operation Time' in incidents_site.columns else np.full(len(incidents_site), np.nan, dtype=object)
+        unit_component[~is_inverter] = "N/A"
+        operation_time[~is_inverter] = "N/A"
+
+        # Unit in operation
+        inverter_incidents = np.flatnonzero(is_inverter)
+        component_numbers = components.iloc[inverter_incidents].str.extract(r'(\d.*)', expand=False).to_numpy(
+            dtype=object)
+        units_in_operation = get_units_in_operation(component_numbers, incident_times[inverter_incidents],
+                                                    inverter_operation)
+
+        with_unit = inverter_incidents[pd.notna(units_in_operation)]
+        unit_component[with_unit] = units_in_operation[pd.notna(units_in_operation)]
+
+        # Operation time at the incident, from the last valid reading if the rounded time has none
+        rounded_incident_times = incident_times[with_unit].round(operation_hours_index.sampling_interval)
+        incident_operation_times, reading_times = operation_hours_index.get_component_readings_at(
+            components.iloc[with_unit].to_numpy(dtype=object), rounded_incident_times)
+        operation_time[with_unit] = incident_operation_times
+        earlier_reading = np.asarray(reading_times < rounded_incident_times)
+
+        if earlier_reading.any():
+            logger.info("Changed rounded time to backward timestamp because it was NaN, for " +
+                        str(earlier_reading.sum()) + " incidents")
+
+        incidents_site['Component Type'] = component_type
+        incidents_site['Unit Component'] = unit_component
+        incidents_site['Operation Time'] = operation_time
+
+        return incidents_site
+
+
+def get_timeframe_of_analysis(df_operation_hours, start_date=None, end_date=None, datapoints=100):
+    """Headless timeframe of analysis, returns (start date, end date, datapoints) as the window of
+    timeframe_of_analysis_with_opshours does: dates as 'YYYY-MM-DD' strings and datapoints as a string.
+    Dates not given are the first and last dates of the operation hours"""
+
+    timestamps = pd.to_datetime(df_operation_hours['Timestamp'])
+    start_date = timestamps.iloc[0].date() if start_date is None else pd.Timestamp(start_date).date()
+    end_date = timestamps.iloc[-1].date() if end_date is None else pd.Timestamp(end_date).date()
+
+    if start_date > end_date:
+        raise ValueError('Start date ' + str(start_date) + ' is after end date ' + str(end_date))
+    if int(datapoints) <= 0:
+        raise ValueError('Number of datapoints must be positive, your input: ' + str(datapoints))
+
+    return str(start_date), str(end_date), str(int(datapoints))
+
+
+def timeframe_of_analysis_with_opshours(df_operation_hours, headless: bool = False, start_date=None, end_date=None,
+                                        datapoints=None):
+    """Asks the timeframe of analysis and number of datapoints in a window. With headless, or if any of start_date,
+    end_date and datapoints is given, no window is opened (see get_timeframe_of_analysis)"""
+
+    if headless or start_date is not None or end_date is not None or datapoints is not None:
+        return get_timeframe_of_analysis(df_operation_hours, start_date, end_date,
+                                         datapoints if datapoints is not None else 100)
+
+    # GUI only imported when a window is needed
+    import PySimpleGUI as sg
 
-def timeframe_of_analysis_with_opshours(df_operation_hours):
     start_date_data = df_operation_hours['Timestamp'][0].date()
     end_date_data = df_operation_hours['Timestamp'][len(df_operation_hours) - 1].date()
 
@@ -0,0 +1,183 @@
+import pandas as pd
+import numpy as np
+import perfonitor.fleet as fleet_data
+
+
+# <editor-fold desc="Downsampling pyramid">
+
+class DownsamplingPyramid:
+    """Min, max, sum and count of non-missing values of series with shared sorted timestamps, over buckets of 2, 4,
+    8, ... rows. A request for N points over any timeframe is served from the level with buckets of about
+    rows / N rows, plus the raw rows of the incomplete buckets at both ends of the timeframe, so it takes time
+    proportional to N and not to the rows of the timeframe. Results are exact, not approximations of the raw data.
+
+    Memory is about 4 times the raw values (all levels together)"""
+
+    statistics = ['Min', 'Max', 'Mean', 'Sum', 'Count']
+
+    def __init__(self, timestamps, values, columns):
+        self.timestamps = pd.DatetimeIndex(timestamps)
+        self.values = np.asarray(values, dtype=float)
+        self.columns = list(columns)
+
+        self._timestamp_values = self.timestamps.asi8
+        if len(self._timestamp_values) > 1 and (np.diff(self._timestamp_values) < 0).any():
+            raise ValueError('Timestamps of the pyramid must be sorted')
+
+        # levels[l - 1] has buckets of 2 ** l rows, the last bucket of each level may be incomplete
+        self.levels = []
+        level = _get_raw_statistics(self.values)
+        while len(level['Sum']) > 1:
+            level = _reduce_pairs(level)
+            self.levels.append(level)
+
+    @classmethod
+    def from_dataframe(cls, df, columns=None, timestamp_column: str = 'Timestamp'):
+        """Builds the pyramid of the columns of a Dataframe with a timestamp column, e.g. df_operation_hours or the
+        power data of an inverter. All columns other than the timestamp by default"""
+
+        if columns is None:
+            columns = [column for column in df.columns if column != timestamp_column]
+
+        df = df.sort_values(timestamp_column, kind='mergesort')
+        timestamps = pd.to_datetime(df[timestamp_column])
+
+        return cls(timestamps, df[columns].to_numpy(dtype=float), columns)
+
+    @classmethod
+    def from_fleet(cls, fleet):
+        """Builds the pyramid of all power columns of all inverters of a FleetPowerData block"""
+
+        n_timestamps, n_inverters, n_quantities = fleet.power.shape
+        columns = [column for inverter in fleet.inverters for column in fleet.power_columns[inverter]]
+
+        return cls(fleet.timestamps, fleet.power.reshape(n_timestamps, n_inverters * n_quantities), columns)
+
+    @classmethod
+    def from_inverter_dict(cls, inverter_list, all_inverter_power_data_dict, schema=None):
+        """Builds the pyramid of the power data of all inverters in all_inverter_power_data_dict"""
+
+        fleet = fleet_data.FleetPowerData.from_inverter_dict(inverter_list, all_inverter_power_data_dict, schema)
+
+        return cls.from_fleet(fleet)
+
+    def _get_position(self, timestamp, default_position):
+        if timestamp is None:
+            return default_position
+
+        timestamp = pd.Timestamp(timestamp)
+        if self.timestamps.tz is not None and timestamp.tz is None:
+            timestamp = timestamp.tz_localize(self.timestamps.tz)
+
+        return int(np.searchsorted(self._timestamp_values, timestamp.value, side='left'))
+
+    def _get_pieces(self, start_position, end_position, datapoints):
+        """Returns the statistics and start rows of the pieces covering the rows from start_position to end_position:
+        complete buckets of the chosen level and one piece of raw rows at each end if they are not aligned"""
+
+        n_rows = end_position - start_position
+        level_number = min(int(np.log2(n_rows / datapoints)) if n_rows >= 2 * datapoints else 0, len(self.levels))
+        if level_number == 0:
+            return _get_raw_statistics(self.values[start_position:end_position]), \
+                np.arange(start_position, end_position)
+
+        bucket_size = 2 ** level_number
+        first_bucket = -(-start_position // bucket_size)
+        end_bucket = end_position // bucket_size
+
+        pieces = []
+        piece_starts = []
+        if start_position < first_bucket * bucket_size:
+            pieces.append(_reduce_all(_get_raw_statistics(self.values[start_position:first_bucket * bucket_size])))
+            piece_starts.append([start_position])
+
+        level = self.levels[level_number - 1]
+        pieces.append({statistic: values[first_bucket:end_bucket] for statistic, values in level.items()})
+        piece_starts.append(np.arange(first_bucket, end_bucket) * bucket_size)
+
+        if end_bucket * bucket_size < end_position:
+            pieces.append(_reduce_all(_get_raw_statistics(self.values[end_bucket * bucket_size:end_position])))
+            piece_starts.append([end_bucket * bucket_size])
+
+        pieces = {statistic: np.concatenate([piece[statistic] for piece in pieces]) for statistic in pieces[0]}
+
+        return pieces, np.concatenate(piece_starts)
+
+    def get_points(self, start=None, end=None, datapoints=100, statistic: str = 'Mean'):
+        """Returns at most datapoints points of all columns between start (included) and end (excluded), each one the
+        statistic (Min, Max, Mean, Sum or Count) of a group of consecutive rows of about the same length.
+        Groups with no values are NaN. Returns a Dataframe with the Timestamp of the first row of each group and the
+        columns of the pyramid"""
+
+        if statistic not in self.statistics:
+            raise ValueError('Possible statistics: ' + str(self.statistics) + ", your input: " + str(statistic))
+        datapoints = int(datapoints)
+        if datapoints <= 0:
+            raise ValueError('Number of datapoints must be positive, your input: ' + str(datapoints))
+
+        start_position = self._get_position(start, 0)
+        end_position = max(self._get_position(end, len(self.timestamps)), start_position)
+        if start_position == end_position:
+            points = pd.DataFrame(np.empty((0, len(self.columns))), columns=self.columns)
+            points.insert(0, 'Timestamp', self.timestamps[:0])
+            return points
+
+        pieces, piece_starts = self._get_pieces(start_position, end_position, datapoints)
+
+        # Groups of pieces starting closest to evenly spaced rows
+        n_rows = end_position - start_position
+        group_rows = start_position + np.arange(datapoints) * n_rows // datapoints
+        group_starts = np.unique(np.searchsorted(piece_starts, group_rows, side='right') - 1)
+        groups = _reduce_groups(pieces, group_starts)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            has_values = groups['Count'] > 0
+            if statistic == 'Mean':
+                point_values = groups['Sum'] / groups['Count']
+            elif statistic == 'Count':
+                point_values = groups['Count'].astype(float)
+            else:
+                point_values = np.where(has_values, groups[statistic], np.nan)
+
+        points = pd.DataFrame(point_values, columns=self.columns)
+        points.insert(0, 'Timestamp', self.timestamps[piece_starts[group_starts]])
+
+        return points
+
+    def get_points_for_dates(self, start_date, end_date, datapoints=100, statistic: str = 'Mean'):
+        """Same as get_points for whole days, from start_date to end_date included, e.g. the output of
+        timeframe_of_analysis_with_opshours"""
+
+        start = pd.Timestamp(start_date).normalize()
+        end = pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)
+
+        return self.get_points(start, end, datapoints, statistic)
+
+
+def _get_raw_statistics(values):
+    missing = np.isnan(values)
+
+    return {'Min': np.where(missing, np.inf, values), 'Max': np.where(missing, -np.inf, values),
+            'Sum': np.where(missing, 0, values), 'Count': (~missing).astype(np.int64)}
+
+
+def _reduce_pairs(level):
+    """Next level of the pyramid: buckets of two consecutive buckets"""
+
+    n_buckets = len(level['Sum'])
+    pair_starts = np.arange(0, n_buckets, 2)
+
+    return _reduce_groups(level, pair_starts)
+
+
+def _reduce_all(statistics):
+    return _reduce_groups(statistics, np.array([0]))
+
+
+def _reduce_groups(statistics, group_starts):
+    return {'Min': np.minimum.reduceat(statistics['Min'], group_starts, axis=0),
+            'Max': np.maximum.reduceat(statistics['Max'], group_starts, axis=0),
+            'Sum': np.add.reduceat(statistics['Sum'], group_starts, axis=0),
+            'Count': np.add.reduceat(statistics['Count'], group_starts, axis=0)}
+
+# </editor-fold>
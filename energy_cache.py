@@ -0,0 +1,150 @@
+import os
+import hashlib
+import pandas as pd
+import numpy as np
+import perfonitor.calculations as calculations
+import perfonitor.file_names as file_names
+import perfonitor.schema as data_schema
+import perfonitor.site_calendar as site_calendar
+
+
+# <editor-fold desc="Energy cache">
+
+class EnergyCache:
+    """Persistent cache, in NPZ files, of the energy sums behind the PR calculations. Files are kept per site,
+    inverter and month of data, as <cache directory>/<site>/<inverter>/<MM-YYYY>-<hash>.npz, with the daily and
+    monthly energy of raw, corrected and DC focus PR. The hash covers the timestamps, power values and interval hours
+    (see sampling.get_interval_hours) of the month and the max export capacity, so a month is recalculated whenever
+    its data or Capacity AC changes, and the file of the previous version is removed"""
+
+    pr_types = ['raw', 'corrected', 'corrected_DCfocus']
+    n_quantities = 4
+    version = '2'
+
+    def __init__(self, cache_directory, site):
+        self.cache_directory = cache_directory
+        self.site = site
+        self.hits = 0
+        self.misses = 0
+
+    def _get_inverter_directory(self, inverter):
+        inverter_directory = os.path.join(self.cache_directory, file_names.get_safe_name(self.site),
+                                          file_names.get_safe_name(inverter))
+        os.makedirs(inverter_directory, exist_ok=True)
+
+        return inverter_directory
+
+    def _get_month_hash(self, timestamps, values, interval_hours, maxexport_capacity_ac):
+        month_hash = hashlib.blake2b(digest_size=16)
+        month_hash.update(self.version.encode())
+        month_hash.update(repr(float(maxexport_capacity_ac)).encode())
+        month_hash.update(np.ascontiguousarray(timestamps).tobytes())
+        month_hash.update(np.ascontiguousarray(values).tobytes())
+        month_hash.update(np.ascontiguousarray(interval_hours).tobytes())
+
+        return month_hash.hexdigest()
+
+    def get_inverter_period_sums(self, inverter, power_data, maxexport_capacity_ac, schema=None):
+        """Returns the daily and monthly sums of one inverter as {'daily': {day: sums}, 'monthly': {month: sums}},
+        each sums array with the quantities of every PR type side by side (see stack_pr_type_values).
+        Months found in the cache are loaded, the others are calculated and saved"""
+
+        if schema is None:
+            schema = data_schema.PowerDataSchema()
+        columns = list(schema.get_columns(inverter, power_data))
+
+        calendar_index = site_calendar.get_calendar_index(power_data['Timestamp'])
+        timestamps = calendar_index.timestamps.asi8
+        values = power_data[columns].to_numpy(dtype=float)
+        interval_hours = calendar_index.get_interval_hours()
+        inverter_directory = self._get_inverter_directory(inverter)
+
+        period_sums = {'daily': {}, 'monthly': {}}
+        month_codes = calendar_index.codes['Month']
+        for month_code, month in enumerate(calendar_index.labels['Month']):
+            month_rows = np.flatnonzero(month_codes == month_code)
+            month_hash = self._get_month_hash(timestamps[month_rows], values[month_rows], interval_hours[month_rows],
+                                              maxexport_capacity_ac)
+            month_file = os.path.join(inverter_directory, month + '-' + month_hash + '.npz')
+
+            if os.path.exists(month_file):
+                self.hits += 1
+                with np.load(month_file, allow_pickle=False) as cached_sums:
+                    days = list(pd.to_datetime(cached_sums['days']).date)
+                    daily_sums = cached_sums['daily_sums']
+                    monthly_sums = cached_sums['monthly_sums']
+            else:
+                self.misses += 1
+                days, daily_sums, monthly_sums = self._calculate_month_sums(
+                    calendar_index, month_rows, values[month_rows], interval_hours[month_rows],
+                    maxexport_capacity_ac)
+                self._save_month_sums(inverter_directory, month, month_file, days, daily_sums, monthly_sums)
+
+            period_sums['daily'].update(zip(days, daily_sums))
+            period_sums['monthly'][month] = monthly_sums
+
+        return period_sums
+
+    @staticmethod
+    def _calculate_month_sums(calendar_index, month_rows, month_values, month_interval_hours, maxexport_capacity_ac):
+        pr_type_values = calculations.stack_pr_type_values(month_values, maxexport_capacity_ac)
+
+        day_codes, day_positions = np.unique(calendar_index.codes['Day'][month_rows], return_inverse=True)
+        days = list(calendar_index.labels['Day'][day_codes])
+        daily_sums = calculations.sum_per_period(pr_type_values, day_positions.ravel(), len(days),
+                                                 month_interval_hours)
+        monthly_sums = calculations.sum_per_period(pr_type_values, np.zeros(len(month_rows), dtype=int), 1,
+                                                   month_interval_hours)[0]
+
+        return days, daily_sums, monthly_sums
+
+    @staticmethod
+    def _save_month_sums(inverter_directory, month, month_file, days, daily_sums, monthly_sums):
+        # Older versions of the month are no longer valid
+        for file_name in os.listdir(inverter_directory):
+            if file_name.startswith(month + '-') and file_name.endswith('.npz'):
+                os.remove(os.path.join(inverter_directory, file_name))
+
+        temporary_file = month_file + '.tmp.npz'
+        np.savez(temporary_file, days=np.array([str(day) for day in days]), daily_sums=daily_sums,
+                 monthly_sums=monthly_sums)
+        os.replace(temporary_file, month_file)
+
+    def get_site_energy(self, inverter_list, all_inverter_power_data_dict, site_info, pr_type: str = 'raw',
+                        granularity: str = 'daily', schema=None):
+        """Returns the energy per period of all inverters, with shape (periods, inverters, quantities), and the
+        periods under analysis, as used by calculations.build_pr_tables"""
+
+        if schema is None:
+            schema = data_schema.PowerDataSchema.from_power_data_dict(inverter_list, all_inverter_power_data_dict)
+
+        periods_under_analysis = site_info['Days'] if granularity == 'daily' else site_info['Months']
+        periods = pd.Index(list(dict.fromkeys(periods_under_analysis)))
+        i_pr_type = self.pr_types.index(pr_type)
+
+        component_info = site_info['Component Info']
+        energy = np.zeros((len(periods), len(inverter_list), self.n_quantities))
+        for i, inverter in enumerate(inverter_list):
+            maxexport_capacity_ac = float(
+                component_info.loc[component_info['Component'] == inverter]['Capacity AC'].values[0]) * 1.001
+
+            period_sums = self.get_inverter_period_sums(inverter, all_inverter_power_data_dict[inverter]['Power Data'],
+                                                        maxexport_capacity_ac, schema)[granularity]
+
+            for j, period in enumerate(periods):
+                if period in period_sums:
+                    energy[j, i] = period_sums[period][i_pr_type * self.n_quantities:
+                                                       (i_pr_type + 1) * self.n_quantities]
+
+        return energy, periods
+
+    def clear(self):
+        """Removes all cached files of the site"""
+
+        site_directory = os.path.join(self.cache_directory, file_names.get_safe_name(self.site))
+        for directory, _, directory_file_names in os.walk(site_directory):
+            for file_name in directory_file_names:
+                if file_name.endswith('.npz'):
+                    os.remove(os.path.join(directory, file_name))
+
+# </editor-fold>
@@ -0,0 +1,139 @@
+import pandas as pd
+import numpy as np
+import perfonitor.calculations as calculations
+import perfonitor.fleet as fleet_data
+
+
+# <editor-fold desc="Cumulative energy index">
+
+class CumulativeEnergyIndex:
+    """Cumulative energy of every inverter over the sorted timestamps of a site: AC, Expected, Ideal and Irradiance
+    (raw), Expected and Ideal clipped to Capacity AC * 1.001 (corrected) and, optionally, the DC focus values (only
+    where AC > 0). The energy of any window is the difference of two rows found with binary searches, so PR of
+    any window, inverter subset or the whole site does not scan the power data.
+
+    Memory is (timestamps + 1) * inverters * 6 floats, 10 with DC focus"""
+
+    quantities = ['AC', 'Expected', 'Ideal', 'Irradiance']
+    pr_type_columns = {'raw': [0, 1, 2, 3], 'corrected': [0, 4, 5, 3], 'corrected_DCfocus': [6, 7, 8, 9]}
+
+    def __init__(self, timestamps, inverters, cumulative_energy, power_columns, capacities=None):
+        self.timestamps = pd.DatetimeIndex(timestamps)
+        self.inverters = pd.Index(inverters)
+        self.cumulative_energy = cumulative_energy
+        self.power_columns = power_columns
+
+        # Capacity AC of the inverters, weights of the irradiation of several inverters (equal weights if not given)
+        self.capacities = np.ones(len(self.inverters)) if capacities is None else np.asarray(capacities, dtype=float)
+
+        self._timestamp_values = self.timestamps.asi8
+
+    @classmethod
+    def from_fleet(cls, fleet, site_info, include_dc_focus: bool = False):
+        """Builds the index from a FleetPowerData block"""
+
+        component_info = site_info['Component Info'].set_index('Component')
+        capacities = component_info.loc[fleet.inverters, 'Capacity AC'].to_numpy(dtype=float)
+        maxexport_capacity_ac = capacities * 1.001
+
+        power = fleet.power
+        clipped_power = calculations.clip_to_export_capacity(power[:, :, 1:3],
+                                                             maxexport_capacity_ac[np.newaxis, :, np.newaxis])
+        energy_values = [power, clipped_power]
+        if include_dc_focus:
+            in_production = (power[:, :, 0] > 0)[:, :, np.newaxis]
+            energy_values.append(np.where(in_production, np.concatenate(
+                [power[:, :, :1], clipped_power, power[:, :, 3:]], axis=2), 0))
+
+        # Energy of each datapoint, power times the hours it stands for
+        interval_hours = fleet.interval_hours
+        if interval_hours.ndim == 1:
+            interval_hours = interval_hours[:, np.newaxis]
+        energy_values = np.nan_to_num(np.concatenate(energy_values, axis=2), nan=0.0) * \
+            interval_hours[:, :, np.newaxis]
+
+        n_timestamps, n_inverters, n_quantities = energy_values.shape
+        cumulative_energy = np.zeros((n_timestamps + 1, n_inverters, n_quantities))
+        np.cumsum(energy_values, axis=0, out=cumulative_energy[1:])
+
+        return cls(fleet.timestamps, fleet.inverters, cumulative_energy, fleet.power_columns, capacities)
+
+    @classmethod
+    def from_inverter_dict(cls, inverter_list, all_inverter_power_data_dict, site_info, schema=None,
+                           include_dc_focus: bool = False):
+        """Builds the index from all_inverter_power_data_dict"""
+
+        fleet = fleet_data.FleetPowerData.from_inverter_dict(inverter_list, all_inverter_power_data_dict, schema)
+
+        return cls.from_fleet(fleet, site_info, include_dc_focus)
+
+    def _get_positions(self, timestamps, default_position):
+        if timestamps is None:
+            return np.array([default_position])
+
+        timestamps = pd.DatetimeIndex(pd.to_datetime(np.atleast_1d(timestamps)))
+        if self.timestamps.tz is not None and timestamps.tz is None:
+            timestamps = timestamps.tz_localize(self.timestamps.tz)
+
+        return np.searchsorted(self._timestamp_values, timestamps.asi8, side='left')
+
+    def get_energy(self, start=None, end=None, inverters=None, pr_type: str = 'raw'):
+        """Returns the energy of the inverters between start (included) and end (excluded), as an array with shape
+        (inverters, quantities) for AC, Expected, Ideal and Irradiance. start and end can also be arrays of windows,
+        the energy then has shape (windows, inverters, quantities). None is the start or end of the data"""
+
+        if pr_type not in self.pr_type_columns:
+            raise ValueError('Possible PR types: ' + str(list(self.pr_type_columns)) + ", your input: " + str(pr_type))
+        columns = self.pr_type_columns[pr_type]
+        if max(columns) >= self.cumulative_energy.shape[2]:
+            raise ValueError('DC focus values not in the index, build it with include_dc_focus=True')
+
+        inverter_positions = slice(None) if inverters is None else self.inverters.get_indexer(inverters)
+        if inverters is not None and (inverter_positions < 0).any():
+            raise KeyError('Inverters not in the index: ' + str(list(np.asarray(inverters)[inverter_positions < 0])))
+
+        start_positions = self._get_positions(start, 0)
+        end_positions = self._get_positions(end, len(self.timestamps))
+        start_positions, end_positions = np.broadcast_arrays(start_positions, end_positions)
+
+        # Only the rows of the window limits are read
+        end_energy = self.cumulative_energy[np.maximum(end_positions, start_positions)][:, inverter_positions]
+        start_energy = self.cumulative_energy[start_positions][:, inverter_positions]
+        energy = end_energy[:, :, columns] - start_energy[:, :, columns]
+
+        if np.ndim(start) == 0 and np.ndim(end) == 0:
+            return energy[0]
+        return energy
+
+    def get_pr(self, start=None, end=None, inverters=None, pr_type: str = 'raw'):
+        """Returns the energy and PR of each inverter between start (included) and end (excluded), and of all of
+        them together in the 'Site' row: the sum of their energy and the capacity weighted mean of their
+        irradiation, as in rollup.rollup_energy"""
+
+        energy = self.get_energy(start, end, inverters, pr_type)
+        if energy.ndim != 2:
+            raise ValueError('get_pr takes one window, use get_energy for several windows')
+
+        inverter_list = list(self.inverters) if inverters is None else list(inverters)
+        capacities = self.capacities if inverters is None else self.capacities[self.inverters.get_indexer(inverters)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            site_irradiation = (energy[:, 3] * capacities).sum() / capacities.sum()
+        energy = np.vstack([energy, np.append(energy[:, :3].sum(axis=0), site_irradiation)])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pr = energy[:, 0] / energy[:, 2]
+
+        return pd.DataFrame({'AC Energy': energy[:, 0], 'Expected Energy': energy[:, 1],
+                             'Ideal Energy': energy[:, 2], 'Irradiation': energy[:, 3], 'PR %': pr},
+                            index=pd.Index(inverter_list + ['Site'], name='Component'))
+
+    def get_pr_for_dates(self, start_date, end_date, inverters=None, pr_type: str = 'raw'):
+        """Same as get_pr for whole days, from start_date to end_date included, e.g. the dates returned by
+        timeframe_of_analysis_with_opshours"""
+
+        start = pd.Timestamp(start_date).normalize()
+        end = pd.Timestamp(end_date).normalize() + pd.Timedelta(days=1)
+
+        return self.get_pr(start, end, inverters, pr_type)
+
+# </editor-fold>
@@ -0,0 +1,120 @@
+import pandas as pd
+import numpy as np
+import perfonitor.calculations as calculations
+import perfonitor.operation_hours as operation_hours
+
+
+# <editor-fold desc="Failure rate cube">
+
+class FailureRateCube:
+    """Failures, exposure hours and failures per 1000 h for any combination of dimensions, from one censored events
+    base table (events summary of all units with 'Failure' Yes/No entries, see calculations.get_events_summary).
+
+    Partial aggregates are computed once at the finest level: failures per site, unit, component type, fault
+    component and failure mode, and exposure hours (sum of Time to Failure) per site, unit, component type and fault
+    component. Every breakdown is a regrouping of these aggregates and is cached. Failure mode is not a dimension of
+    exposure, failures of each mode are divided by the exposure of the other dimensions of the breakdown"""
+
+    dimensions = ['Site', 'Unit Component', 'Component Type', 'Fault Component', 'Failure Mode']
+    exposure_dimensions = ['Site', 'Unit Component', 'Component Type', 'Fault Component']
+
+    def __init__(self, base_table):
+        base_table = base_table.copy()
+        for dimension in self.dimensions:
+            if dimension not in base_table.columns:
+                base_table[dimension] = ""
+            base_table[dimension] = base_table[dimension].fillna("").astype(str)
+        base_table['Exposure Hours'] = pd.to_numeric(base_table['Time to Failure'], errors='coerce')
+
+        self.base_table = base_table
+
+        failures = base_table.loc[base_table['Failure'] == "Yes"]
+        self._failures = failures.groupby(self.dimensions).size().rename('Failures').reset_index()
+        self._exposure = base_table.groupby(self.exposure_dimensions)['Exposure Hours'].sum(
+            min_count=1).reset_index()
+
+        self._failure_rates = {}
+
+    @classmethod
+    def from_incidents(cls, components_to_analyse, inverter_incidents_site, inverter_operation, df_operation_hours,
+                       site="", operation_hours_index=None):
+        """Builds the cube of one site from its incidents, completed with complete_dataset_inverterops_data"""
+
+        if operation_hours_index is None:
+            operation_hours_index = operation_hours.OperationHoursIndex(df_operation_hours)
+
+        summary_columns = ['Unit Component', 'Fault Component', 'Event Start Time', 'Operation Time']
+        for column in ['Failure Mode', 'Component Type']:
+            if column in inverter_incidents_site.columns:
+                summary_columns.insert(2, column)
+
+        _, _, all_events_summary = calculations.get_events_summary(
+            components_to_analyse, inverter_incidents_site, inverter_operation, df_operation_hours,
+            operation_hours_index, summary_columns=summary_columns)
+
+        base_table = all_events_summary.reset_index(drop=True)
+        base_table['Site'] = site
+        # End of analysis entries are inverter units
+        if 'Component Type' in base_table.columns:
+            base_table['Component Type'] = base_table['Component Type'].replace("", "Inverter")
+        else:
+            base_table['Component Type'] = "Inverter"
+
+        return cls(base_table)
+
+    @classmethod
+    def combine(cls, cubes):
+        """Cube of several sites (or other partial cubes) together"""
+
+        return cls(pd.concat([cube.base_table.drop(columns='Exposure Hours') for cube in cubes],
+                             ignore_index=True))
+
+    def get_failure_rates(self, dimensions=None):
+        """Returns a Dataframe with Failures, Exposure Hours and Failures per 1000h per combination of the given
+        dimensions (any of Site, Unit Component, Component Type, Fault Component, Failure Mode), or the totals
+        if no dimension is given"""
+
+        dimensions = [] if dimensions is None else [dimensions] if isinstance(dimensions, str) else list(dimensions)
+        unknown_dimensions = [dimension for dimension in dimensions if dimension not in self.dimensions]
+        if unknown_dimensions:
+            raise ValueError('Unknown dimensions ' + str(unknown_dimensions) + ', available dimensions: ' +
+                             str(self.dimensions))
+
+        key = tuple(dimensions)
+        if key not in self._failure_rates:
+            self._failure_rates[key] = self._get_failure_rates(dimensions)
+
+        return self._failure_rates[key].copy()
+
+    def _get_failure_rates(self, dimensions):
+        exposure_dimensions = [dimension for dimension in dimensions if dimension in self.exposure_dimensions]
+
+        failures = _sum_per_group(self._failures, dimensions, 'Failures')
+        exposure = _sum_per_group(self._exposure, exposure_dimensions, 'Exposure Hours')
+
+        if 'Failure Mode' in dimensions:
+            failure_rates = failures.merge(exposure, how='left', on=exposure_dimensions or None) \
+                if exposure_dimensions else failures.assign(**{'Exposure Hours': exposure['Exposure Hours'].iloc[0]})
+        else:
+            failure_rates = failures.merge(exposure, how='outer', on=dimensions or None) \
+                if dimensions else pd.concat([failures, exposure], axis=1)
+            failure_rates['Failures'] = failure_rates['Failures'].fillna(0).astype(int)
+
+        exposure_hours = failure_rates['Exposure Hours'].to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            failure_rates['Failures per 1000h'] = np.where(
+                exposure_hours > 0, failure_rates['Failures'].to_numpy() / exposure_hours * 1000, np.nan)
+
+        if dimensions:
+            failure_rates = failure_rates.sort_values(by=dimensions).set_index(dimensions)
+
+        return failure_rates
+
+
+def _sum_per_group(partial_aggregates, dimensions, column):
+    if not dimensions:
+        return pd.DataFrame({column: [partial_aggregates[column].sum(min_count=1)]})
+
+    return partial_aggregates.groupby(dimensions)[column].sum(min_count=1).reset_index()
+
+# </editor-fold>
@@ -0,0 +1,21 @@
+import re
+
+
+# <editor-fold desc="File names">
+
+def get_safe_name(name):
+    """Returns the name with the characters not allowed in file names replaced by '_', e.g. 'A/B' --> 'A_B'"""
+
+    return re.sub(r'[^\w\-. ]', '_', str(name))
+
+
+def get_name_collisions(names):
+    """Returns {safe name: names} for the distinct names that share the same safe name, and so the same file"""
+
+    names_per_safe_name = {}
+    for name in dict.fromkeys(names):
+        names_per_safe_name.setdefault(get_safe_name(name), []).append(name)
+
+    return {safe_name: names for safe_name, names in names_per_safe_name.items() if len(names) > 1}
+
+# </editor-fold>
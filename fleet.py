@@ -0,0 +1,142 @@
+import pandas as pd
+import numpy as np
+import perfonitor.calculations as calculations
+import perfonitor.sampling as sampling
+import perfonitor.schema as data_schema
+import perfonitor.site_calendar as site_calendar
+
+
+# <editor-fold desc="Fleet power data">
+
+class FleetPowerData:
+    """Power data of all inverters of a site as one aligned block with shape (timestamps, inverters, quantities).
+    Quantities are, in order, AC power, Expected power, Ideal power and Irradiance. Timestamps are shared by all
+    inverters, datapoints missing for an inverter are NaN.
+
+    interval_hours are the hours each datapoint stands for, to integrate power into energy: one per timestamp if
+    all inverters share the timestamps, otherwise one per timestamp and inverter from each inverter's own timestamps
+    (0 where the inverter has no datapoint). From the timestamps if not given"""
+
+    quantities = ['AC', 'Expected', 'Ideal', 'Irradiance']
+
+    def __init__(self, timestamps, inverters, power, power_columns, interval_hours=None):
+        self.timestamps = pd.DatetimeIndex(timestamps)
+        self.inverters = list(inverters)
+        self.power = power
+        self.power_columns = power_columns
+        self.interval_hours = interval_hours if interval_hours is not None else \
+            sampling.get_interval_hours(self.timestamps)
+
+    @classmethod
+    def from_inverter_dict(cls, inverter_list, all_inverter_power_data_dict, schema=None):
+        """Builds the fleet block from all_inverter_power_data_dict, each inverter with one row per timestamp.
+        The input Dataframes are not changed"""
+
+        if schema is None:
+            schema = data_schema.PowerDataSchema.from_power_data_dict(inverter_list, all_inverter_power_data_dict)
+
+        inverter_timestamps = {}
+        power_columns = {}
+        for inverter in inverter_list:
+            power_data = all_inverter_power_data_dict[inverter]['Power Data']
+            inverter_timestamps[inverter] = pd.to_datetime(power_data['Timestamp']).to_numpy()
+            power_columns[inverter] = list(schema.get_columns(inverter, power_data))
+
+        # Most sites share the same timestamp grid for all inverters, in that case no alignment is needed
+        first_timestamps = inverter_timestamps[inverter_list[0]]
+        shared_grid = all(np.array_equal(first_timestamps, timestamps)
+                          for timestamps in inverter_timestamps.values())
+        if shared_grid:
+            timestamps = first_timestamps
+        else:
+            timestamps = np.unique(np.concatenate(list(inverter_timestamps.values())))
+
+        power = np.full((len(timestamps), len(inverter_list), len(cls.quantities)), np.nan)
+        if shared_grid:
+            interval_hours = site_calendar.get_calendar_index(timestamps).get_interval_hours()
+        else:
+            interval_hours = np.zeros((len(timestamps), len(inverter_list)))
+
+        for i, inverter in enumerate(inverter_list):
+            power_data = all_inverter_power_data_dict[inverter]['Power Data']
+            values = power_data[power_columns[inverter]].to_numpy(dtype=float)
+
+            if shared_grid:
+                power[:, i, :] = values
+            else:
+                rows = np.searchsorted(timestamps, inverter_timestamps[inverter])
+                power[rows, i, :] = values
+                interval_hours[rows, i] = sampling.get_interval_hours(inverter_timestamps[inverter])
+
+        return cls(timestamps, inverter_list, power, power_columns, interval_hours)
+
+    def get_inverter_data(self, inverter):
+        """Returns the power data of one inverter as in all_inverter_power_data_dict[inverter]['Power Data']"""
+
+        i = self.inverters.index(inverter)
+        inverter_data = pd.DataFrame(self.power[:, i, :], columns=self.power_columns[inverter])
+        inverter_data.insert(0, 'Timestamp', self.timestamps)
+
+        return inverter_data
+
+    def to_inverter_dict(self):
+        """Returns the fleet as all_inverter_power_data_dict, for code that still works per inverter"""
+
+        all_inverter_power_data_dict = {inverter: {'Power Data': self.get_inverter_data(inverter)}
+                                        for inverter in self.inverters}
+
+        return all_inverter_power_data_dict
+
+# </editor-fold>
+
+# <editor-fold desc="Fleet PR Calculation">
+
+def calculate_fleet_energy_per_period(fleet, site_info, pr_type: str = 'raw', granularity: str = 'daily'):
+    """Calculates the energy of all inverters and quantities per period in one reduction over the fleet block.
+    Returns an array with shape (periods, inverters, quantities) and the periods"""
+
+    power = fleet.power
+
+    if pr_type in ['corrected', 'corrected_DCfocus']:
+        component_info = site_info['Component Info'].set_index('Component')
+        maxexport_capacity_ac = component_info.loc[fleet.inverters, 'Capacity AC'].to_numpy(dtype=float) * 1.001
+
+        power = power.copy()
+        power[:, :, 1:3] = calculations.clip_to_export_capacity(power[:, :, 1:3],
+                                                                maxexport_capacity_ac[np.newaxis, :, np.newaxis])
+
+        if pr_type == 'corrected_DCfocus':
+            power = np.where((power[:, :, 0] > 0)[:, :, np.newaxis], power, 0)
+
+    calendar_index = site_calendar.get_calendar_index(fleet.timestamps)
+    if granularity == 'daily':
+        period_codes, periods = calendar_index.get_period_codes('Day', site_info['Days'])
+    else:
+        period_codes, periods = calendar_index.get_period_codes('Month', site_info['Months'])
+    n_timestamps, n_inverters, n_quantities = power.shape
+
+    interval_hours = fleet.interval_hours
+    if interval_hours.ndim == 2:
+        interval_hours = np.repeat(interval_hours, n_quantities, axis=1)
+    energy = calculations.sum_per_period(power.reshape(n_timestamps, n_inverters * n_quantities), period_codes,
+                                         len(periods), interval_hours)
+
+    return energy.reshape(len(periods), n_inverters, n_quantities), periods
+
+
+def calculate_pr_fleet(fleet, site_info, pr_type: str = 'raw', granularity: str = 'daily'):
+    """Calculates PR of every inverter, and site PR for monthly granularity, from the fleet block.
+    Returns the same tables as calculate_pr_inverters for the same pr_type and granularity"""
+
+    possible_prs = ['raw', 'corrected', 'corrected_DCfocus']
+    possible_gran = ['daily', 'monthly']
+
+    if pr_type not in possible_prs or granularity not in possible_gran:
+        raise ValueError('Combination of PR type and granularity not possible: ' + str(pr_type) + ", " +
+                         str(granularity))
+
+    energy, periods = calculate_fleet_energy_per_period(fleet, site_info, pr_type, granularity)
+
+    return calculations.build_pr_tables(energy, periods, fleet.inverters, fleet.power_columns, pr_type, granularity)
+
+# </editor-fold>
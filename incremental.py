@@ -0,0 +1,142 @@
+import pandas as pd
+import numpy as np
+import perfonitor.calculations as calculations
+import perfonitor.sampling as sampling
+import perfonitor.schema as data_schema
+import perfonitor.site_calendar as site_calendar
+
+
+# <editor-fold desc="Incremental PR">
+
+class IncrementalPR:
+    """Running sums of actual, expected, ideal power and irradiance per inverter and period (day and month), for
+    raw, corrected (clipped to Capacity AC * 1.001) and DC focus (AC > 0) PR. New intervals are added with append,
+    intervals already seen replace their previous values (late corrections), so the cost of an update depends only
+    on the new data. get_pr returns the same tables as calculate_pr_inverters.
+
+    The last values of every interval are kept, one row of 4 values per timestamp and inverter, to be able to undo
+    them when a correction arrives.
+
+    Every interval counts one sampling interval of energy, found from the first data appended if not given. Intervals
+    arrive in any order, so steps between timestamps are not used: for irregular data, calculate_pr_inverters
+    integrates the actual steps"""
+
+    pr_types = ['raw', 'corrected', 'corrected_DCfocus']
+    period_columns = {'daily': 'Day', 'monthly': 'Month'}
+    n_quantities = 4
+
+    def __init__(self, inverter_list, site_info, schema=None, sampling_interval=None):
+        self.inverter_list = list(inverter_list)
+        self.site_info = site_info
+        self.schema = schema if schema is not None else data_schema.PowerDataSchema()
+        self.sampling_interval = None if sampling_interval is None else pd.Timedelta(sampling_interval)
+
+        component_info = site_info['Component Info']
+        self.maxexport_capacity_ac = np.array([
+            float(component_info.loc[component_info['Component'] == inverter]['Capacity AC'].values[0]) * 1.001
+            for inverter in self.inverter_list])
+
+        n_inverters = len(self.inverter_list)
+        self._inverter_positions = {inverter: i for i, inverter in enumerate(self.inverter_list)}
+        self._row_positions = [{} for _ in range(n_inverters)]
+        self._values = [np.empty((0, self.n_quantities)) for _ in range(n_inverters)]
+        self._n_rows = [0] * n_inverters
+
+        # {granularity: {period label: array with shape (inverters, PR types * quantities)}}
+        self._period_sums = {granularity: {} for granularity in self.period_columns}
+
+    def _get_contributions(self, values, i):
+        """Returns the contribution of each datapoint to the sums of raw, corrected and DC focus PR"""
+
+        contributions = calculations.stack_pr_type_values(values, self.maxexport_capacity_ac[i])
+
+        return np.nan_to_num(contributions, nan=0.0)
+
+    def append(self, inverter, power_data):
+        """Adds new intervals of one inverter, power_data as in all_inverter_power_data_dict[inverter]['Power Data'].
+        Intervals with a timestamp already seen replace the previous values"""
+
+        i = self._inverter_positions[inverter]
+        columns = list(self.schema.get_columns(inverter, power_data))
+
+        timestamps = pd.DatetimeIndex(pd.to_datetime(power_data['Timestamp']))
+        values = power_data[columns].to_numpy(dtype=float)
+
+        # Within the new data, the last value of a repeated timestamp is the valid one
+        last_values = ~timestamps.duplicated(keep='last')
+        if not last_values.all():
+            timestamps = timestamps[last_values]
+            values = values[last_values]
+
+        if len(timestamps) == 0:
+            return
+        if self.sampling_interval is None and len(timestamps) > 1:
+            self.sampling_interval = sampling.get_sampling_interval(timestamps)
+
+        row_positions = self._row_positions[i]
+        positions = np.array([row_positions.get(timestamp, -1) for timestamp in timestamps.asi8])
+        seen = positions >= 0
+
+        # Difference to the sums: new values, minus the previous values of corrected intervals
+        delta = self._get_contributions(values, i)
+        if seen.any():
+            delta[seen] -= self._get_contributions(self._values[i][positions[seen]], i)
+            self._values[i][positions[seen]] = values[seen]
+
+        if not seen.all():
+            new_values = values[~seen]
+            start = self._n_rows[i]
+            if start + len(new_values) > len(self._values[i]):
+                grown_values = np.empty((max(2 * len(self._values[i]), start + len(new_values)), self.n_quantities))
+                grown_values[:start] = self._values[i][:start]
+                self._values[i] = grown_values
+            self._values[i][start:start + len(new_values)] = new_values
+            row_positions.update(zip(timestamps.asi8[~seen], range(start, start + len(new_values))))
+            self._n_rows[i] = start + len(new_values)
+
+        calendar_index = site_calendar.CalendarIndex(timestamps)
+        for granularity, period_column in self.period_columns.items():
+            period_labels = calendar_index.labels[period_column]
+            period_sums = calculations.sum_per_period(delta, calendar_index.codes[period_column], len(period_labels))
+
+            for period, sums in zip(period_labels, period_sums):
+                if period not in self._period_sums[granularity]:
+                    self._period_sums[granularity][period] = np.zeros((len(self.inverter_list), delta.shape[1]))
+                self._period_sums[granularity][period][i] += sums
+
+    def append_site(self, all_inverter_power_data_dict):
+        """Adds new intervals of all inverters in all_inverter_power_data_dict"""
+
+        for inverter, inverter_data in all_inverter_power_data_dict.items():
+            self.append(inverter, inverter_data['Power Data'])
+
+    def get_energy(self, pr_type: str = 'raw', granularity: str = 'daily', periods_under_analysis=None):
+        """Returns the energy per period with shape (periods, inverters, quantities) and the periods.
+        Periods under analysis are the site_info Days or Months if not given"""
+
+        if periods_under_analysis is None:
+            periods_under_analysis = self.site_info['Days'] if granularity == 'daily' else self.site_info['Months']
+
+        periods = pd.Index(list(dict.fromkeys(periods_under_analysis)))
+        no_data = np.zeros((len(self.inverter_list), len(self.pr_types) * self.n_quantities))
+        all_energy = np.array([self._period_sums[granularity].get(period, no_data) for period in periods])
+        all_energy = all_energy.reshape(len(periods), len(self.inverter_list), len(self.pr_types) * self.n_quantities)
+
+        sampling_interval = self.sampling_interval if self.sampling_interval is not None \
+            else sampling.default_sampling_interval
+        interval_hours = sampling_interval / pd.Timedelta(hours=1)
+
+        i = self.pr_types.index(pr_type)
+        energy = all_energy[:, :, i * self.n_quantities:(i + 1) * self.n_quantities] * interval_hours
+
+        return energy, periods
+
+    def get_pr(self, pr_type: str = 'raw', granularity: str = 'daily', periods_under_analysis=None):
+        """Returns the same PR tables as calculate_pr_inverters for all intervals appended so far"""
+
+        energy, periods = self.get_energy(pr_type, granularity, periods_under_analysis)
+        power_columns = {inverter: self.schema.get_columns(inverter) for inverter in self.inverter_list}
+
+        return calculations.build_pr_tables(energy, periods, self.inverter_list, power_columns, pr_type, granularity)
+
+# </editor-fold>
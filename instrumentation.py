@@ -0,0 +1,123 @@
+import json
+import time
+import logging
+import contextlib
+import pandas as pd
+
+
+# <editor-fold desc="Logging">
+
+logger = logging.getLogger('perfonitor')
+logger.addHandler(logging.NullHandler())
+
+
+def set_log_level(level=logging.INFO, log_format: str = '%(asctime)s %(name)s %(levelname)s %(message)s'):
+    """Sets the level of the perfonitor loggers, e.g. logging.DEBUG for per inverter messages and spans, and adds a
+    console handler if there is none"""
+
+    logger.setLevel(level)
+    if not any(isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.NullHandler)
+               for handler in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(log_format))
+        logger.addHandler(handler)
+
+
+def get_logger(module_name):
+    """Logger of a perfonitor module, child of the 'perfonitor' logger"""
+
+    return logging.getLogger('perfonitor.' + module_name.rsplit('.', 1)[-1])
+
+# </editor-fold>
+
+# <editor-fold desc="Spans and metrics">
+
+_span_logger = get_logger('spans')
+_metrics_hooks = []
+_active_spans = []
+
+
+class MetricsRecorder:
+    """Collects the spans (stage, wall time, rows and other attributes) that finish while it is active, see
+    record_metrics. Spans run in worker processes are not collected"""
+
+    def __init__(self):
+        self.spans = []
+
+    def __call__(self, span):
+        self.spans.append(span)
+
+    def to_dataframe(self):
+        return pd.DataFrame(self.spans)
+
+    def get_summary(self):
+        """Total, mean and max wall time and total rows per stage"""
+
+        spans = self.to_dataframe()
+        if spans.empty:
+            return spans
+
+        summary = spans.groupby('stage')['wall_time'].agg(['count', 'sum', 'mean', 'max'])
+        summary.columns = ['Spans', 'Total (s)', 'Mean (s)', 'Max (s)']
+        if 'rows' in spans.columns:
+            summary['Rows'] = spans.groupby('stage')['rows'].sum(min_count=1)
+
+        return summary.sort_values('Total (s)', ascending=False)
+
+    def to_json(self, output_file):
+        """Saves the spans as a JSON report"""
+
+        with open(output_file, 'w') as file:
+            json.dump({'spans': self.spans}, file, indent=2, default=str)
+
+
+def add_metrics_hook(hook):
+    """Calls hook(span) with the dictionary of every finished span, e.g. to export metrics"""
+
+    _metrics_hooks.append(hook)
+
+
+def remove_metrics_hook(hook):
+    if hook in _metrics_hooks:
+        _metrics_hooks.remove(hook)
+
+
+@contextlib.contextmanager
+def record_metrics(output_file=None):
+    """Collects the spans of the block in a MetricsRecorder, saved as JSON to output_file if given"""
+
+    recorder = MetricsRecorder()
+    add_metrics_hook(recorder)
+    try:
+        yield recorder
+    finally:
+        remove_metrics_hook(recorder)
+        if output_file is not None:
+            recorder.to_json(output_file)
+
+
+@contextlib.contextmanager
+def span(stage, **attributes):
+    """Measures the wall time (seconds) of a stage, with attributes such as inverter or rows. Finished spans are
+    logged at DEBUG level and passed to the metrics hooks as {'stage', 'parent', 'wall_time', attributes}.
+    Attributes can be added inside the block with the yielded dictionary. Nested spans keep the name of their parent
+    stage"""
+
+    span_data = {'stage': stage, 'parent': _active_spans[-1]['stage'] if _active_spans else None}
+    span_data.update(attributes)
+
+    _active_spans.append(span_data)
+    start = time.perf_counter()
+    try:
+        yield span_data
+    finally:
+        span_data['wall_time'] = time.perf_counter() - start
+        _active_spans.pop()
+
+        if _span_logger.isEnabledFor(logging.DEBUG):
+            _span_logger.debug(stage + ' ' + ', '.join(key + ': ' + str(value) for key, value in span_data.items()
+                                                      if key not in ['stage', 'parent']))
+        for hook in list(_metrics_hooks):
+            hook(span_data)
+
+# </editor-fold>
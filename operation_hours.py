@@ -0,0 +1,97 @@
+import pandas as pd
+import numpy as np
+import perfonitor.sampling as sampling
+
+
+# <editor-fold desc="Operation hours index">
+
+class OperationHoursIndex:
+    """Valid readings (not NaN) of each component's operation hours, sorted by timestamp, built once from
+    df_operation_hours. Answers "last valid reading at or before t" with a binary search, for one timestamp or for
+    arrays of timestamps, instead of scanning the Timestamp column and stepping back one interval while NaN.
+    sampling_interval is the interval of the readings, found from the timestamps (see sampling.get_sampling_interval)"""
+
+    def __init__(self, df_operation_hours):
+        timestamps = pd.DatetimeIndex(pd.to_datetime(df_operation_hours['Timestamp']))
+        self.tz = timestamps.tz
+        self.components = [column for column in df_operation_hours.columns if column != 'Timestamp']
+        self.sampling_interval = sampling.get_sampling_interval(timestamps)
+
+        timestamp_values = timestamps.asi8
+        has_timestamp = ~timestamps.isna()
+
+        # {component: (sorted timestamps of valid readings, readings)}
+        self._readings = {}
+        for component in self.components:
+            operation_hours = pd.to_numeric(df_operation_hours[component], errors='coerce').to_numpy(dtype=float)
+            valid_readings = np.flatnonzero(~np.isnan(operation_hours) & has_timestamp)
+            order = np.argsort(timestamp_values[valid_readings], kind='stable')
+            valid_readings = valid_readings[order]
+
+            self._readings[component] = (timestamp_values[valid_readings], operation_hours[valid_readings])
+
+    def __contains__(self, component):
+        return component in self._readings
+
+    def _get_timestamp_values(self, timestamps):
+        timestamps = pd.DatetimeIndex(pd.to_datetime(timestamps))
+        if self.tz is not None and timestamps.tz is None:
+            timestamps = timestamps.tz_localize(self.tz)
+        elif self.tz is None and timestamps.tz is not None:
+            timestamps = timestamps.tz_localize(None)
+
+        return timestamps.asi8
+
+    def _to_timestamps(self, timestamp_values):
+        timestamps = pd.DatetimeIndex(timestamp_values.view('datetime64[ns]'))
+        if self.tz is not None:
+            timestamps = timestamps.tz_localize('UTC').tz_convert(self.tz)
+
+        return timestamps
+
+    def _search(self, component, timestamp_values):
+        reading_timestamps, operation_hours = self._readings[component]
+
+        positions = np.searchsorted(reading_timestamps, timestamp_values, side='right') - 1
+        found = (positions >= 0) & (timestamp_values != pd.NaT.value)
+
+        readings = np.full(len(timestamp_values), np.nan)
+        readings[found] = operation_hours[positions[found]]
+        found_timestamps = np.full(len(timestamp_values), pd.NaT.value, dtype=np.int64)
+        found_timestamps[found] = reading_timestamps[positions[found]]
+
+        return readings, found_timestamps
+
+    def get_readings_at(self, component, timestamps):
+        """Returns the last valid operation hours of the component at or before each timestamp (NaN if there is
+        none) and the timestamps of those readings (NaT if there is none)"""
+
+        readings, found_timestamps = self._search(component, self._get_timestamp_values(timestamps))
+
+        return readings, self._to_timestamps(found_timestamps)
+
+    def get_reading_at(self, component, timestamp):
+        """Returns the last valid operation hours of the component at or before the timestamp (NaN if none)"""
+
+        readings, _ = self._search(component, self._get_timestamp_values([timestamp]))
+
+        return float(readings[0])
+
+    def get_component_readings_at(self, components, timestamps):
+        """Same as get_readings_at for arrays of components and timestamps of the same length, components without
+        operation hours get NaN"""
+
+        components = np.asarray(components, dtype=object)
+        timestamp_values = self._get_timestamp_values(timestamps)
+
+        readings = np.full(len(components), np.nan)
+        found_timestamps = np.full(len(components), pd.NaT.value, dtype=np.int64)
+        for component in pd.unique(components):
+            if component not in self._readings:
+                continue
+            rows = np.flatnonzero(components == component)
+            readings[rows], found_timestamps[rows] = self._search(component, timestamp_values[rows])
+
+        return readings, self._to_timestamps(found_timestamps)
+
+# </editor-fold>
@@ -0,0 +1,133 @@
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import perfonitor.calculations as calculations
+import perfonitor.schema as data_schema
+
+
+# <editor-fold desc="Shared memory power data">
+
+class SharedPowerData:
+    """Power data of several inverters in shared memory, so that worker processes read the arrays instead of
+    receiving pickled Dataframes. Values of all inverters are stacked in one block, with the rows of each inverter
+    between its start and end. Only the name of the memory blocks and the layout are pickled"""
+
+    def __init__(self, values_name, timestamps_name, n_rows, n_columns, inverter_layout, timezones):
+        self.values_name = values_name
+        self.timestamps_name = timestamps_name
+        self.n_rows = n_rows
+        self.n_columns = n_columns
+        self.inverter_layout = inverter_layout
+        self.timezones = timezones
+
+    @classmethod
+    def create(cls, inverter_list, all_inverter_power_data_dict, schema=None):
+        """Copies Timestamp, AC, Expected, Ideal and Irradiance of each inverter to shared memory.
+        The caller owns the memory blocks and must call unlink once all workers are done"""
+
+        if schema is None:
+            schema = data_schema.PowerDataSchema.from_power_data_dict(inverter_list, all_inverter_power_data_dict)
+
+        n_quantities = len(schema.quantities)
+        inverter_layout = {}
+        timezones = {}
+        n_rows = 0
+        for inverter in inverter_list:
+            power_data = all_inverter_power_data_dict[inverter]['Power Data']
+            columns = list(schema.get_columns(inverter, power_data))
+
+            inverter_layout[inverter] = (n_rows, n_rows + len(power_data), columns)
+            n_rows += len(power_data)
+
+        values_memory = shared_memory.SharedMemory(create=True, size=max(n_rows * n_quantities * 8, 1))
+        timestamps_memory = shared_memory.SharedMemory(create=True, size=max(n_rows * 8, 1))
+
+        values = np.ndarray((n_rows, n_quantities), dtype=float, buffer=values_memory.buf)
+        timestamps = np.ndarray((n_rows,), dtype=np.int64, buffer=timestamps_memory.buf)
+        for inverter in inverter_list:
+            power_data = all_inverter_power_data_dict[inverter]['Power Data']
+            start, end, columns = inverter_layout[inverter]
+
+            inverter_timestamps = pd.DatetimeIndex(pd.to_datetime(power_data['Timestamp']))
+            timezones[inverter] = inverter_timestamps.tz
+            timestamps[start:end] = inverter_timestamps.asi8
+            values[start:end] = power_data[columns].to_numpy(dtype=float)
+
+        shared_power_data = cls(values_memory.name, timestamps_memory.name, n_rows, n_quantities,
+                                inverter_layout, timezones)
+        shared_power_data._memory_blocks = [values_memory, timestamps_memory]
+
+        return shared_power_data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_memory_blocks', None)
+        return state
+
+    def get_inverter_data(self, inverter):
+        """Returns a copy of the power data of one inverter as a Dataframe with Timestamp and power columns"""
+
+        start, end, columns = self.inverter_layout[inverter]
+
+        values_memory = shared_memory.SharedMemory(name=self.values_name)
+        timestamps_memory = shared_memory.SharedMemory(name=self.timestamps_name)
+        try:
+            values = np.ndarray((self.n_rows, self.n_columns), dtype=float, buffer=values_memory.buf)
+            timestamps = np.ndarray((self.n_rows,), dtype=np.int64, buffer=timestamps_memory.buf)
+
+            inverter_data = pd.DataFrame(values[start:end].copy(), columns=columns)
+            inverter_timestamps = pd.DatetimeIndex(timestamps[start:end].copy().view('datetime64[ns]'))
+            del values, timestamps
+        finally:
+            values_memory.close()
+            timestamps_memory.close()
+
+        if self.timezones[inverter] is not None:
+            inverter_timestamps = inverter_timestamps.tz_localize('UTC').tz_convert(self.timezones[inverter])
+        inverter_data.insert(0, 'Timestamp', inverter_timestamps)
+
+        return inverter_data
+
+    def unlink(self):
+        """Releases the shared memory blocks, only in the process that created them"""
+
+        for memory_block in getattr(self, '_memory_blocks', []):
+            memory_block.close()
+            memory_block.unlink()
+        self._memory_blocks = []
+
+# </editor-fold>
+
+# <editor-fold desc="Process pool PR Calculation">
+
+def _calculate_pr_inverter_from_shared_memory(shared_power_data, inverter, site_info, pr_type, granularity, schema):
+    power_data = shared_power_data.get_inverter_data(inverter)
+
+    return calculations.calculate_pr_inverter(power_data, inverter, site_info, pr_type, granularity, schema)
+
+
+def calculate_pr_inverters_in_pool(inverter_list, all_inverter_power_data_dict, site_info, pr_type: str = 'raw',
+                                   granularity: str = 'daily', workers: int = None, executor=None, schema=None):
+    """Calculates PR of each inverter in a process pool, with power data passed through shared memory.
+    Uses the given executor, or a new ProcessPoolExecutor with workers processes.
+    Returns the results of calculate_pr_inverter in the order of inverter_list"""
+
+    if schema is None:
+        schema = data_schema.PowerDataSchema.from_power_data_dict(inverter_list, all_inverter_power_data_dict)
+
+    shared_power_data = SharedPowerData.create(inverter_list, all_inverter_power_data_dict, schema)
+    pool = executor if executor is not None else ProcessPoolExecutor(max_workers=workers)
+
+    try:
+        futures = [pool.submit(_calculate_pr_inverter_from_shared_memory, shared_power_data, inverter, site_info,
+                               pr_type, granularity, schema) for inverter in inverter_list]
+        inverter_results = [future.result() for future in futures]
+    finally:
+        if executor is None:
+            pool.shutdown()
+        shared_power_data.unlink()
+
+    return inverter_results
+
+# </editor-fold>
@@ -0,0 +1,166 @@
+import pandas as pd
+import numpy as np
+
+
+# <editor-fold desc="Lifetimes">
+
+def get_lifetimes(all_events_summary, group_column: str = 'Fault Component'):
+    """Returns the lifetimes of the events summary grouped by fault component (or another column), as
+    (groups, times, failures, group_starts): times and failures (1 for 'Failure' Yes, 0 for the censored end of
+    analysis entries) sorted by group, each group starting at its position in group_starts.
+    Entries without a Time to Failure, or with a negative one, are left out. Zero times are kept, fit_weibull leaves
+    them out itself"""
+
+    times = pd.to_numeric(all_events_summary['Time to Failure'], errors='coerce').to_numpy(dtype=float)
+    failures = (all_events_summary['Failure'] == "Yes").to_numpy(dtype=float)
+    group_codes, groups = pd.factorize(all_events_summary[group_column], sort=True)
+
+    valid = (times >= 0) & (group_codes >= 0)
+    order = np.argsort(group_codes[valid], kind='stable')
+    times, failures, group_codes = times[valid][order], failures[valid][order], group_codes[valid][order]
+
+    # Only groups with lifetimes
+    present_codes, group_starts = np.unique(group_codes, return_index=True)
+
+    return pd.Index(groups[present_codes], name=group_column), times, failures, group_starts
+
+# </editor-fold>
+
+# <editor-fold desc="Model fitting">
+
+def fit_exponential(times, failures, group_starts):
+    """Maximum likelihood failure rate (failures per hour) of each group with right censoring: failures / total time.
+    times and failures can have a leading batch axis, e.g. (bootstrap samples, lifetimes)"""
+
+    n_failures = np.add.reduceat(failures, group_starts, axis=-1)
+    total_time = np.add.reduceat(times, group_starts, axis=-1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return n_failures / total_time
+
+
+def fit_weibull(times, failures, group_starts, max_iterations: int = 100, tolerance: float = 1e-10):
+    """Maximum likelihood Weibull shape and scale of each group with right censoring. Solves the profile likelihood
+    equation of the shape for all groups (and all batches, if times has a leading batch axis) at once with a
+    bracketed Newton method. Groups without failures, or without a finite solution (e.g. all failures at the same
+    time), get NaN. Zero times have no Weibull log-likelihood (log(0)) and are left out of the fit only"""
+
+    group_sizes = np.diff(np.append(group_starts, times.shape[-1]))
+    group_positions = np.repeat(np.arange(len(group_starts)), group_sizes)
+
+    positive = times > 0
+    failures = failures * positive
+
+    # Times are scaled by the largest time of the group, t^k stays <= 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_times = np.where(positive, np.log(np.where(positive, times, 1)), -np.inf)
+        log_max_times = np.maximum.reduceat(log_times, group_starts, axis=-1)
+        log_times = np.where(positive, log_times - log_max_times[..., group_positions], 0)
+
+    n_failures = np.add.reduceat(failures, group_starts, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_log_failure_time = np.add.reduceat(failures * log_times, group_starts, axis=-1) / n_failures
+
+    shape = np.ones(n_failures.shape)
+    lower, upper = np.full(shape.shape, 1e-3), np.full(shape.shape, 1e3)
+    for _ in range(max_iterations):
+        weights = np.where(positive, np.exp(shape[..., group_positions] * log_times), 0)
+        s0 = np.add.reduceat(weights, group_starts, axis=-1)
+        s1 = np.add.reduceat(weights * log_times, group_starts, axis=-1)
+        s2 = np.add.reduceat(weights * log_times ** 2, group_starts, axis=-1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            equation = s1 / s0 - 1 / shape - mean_log_failure_time
+            derivative = (s2 * s0 - s1 ** 2) / s0 ** 2 + 1 / shape ** 2
+
+            # The equation increases with the shape, the root stays between lower and upper
+            upper = np.where(equation > 0, shape, upper)
+            lower = np.where(equation <= 0, shape, lower)
+            newton_shape = shape - equation / derivative
+
+        bisection_shape = np.sqrt(lower * upper)
+        new_shape = np.where((newton_shape > lower) & (newton_shape < upper), newton_shape, bisection_shape)
+
+        converged = np.nanmax(np.abs(new_shape - shape) / shape, initial=0) < tolerance
+        shape = new_shape
+        if converged:
+            break
+
+    s0 = np.add.reduceat(np.where(positive, np.exp(shape[..., group_positions] * log_times), 0), group_starts,
+                         axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.exp(log_max_times) * (s0 / n_failures) ** (1 / shape)
+
+    no_solution = (n_failures == 0) | (shape <= 1.001e-3) | (shape >= 0.999e3) | ~np.isfinite(mean_log_failure_time)
+    shape = np.where(no_solution, np.nan, shape)
+    scale = np.where(no_solution, np.nan, scale)
+
+    return shape, scale
+
+
+def get_bootstrap_samples(times, failures, group_starts, n_bootstrap: int = 1000, seed=None):
+    """Resamples the lifetimes of every group with replacement, n_bootstrap times, drawn as one array with shape
+    (n_bootstrap, lifetimes) that keeps the group layout of times and failures"""
+
+    rng = np.random.default_rng(seed)
+
+    group_sizes = np.diff(np.append(group_starts, len(times)))
+    group_positions = np.repeat(np.arange(len(group_starts)), group_sizes)
+
+    draws = (rng.random((n_bootstrap, len(times))) * group_sizes[group_positions]).astype(np.int64)
+    sample_rows = group_starts[group_positions] + np.minimum(draws, group_sizes[group_positions] - 1)
+
+    return times[sample_rows], failures[sample_rows]
+
+
+def fit_reliability_models(all_events_summary, group_column: str = 'Fault Component', n_bootstrap: int = 1000,
+                           confidence: float = 0.9, seed=None):
+    """Fits exponential and Weibull models with right censoring for every fault component (or group_column) of the
+    events summary at once, with percentile bootstrap confidence intervals. Bootstrap samples are fitted together,
+    memory grows with n_bootstrap * number of lifetimes.
+
+    Returns a Dataframe per group with Failures, Censored, Exposure Hours, Failures per 1000h, MTBF, Weibull Shape
+    and Weibull Scale, and the Lower/Upper bounds of the failure rate and Weibull parameters"""
+
+    groups, times, failures, group_starts = get_lifetimes(all_events_summary, group_column)
+
+    n_lifetimes = np.diff(np.append(group_starts, len(times)))
+    n_failures = np.add.reduceat(failures, group_starts) if len(times) else np.zeros(0)
+    exposure_hours = np.add.reduceat(times, group_starts) if len(times) else np.zeros(0)
+
+    reliability_models = pd.DataFrame({'Failures': n_failures.astype(int),
+                                       'Censored': (n_lifetimes - n_failures).astype(int),
+                                       'Exposure Hours': exposure_hours}, index=groups)
+    if len(times) == 0:
+        for column in ['Failures per 1000h', 'MTBF', 'Weibull Shape', 'Weibull Scale']:
+            reliability_models[column] = np.nan
+        return reliability_models
+
+    failure_rate = fit_exponential(times, failures, group_starts)
+    shape, scale = fit_weibull(times, failures, group_starts)
+
+    bootstrap_times, bootstrap_failures = get_bootstrap_samples(times, failures, group_starts, n_bootstrap, seed)
+    bootstrap_failure_rate = fit_exponential(bootstrap_times, bootstrap_failures, group_starts)
+    bootstrap_shape, bootstrap_scale = fit_weibull(bootstrap_times, bootstrap_failures, group_starts)
+
+    percentiles = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+    with np.errstate(divide='ignore'):
+        parameters = {'Failures per 1000h': (failure_rate * 1000, bootstrap_failure_rate * 1000),
+                      'MTBF': (1 / failure_rate, None),
+                      'Weibull Shape': (shape, bootstrap_shape),
+                      'Weibull Scale': (scale, bootstrap_scale)}
+
+    for parameter, (estimate, bootstrap_estimates) in parameters.items():
+        reliability_models[parameter] = estimate
+        if bootstrap_estimates is not None:
+            bootstrap_estimates = np.where(np.isfinite(bootstrap_estimates), bootstrap_estimates, np.nan)
+            all_nan = np.isnan(bootstrap_estimates).all(axis=0)
+            bounds = np.full((2, len(groups)), np.nan)
+            if not all_nan.all():
+                bounds[:, ~all_nan] = np.nanpercentile(bootstrap_estimates[:, ~all_nan], percentiles, axis=0)
+            reliability_models[parameter + ' Lower'] = bounds[0]
+            reliability_models[parameter + ' Upper'] = bounds[1]
+
+    return reliability_models
+
+# </editor-fold>
@@ -0,0 +1,175 @@
+import re
+import pandas as pd
+import numpy as np
+import perfonitor.fleet as fleet_data
+
+
+# <editor-fold desc="Component hierarchy">
+
+def get_inverter_blocks(inverter_list, site_info, block_column: str = 'Block'):
+    """Returns the block of each inverter, from the block column of site_info['Component Info'] if there is one,
+    otherwise from the inverter name (Inverter 2.1 --> Block 2), or one block for all inverters"""
+
+    component_info = site_info['Component Info']
+    if block_column in component_info.columns:
+        blocks = component_info.set_index('Component')[block_column]
+        return [str(blocks[inverter]) for inverter in inverter_list]
+
+    block_numbers = [re.search(r'(\d+)\.\d+', str(inverter)) for inverter in inverter_list]
+    if all(block_numbers):
+        return ['Block ' + block_number.group(1) for block_number in block_numbers]
+
+    return ['Block'] * len(inverter_list)
+
+
+def get_hierarchy(site_inverters, site_infos, block_column: str = 'Block'):
+    """Returns the nodes of the hierarchy (Level, Site, Node), inverters first, then blocks, sites and the portfolio,
+    and the node of every inverter at each level as {level: codes}, codes numbering the nodes of that level from 0.
+    Inverters of all sites are in the order of site_inverters"""
+
+    inverter_sites = []
+    inverter_blocks = []
+    inverters = []
+    for site, inverter_list in site_inverters.items():
+        inverter_sites += [site] * len(inverter_list)
+        inverter_blocks += get_inverter_blocks(inverter_list, site_infos[site], block_column)
+        inverters += list(inverter_list)
+
+    blocks = list(dict.fromkeys(zip(inverter_sites, inverter_blocks)))
+    block_positions = {block: n for n, block in enumerate(blocks)}
+    site_positions = {site: n for n, site in enumerate(site_inverters)}
+
+    node_codes = {'Inverter': np.arange(len(inverters)),
+                  'Block': np.array([block_positions[block] for block in zip(inverter_sites, inverter_blocks)],
+                                    dtype=np.int64),
+                  'Site': np.array([site_positions[site] for site in inverter_sites], dtype=np.int64),
+                  'Portfolio': np.zeros(len(inverters), dtype=np.int64)}
+
+    node_keys = [('Inverter', site, inverter) for site, inverter in zip(inverter_sites, inverters)]
+    node_keys += [('Block', site, block) for site, block in blocks]
+    node_keys += [('Site', site, site) for site in site_inverters]
+    node_keys += [('Portfolio', 'Portfolio', 'Portfolio')]
+
+    nodes = pd.MultiIndex.from_tuples(node_keys, names=['Level', 'Site', 'Node'])
+
+    return nodes, node_codes
+
+# </editor-fold>
+
+# <editor-fold desc="Rollup">
+
+def rollup_energy(site_energies, site_infos, block_column: str = 'Block'):
+    """Aggregates the energy of the inverters of one or more sites to inverter, block, site and portfolio level, with
+    one sum per node and level over the inverters sorted by node. site_energies is {site: (energy, periods, inverter_list)}, energy with shape (periods,
+    inverters, quantities) for AC, Expected, Ideal and Irradiance as returned by
+    fleet.calculate_fleet_energy_per_period, IncrementalPR.get_energy or EnergyCache.get_site_energy.
+
+    PR of a node is the AC energy over the Ideal energy of all its inverters, so larger inverters weigh more, as
+    Site PR % in calculate_pr_inverters. Irradiation is the capacity weighted mean of the inverters.
+    Returns a Dataframe indexed by Level, Site, Node and Period"""
+
+    site_inverters = {site: list(inverter_list) for site, (_, _, inverter_list) in site_energies.items()}
+    nodes, node_codes = get_hierarchy(site_inverters, site_infos, block_column)
+
+    # Periods of all sites, a site without data in a period adds nothing
+    periods = pd.Index(list(dict.fromkeys(period for _, site_periods, _ in site_energies.values()
+                                          for period in site_periods)), name='Period')
+    energy = np.concatenate([_reindex_periods(site_energy, site_periods, periods)
+                             for site_energy, site_periods, _ in site_energies.values()], axis=1)
+
+    capacities = np.concatenate([
+        site_infos[site]['Component Info'].set_index('Component').loc[inverter_list, 'Capacity AC'].to_numpy(
+            dtype=float) for site, inverter_list in site_inverters.items()])
+
+    # Energy and capacity weighted irradiance of the inverters, summed per node of each level. Inverter nodes are
+    # the inverters themselves
+    inverter_sums = np.concatenate([energy[:, :, :3], (energy[:, :, 3] * capacities)[:, :, np.newaxis]], axis=2)
+    node_levels = nodes.get_level_values('Level')
+    node_sums = [inverter_sums]
+    node_capacities = [capacities]
+    for level in ['Block', 'Site', 'Portfolio']:
+        n_level_nodes = np.count_nonzero(node_levels == level)
+        node_sums.append(_sum_per_node(inverter_sums, node_codes[level], n_level_nodes))
+        node_capacities.append(_sum_per_node(capacities[np.newaxis], node_codes[level], n_level_nodes)[0])
+    node_sums = np.concatenate(node_sums, axis=1)
+    node_capacities = np.concatenate(node_capacities)
+
+    node_energy = node_sums[:, :, :3]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        node_irradiation = node_sums[:, :, 3] / node_capacities
+        node_pr = node_energy[:, :, 0] / node_energy[:, :, 2]
+
+    # One row per node and period, nodes in hierarchy order
+    n_periods, n_nodes = node_pr.shape
+    index = pd.MultiIndex.from_arrays(
+        [np.repeat(nodes.get_level_values(level), n_periods) for level in nodes.names] +
+        [np.tile(periods, n_nodes)], names=list(nodes.names) + ['Period'])
+
+    rollup = pd.DataFrame({'Capacity AC': np.repeat(node_capacities, n_periods),
+                           'AC Energy': node_energy[:, :, 0].T.ravel(),
+                           'Expected Energy': node_energy[:, :, 1].T.ravel(),
+                           'Ideal Energy': node_energy[:, :, 2].T.ravel(),
+                           'Irradiation': node_irradiation.T.ravel(),
+                           'PR %': node_pr.T.ravel()}, index=index)
+
+    return rollup
+
+
+def calculate_pr_rollup(sites, pr_type: str = 'raw', granularity: str = 'daily', block_column: str = 'Block'):
+    """Calculates PR at inverter, block, site and portfolio level. sites is {site: (inverter_list,
+    all_inverter_power_data_dict, site_info)}. Returns the rollup of rollup_energy"""
+
+    site_energies = {}
+    site_infos = {}
+    for site, (inverter_list, all_inverter_power_data_dict, site_info) in sites.items():
+        fleet = fleet_data.FleetPowerData.from_inverter_dict(inverter_list, all_inverter_power_data_dict)
+        energy, periods = fleet_data.calculate_fleet_energy_per_period(fleet, site_info, pr_type, granularity)
+
+        site_energies[site] = (energy, periods, inverter_list)
+        site_infos[site] = site_info
+
+    return rollup_energy(site_energies, site_infos, block_column)
+
+
+def get_pr_table(rollup, level: str = 'Block'):
+    """Returns the PR of one level as a table with one row per period and one column per node"""
+
+    level_rollup = rollup[rollup.index.get_level_values('Level') == level].droplevel('Level')
+    pr_table = level_rollup['PR %'].unstack(['Site', 'Node'])
+    if level in ['Site', 'Portfolio']:
+        pr_table.columns = pr_table.columns.get_level_values('Node')
+
+    return pr_table
+
+
+def _sum_per_node(values, codes, n_nodes):
+    """Sums values with shape (periods, inverters, ...) over the inverters of each node, codes being the node of each
+    inverter. Inverters are sorted by node (unless they already are) and each node is summed with np.add.reduceat"""
+
+    node_sums = np.zeros((values.shape[0], n_nodes) + values.shape[2:])
+    if len(codes) == 0:
+        return node_sums
+
+    if (np.diff(codes) < 0).any():
+        order = np.argsort(codes, kind='stable')
+        codes = codes[order]
+        values = values[:, order]
+
+    node_starts = np.flatnonzero(np.diff(codes, prepend=-1))
+    node_sums[:, codes[node_starts]] = np.add.reduceat(values, node_starts, axis=1)
+
+    return node_sums
+
+
+def _reindex_periods(energy, periods, all_periods):
+    energy = np.asarray(energy, dtype=float)
+    if len(periods) == 0:
+        # e.g. a site whose timeframe has no days in site_info
+        return np.zeros((len(all_periods),) + energy.shape[1:])
+
+    positions = pd.Index(periods).get_indexer(all_periods)
+    reindexed_energy = np.where((positions >= 0)[:, np.newaxis, np.newaxis], energy[positions], 0)
+
+    return reindexed_energy
+
+# </editor-fold>
@@ -0,0 +1,327 @@
+import pandas as pd
+import numpy as np
+import perfonitor.schema as data_schema
+
+
+# <editor-fold desc="Sampling interval">
+
+default_sampling_interval = pd.Timedelta(minutes=15)
+
+# Steps up to this factor of the sampling interval are irregular sampling, longer steps are missing datapoints
+max_interval_factor = 1.5
+
+
+def _get_timestamp_values(timestamps):
+    return pd.DatetimeIndex(pd.to_datetime(timestamps)).asi8
+
+
+def get_sampling_interval(timestamps):
+    """Returns the sampling interval of the timestamps as a Timedelta: the median step between consecutive distinct
+    timestamps, 15 minutes if there are less than two"""
+
+    timestamp_values = _get_timestamp_values(timestamps)
+    steps = np.diff(np.unique(timestamp_values[timestamp_values != pd.NaT.value]))
+    if len(steps) == 0:
+        return default_sampling_interval
+
+    return pd.Timedelta(int(np.median(steps)), unit='ns')
+
+
+def get_max_interval(sampling_interval, max_interval=None):
+    """Longest step between two datapoints still counted as sampled, by default 1.5 times the sampling interval"""
+
+    if max_interval is not None:
+        return pd.Timedelta(max_interval)
+
+    return pd.Timedelta(int(pd.Timedelta(sampling_interval).value * max_interval_factor), unit='ns')
+
+
+def get_interval_hours(timestamps, sampling_interval=None, max_interval=None):
+    """Returns the hours each datapoint stands for, to integrate power into energy (energy = sum(power * hours)).
+    A datapoint lasts until the next timestamp, except the last one and those followed by a step longer than
+    max_interval (missing datapoints), which last one sampling interval. The sampling interval is found from the
+    timestamps if not given. With 15 minute data every datapoint is 0.25 hours, as the former energy = sum / 4.
+    Repeated timestamps each count in full and datapoints without timestamp count 0 hours"""
+
+    timestamp_values = _get_timestamp_values(timestamps)
+    has_timestamp = timestamp_values != pd.NaT.value
+
+    unique_values, positions = np.unique(timestamp_values[has_timestamp], return_inverse=True)
+    if sampling_interval is None:
+        sampling_interval = pd.Timedelta(int(np.median(np.diff(unique_values))), unit='ns') \
+            if len(unique_values) > 1 else default_sampling_interval
+    interval = pd.Timedelta(sampling_interval).value
+    max_interval = get_max_interval(sampling_interval, max_interval).value
+
+    steps = np.diff(unique_values, append=unique_values[-1:] + interval)
+    steps = np.where(steps <= max_interval, steps, interval)
+
+    interval_hours = np.zeros(len(timestamp_values))
+    interval_hours[has_timestamp] = steps[positions.ravel()] / pd.Timedelta(hours=1).value
+
+    return interval_hours
+
+# </editor-fold>
+
+# <editor-fold desc="Chunked data">
+
+class ChunkIntervals:
+    """Hours of the datapoints of time ordered chunks of data, as get_interval_hours of all the chunks together: the
+    last datapoint of a chunk lasts until the first timestamp of the next chunk with the same key (e.g. the same
+    inverter), so it is held until that chunk arrives. Repeated timestamps each count in full, all datapoints of the
+    last timestamp are held together. The sampling interval of each key is found from its first chunk if not given"""
+
+    def __init__(self, sampling_interval=None, max_interval=None):
+        self.sampling_interval = None if sampling_interval is None else pd.Timedelta(sampling_interval)
+        self.max_interval = max_interval
+
+        # {key: {'Sampling Interval', 'Max Interval', 'Pending'}}, Pending is the datapoints of the last timestamp of
+        # the key as (timestamps, values)
+        self._keys = {}
+
+    def add(self, key, timestamps, values):
+        """Adds a chunk of a key, values with one row per timestamp. Returns the timestamps, values and hours of the
+        datapoints whose hours are now known: those held from the previous chunk and all of this chunk but those of
+        its last timestamp"""
+
+        timestamps = pd.DatetimeIndex(timestamps)
+        values = np.asarray(values, dtype=float)
+
+        has_timestamp = ~timestamps.isna()
+        if not has_timestamp.all():
+            timestamps = timestamps[has_timestamp]
+            values = values[has_timestamp]
+        if len(timestamps) == 0:
+            return timestamps, values, np.zeros(0)
+
+        if (np.diff(timestamps.asi8) < 0).any():
+            order = np.argsort(timestamps.asi8, kind='stable')
+            timestamps = timestamps[order]
+            values = values[order]
+
+        if key not in self._keys:
+            sampling_interval = self.sampling_interval if self.sampling_interval is not None \
+                else get_sampling_interval(timestamps)
+            self._keys[key] = {'Sampling Interval': sampling_interval,
+                               'Max Interval': get_max_interval(sampling_interval, self.max_interval).value,
+                               'Pending': None}
+        key_intervals = self._keys[key]
+
+        if key_intervals['Pending'] is not None:
+            pending_timestamps, pending_values = key_intervals['Pending']
+            if timestamps[0] < pending_timestamps[0]:
+                raise ValueError('Chunks must be in time order, ' + str(timestamps[0]) + ' is before ' +
+                                 str(pending_timestamps[0]))
+            timestamps = pending_timestamps.append(timestamps)
+            values = np.concatenate([pending_values, values])
+
+        # Each datapoint lasts until the next distinct timestamp, as in get_interval_hours
+        timestamp_values = timestamps.asi8
+        n_known = np.searchsorted(timestamp_values, timestamp_values[-1], side='left')
+        unique_values, positions = np.unique(timestamp_values[:n_known], return_inverse=True)
+        steps = np.diff(unique_values, append=timestamp_values[-1:])
+        steps = np.where(steps <= key_intervals['Max Interval'], steps, key_intervals['Sampling Interval'].value)
+
+        key_intervals['Pending'] = (timestamps[n_known:], values[n_known:])
+
+        return timestamps[:n_known], values[:n_known], steps[positions.ravel()] / pd.Timedelta(hours=1).value
+
+    def get_pending(self, key):
+        """Returns the timestamps, values and hours of the datapoints held for a key, which last one sampling interval
+        if no other chunk follows. They are still held"""
+
+        key_intervals = self._keys.get(key)
+        if key_intervals is None or key_intervals['Pending'] is None:
+            return pd.DatetimeIndex([]), np.zeros((0,)), np.zeros(0)
+
+        pending_timestamps, pending_values = key_intervals['Pending']
+
+        return pending_timestamps, pending_values, np.full(len(pending_timestamps), key_intervals['Sampling Interval'] /
+                                                           pd.Timedelta(hours=1))
+
+    def keys(self):
+        return list(self._keys)
+
+
+def get_chunk_key(chunk, inverter=None):
+    """Key of a chunk of power data: the inverter if given, otherwise its columns"""
+
+    if inverter is not None:
+        return inverter
+
+    return tuple(column for column in chunk.columns if column != 'Timestamp')
+
+
+def read_power_data_chunks(file_path, chunk_size: int = 100000, **read_csv_arguments):
+    """Reads a power data CSV file with a Timestamp column in chunks of chunk_size rows"""
+
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size, **read_csv_arguments):
+        chunk['Timestamp'] = pd.to_datetime(chunk['Timestamp'])
+        yield chunk
+
+# </editor-fold>
+
+# <editor-fold desc="Pre-aggregation">
+
+class PowerDataAggregator:
+    """Reduces high rate power data, e.g. 1 minute SCADA exports, to the energy per interval of a coarser resolution
+    (15 minutes by default), one chunk at a time. Only the sums per interval are kept, not the chunks.
+
+    Chunks are Dataframes with a Timestamp column and the power columns of one inverter (add_chunk with the
+    inverter) or of several inverters. Chunks of the same columns must be in time order. Energy is integrated with
+    the steps between timestamps as in get_interval_hours, also across chunks (see ChunkIntervals). Power data
+    returned has, per interval, the mean power over the whole interval (energy / resolution), so that the energy of
+    the PR calculations is the same as with the high rate data. Intervals with no values are NaN.
+
+    Corrected and DC focus PR of the reduced data clip and filter the interval means, not the high rate values"""
+
+    def __init__(self, resolution='15min', sampling_interval=None, max_interval=None):
+        self.resolution = pd.Timedelta(resolution)
+        self.tz = None
+        self.rows = 0
+
+        self._chunk_intervals = ChunkIntervals(sampling_interval, max_interval)
+
+        # {inverter or columns: {'Columns', 'Intervals', 'Energy', 'Hours'}}
+        self._groups = {}
+
+    def add_chunk(self, chunk, inverter=None):
+        """Adds a chunk of power data, of one inverter if given"""
+
+        key = get_chunk_key(chunk, inverter)
+        columns = tuple(column for column in chunk.columns if column != 'Timestamp')
+        if key not in self._groups:
+            self._groups[key] = {'Columns': columns, 'Intervals': [], 'Energy': [], 'Hours': []}
+
+        group = self._groups[key]
+        if group['Columns'] != columns:
+            raise ValueError('Columns of the chunk differ from previous chunks of ' + str(key) + ': ' +
+                             str(list(columns)))
+
+        timestamps = pd.DatetimeIndex(pd.to_datetime(chunk['Timestamp']))
+        if self.tz is None:
+            self.tz = timestamps.tz
+
+        timestamps, values, hours = self._chunk_intervals.add(key, timestamps, chunk[list(columns)])
+        self._add_interval_sums(group, timestamps.asi8, values, hours)
+        self.rows += len(chunk)
+
+    def _get_interval_sums(self, timestamp_values, values, hours):
+        has_value = ~np.isnan(values)
+        energy = np.where(has_value, values, 0) * hours[:, np.newaxis]
+        value_hours = has_value * hours[:, np.newaxis]
+
+        intervals = timestamp_values // self.resolution.value
+        interval_starts = np.concatenate(([0], np.flatnonzero(intervals[1:] != intervals[:-1]) + 1))
+
+        return intervals[interval_starts], np.add.reduceat(energy, interval_starts, axis=0), \
+            np.add.reduceat(value_hours, interval_starts, axis=0)
+
+    def _add_interval_sums(self, group, timestamp_values, values, hours):
+        if len(timestamp_values) == 0:
+            return
+
+        intervals, energy, value_hours = self._get_interval_sums(timestamp_values, values, hours)
+        group['Intervals'].append(intervals)
+        group['Energy'].append(energy)
+        group['Hours'].append(value_hours)
+
+    def _get_group_power(self, key):
+        """Mean power per interval of a group, including its last datapoint, which lasts one sampling interval"""
+
+        group = self._groups[key]
+        intervals = list(group['Intervals'])
+        energy = list(group['Energy'])
+        value_hours = list(group['Hours'])
+
+        pending_timestamps, pending_values, pending_hours = self._chunk_intervals.get_pending(key)
+        if len(pending_timestamps):
+            pending_sums = self._get_interval_sums(pending_timestamps.asi8, pending_values, pending_hours)
+            for sums, pending_sum in zip([intervals, energy, value_hours], pending_sums):
+                sums.append(pending_sum)
+
+        intervals = np.concatenate(intervals)
+        energy = np.concatenate(energy)
+        value_hours = np.concatenate(value_hours)
+
+        # Intervals split between two chunks are joined
+        interval_starts = np.concatenate(([0], np.flatnonzero(intervals[1:] != intervals[:-1]) + 1))
+        energy = np.add.reduceat(energy, interval_starts, axis=0)
+        value_hours = np.add.reduceat(value_hours, interval_starts, axis=0)
+
+        resolution_hours = self.resolution / pd.Timedelta(hours=1)
+        power = np.where(value_hours > 0, energy / resolution_hours, np.nan)
+
+        return intervals[interval_starts], power
+
+    def _to_dataframe(self, intervals, power, columns):
+        timestamps = pd.DatetimeIndex(intervals * self.resolution.value)
+        if self.tz is not None:
+            timestamps = timestamps.tz_localize('UTC').tz_convert(self.tz)
+
+        power_data = pd.DataFrame(power, columns=list(columns))
+        power_data.insert(0, 'Timestamp', timestamps)
+
+        return power_data
+
+    def get_power_data(self, inverter=None):
+        """Returns the reduced power data of an inverter added with add_chunk(chunk, inverter), or else of all
+        columns, one row per interval with data"""
+
+        if inverter is not None:
+            return self._to_dataframe(*self._get_group_power(inverter), self._groups[inverter]['Columns'])
+
+        if not self._groups:
+            return pd.DataFrame({'Timestamp': pd.DatetimeIndex([])})
+
+        group_powers = [self._get_group_power(key) for key in self._groups]
+        all_intervals = np.unique(np.concatenate([intervals for intervals, _ in group_powers]))
+
+        columns = [column for group in self._groups.values() for column in group['Columns']]
+        power = np.full((len(all_intervals), len(columns)), np.nan)
+        column_start = 0
+        for (intervals, group_power), group in zip(group_powers, self._groups.values()):
+            column_end = column_start + len(group['Columns'])
+            power[np.searchsorted(all_intervals, intervals), column_start:column_end] = group_power
+            column_start = column_end
+
+        return self._to_dataframe(all_intervals, power, columns)
+
+    def get_power_data_dict(self, inverter_list):
+        """Returns the reduced power data as all_inverter_power_data_dict. Inverters not added with their own chunks
+        take the columns starting with their name from the chunks of several inverters, e.g. 'Inverter 01 AC Power'"""
+
+        all_inverter_power_data_dict = {}
+        site_power_data = None
+        for inverter in inverter_list:
+            if inverter in self._groups:
+                all_inverter_power_data_dict[inverter] = {'Power Data': self.get_power_data(inverter)}
+                continue
+
+            if site_power_data is None:
+                site_power_data = self.get_power_data()
+            inverter_columns = data_schema.get_inverter_columns(site_power_data.columns, inverter)
+            if not inverter_columns:
+                raise KeyError('No power data columns found for ' + str(inverter))
+
+            inverter_data = site_power_data[['Timestamp'] + inverter_columns]
+            has_data = inverter_data[inverter_columns].notna().any(axis=1)
+            all_inverter_power_data_dict[inverter] = {'Power Data': inverter_data.loc[has_data].reset_index(drop=True)}
+
+        return all_inverter_power_data_dict
+
+
+def aggregate_power_data(chunks, inverter_list, resolution='15min', sampling_interval=None, max_interval=None):
+    """Reduces the chunks of high rate power data, Dataframes or (inverter, Dataframe) pairs, to
+    all_inverter_power_data_dict at the given resolution, see PowerDataAggregator"""
+
+    aggregator = PowerDataAggregator(resolution, sampling_interval, max_interval)
+    for chunk in chunks:
+        if isinstance(chunk, tuple):
+            aggregator.add_chunk(chunk[1], inverter=chunk[0])
+        else:
+            aggregator.add_chunk(chunk)
+
+    return aggregator.get_power_data_dict(inverter_list)
+
+# </editor-fold>
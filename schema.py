@@ -0,0 +1,80 @@
+# <editor-fold desc="Power data schema">
+
+class PowerDataSchema:
+    """Names of the AC power, Expected power, Ideal power and Irradiance columns of each inverter's power data.
+    Columns are found once per inverter by name matching (the first column containing the quantity pattern) and
+    then looked up from a dictionary. Overrides set the column of a quantity for all inverters, inverter overrides
+    set it for one inverter, e.g. {'Inverter 01': {'irradiance': 'POA Irradiance'}}"""
+
+    quantities = ['ac', 'expected', 'ideal', 'irradiance']
+    default_patterns = {'ac': 'AC', 'expected': 'Expected', 'ideal': 'Ideal', 'irradiance': 'Irradiance'}
+
+    def __init__(self, overrides=None, inverter_overrides=None, patterns=None):
+        self.overrides = dict(overrides or {})
+        self.inverter_overrides = dict(inverter_overrides or {})
+        self.patterns = {**self.default_patterns, **(patterns or {})}
+        self.inverter_columns = {}
+
+    @classmethod
+    def from_power_data_dict(cls, inverter_list, all_inverter_power_data_dict, overrides=None,
+                             inverter_overrides=None, patterns=None):
+        """Resolves the columns of all inverters of a dataset"""
+
+        schema = cls(overrides, inverter_overrides, patterns)
+        for inverter in inverter_list:
+            schema.resolve(inverter, all_inverter_power_data_dict[inverter]['Power Data'])
+
+        return schema
+
+    def resolve(self, inverter, inverter_data):
+        """Finds and stores the columns of the inverter, returns them as (ac, expected, ideal, irradiance)"""
+
+        inverter_overrides = self.inverter_overrides.get(inverter, {})
+
+        columns = []
+        for quantity in self.quantities:
+            if quantity in inverter_overrides:
+                column = inverter_overrides[quantity]
+            elif quantity in self.overrides:
+                column = self.overrides[quantity]
+            else:
+                matching_columns = inverter_data.columns[inverter_data.columns.str.contains(self.patterns[quantity])]
+                if len(matching_columns) == 0:
+                    raise KeyError('No ' + quantity + ' column found for ' + str(inverter) + ', columns: ' +
+                                   str(list(inverter_data.columns)))
+                column = matching_columns.values[0]
+
+            columns.append(column)
+
+        self.inverter_columns[inverter] = tuple(columns)
+
+        return self.inverter_columns[inverter]
+
+    def get_columns(self, inverter, inverter_data=None):
+        """Returns (ac, expected, ideal, irradiance) columns of the inverter, resolving them from inverter_data
+        the first time"""
+
+        try:
+            return self.inverter_columns[inverter]
+        except KeyError:
+            if inverter_data is None:
+                raise
+            return self.resolve(inverter, inverter_data)
+
+    def get_site_columns(self, quantity, inverter_list=None):
+        """Returns the column of a quantity for every inverter, e.g. all AC power columns for site totals"""
+
+        i = self.quantities.index(quantity)
+        if inverter_list is None:
+            inverter_list = list(self.inverter_columns)
+
+        return [self.inverter_columns[inverter][i] for inverter in inverter_list]
+
+
+def get_inverter_columns(columns, inverter):
+    """Returns the columns of one inverter in power data of several inverters: those starting with the inverter name,
+    e.g. 'Inverter 01 AC Power'"""
+
+    return [column for column in columns if str(column).startswith(str(inverter) + ' ')]
+
+# </editor-fold>
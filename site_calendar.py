@@ -0,0 +1,100 @@
+import pandas as pd
+import numpy as np
+import perfonitor.sampling as sampling
+
+
+# <editor-fold desc="Calendar index">
+
+class CalendarIndex:
+    """Day, month and week of every timestamp of a site as integer codes, built once and shared by all inverters
+    with the same timestamps. Labels are the ones used in site_info: dates for 'Day', '%m-%Y' for 'Month' and
+    '%V-%G' (ISO week) for 'Week'. Codes of the periods under analysis are cached per period list"""
+
+    def __init__(self, timestamps):
+        # A copy, not a view of the caller's column, so that a column changed in place no longer matches
+        self.source_timestamps = np.array(_get_timestamp_values(timestamps), copy=True)
+        self.timestamps = pd.DatetimeIndex(pd.to_datetime(timestamps))
+
+        day_codes, days = pd.factorize(self.timestamps.normalize())
+        month_codes, months = pd.factorize(np.asarray(self.timestamps.year * 100 + self.timestamps.month))
+        iso_calendar = self.timestamps.isocalendar()
+        week_codes, weeks = pd.factorize(np.asarray(iso_calendar['year'] * 100 + iso_calendar['week']))
+
+        # Only the unique periods are formatted, not every timestamp
+        self.codes = {'Day': day_codes, 'Month': month_codes, 'Week': week_codes}
+        self.labels = {'Day': pd.Index(days.date),
+                       'Month': pd.Index(['%02d-%d' % (month % 100, month // 100) for month in months]),
+                       'Week': pd.Index(['%02d-%d' % (week % 100, week // 100) for week in weeks])}
+
+        self._period_codes = {}
+        self._interval_hours = None
+
+    def matches(self, timestamps):
+        """Checks if the index was built from the same timestamps"""
+
+        timestamp_values = _get_timestamp_values(timestamps)
+
+        return len(timestamp_values) == len(self.source_timestamps) and \
+            np.array_equal(timestamp_values, self.source_timestamps)
+
+    def get_interval_hours(self):
+        """Returns the hours each timestamp stands for (see sampling.get_interval_hours), found once per index.
+        The array is shared, it must not be changed"""
+
+        if self._interval_hours is None:
+            self._interval_hours = sampling.get_interval_hours(self.timestamps)
+
+        return self._interval_hours
+
+    def get_labels(self, period_column):
+        """Returns the period label of every timestamp, e.g. the former 'Day' or 'Month' columns"""
+
+        return self.labels[period_column][self.codes[period_column]]
+
+    def get_period_codes(self, period_column, periods_under_analysis):
+        """Returns the code of each timestamp's period in periods_under_analysis (-1 if outside the analysis) and
+        the unique periods under analysis. The codes array is shared, it must not be changed"""
+
+        key = (period_column, tuple(periods_under_analysis))
+        if key not in self._period_codes:
+            periods = pd.Index(list(dict.fromkeys(periods_under_analysis)))
+            label_codes = self.codes[period_column]
+
+            # Periods of the data are matched with the periods under analysis once, then mapped to the timestamps
+            analysis_codes = periods.get_indexer(self.labels[period_column])
+            period_codes = np.where(label_codes >= 0, analysis_codes[label_codes], -1)
+
+            self._period_codes[key] = (period_codes, periods)
+
+        return self._period_codes[key]
+
+
+def _get_timestamp_values(timestamps):
+    if isinstance(timestamps, (pd.Series, pd.Index)):
+        return timestamps.values
+    return np.asarray(timestamps)
+
+
+# Calendar indexes of the sites in use, most inverters of a site share the same timestamps
+_calendar_indexes = []
+_max_calendar_indexes = 8
+
+
+def get_calendar_index(timestamps):
+    """Returns the calendar index of the timestamps, built only if no cached index has the same timestamps"""
+
+    for calendar_index in _calendar_indexes:
+        if calendar_index.matches(timestamps):
+            return calendar_index
+
+    calendar_index = CalendarIndex(timestamps)
+    _calendar_indexes.insert(0, calendar_index)
+    del _calendar_indexes[_max_calendar_indexes:]
+
+    return calendar_index
+
+
+def clear_calendar_indexes():
+    _calendar_indexes.clear()
+
+# </editor-fold>
@@ -0,0 +1,138 @@
+import pandas as pd
+import numpy as np
+
+
+# <editor-fold desc="Fleet state">
+
+def get_fleet_components(unit_failure_dict):
+    """Returns the components of the fleet from the events summaries of unit_failure_dict, one row per unit and
+    fault component with Unit Age and Component Age (operation hours since the last failure of the component, the
+    Time to Failure of its end of analysis entry), and the pooled Failures and Exposure Hours per fault component"""
+
+    events_summaries = [unit_data['Events Summary'] for unit_data in unit_failure_dict.values()]
+    all_events_summary = pd.concat(events_summaries, ignore_index=True)
+    time_to_failure = pd.to_numeric(all_events_summary['Time to Failure'], errors='coerce')
+
+    end_of_analysis = all_events_summary['Failure'] == "No"
+    fleet_components = all_events_summary.loc[end_of_analysis, ['Unit Component', 'Fault Component']].copy()
+    fleet_components['Unit Age'] = fleet_components['Unit Component'].map(
+        {unit: unit_data['Unit Age'] for unit, unit_data in unit_failure_dict.items()})
+    fleet_components['Component Age'] = time_to_failure[end_of_analysis].clip(lower=0).fillna(0)
+
+    fault_component_history = pd.DataFrame({
+        'Failures': (all_events_summary['Failure'] == "Yes").groupby(all_events_summary['Fault Component']).sum(),
+        'Exposure Hours': time_to_failure.groupby(all_events_summary['Fault Component']).sum()})
+
+    return fleet_components.reset_index(drop=True), fault_component_history
+
+# </editor-fold>
+
+# <editor-fold desc="Monte Carlo simulation">
+
+class SparePartsDemand:
+    """Simulated spare part demand, one row per trial and one column per fault component. Stock levels are
+    evaluated on the stored trials, without simulating again"""
+
+    def __init__(self, fault_components, demand, horizon_hours):
+        self.fault_components = pd.Index(fault_components, name='Fault Component')
+        self.demand = demand
+        self.horizon_hours = horizon_hours
+
+    def get_summary(self, percentiles=(50, 90, 95, 99)):
+        """Returns mean and percentiles of the demand per fault component"""
+
+        summary = pd.DataFrame({'Mean': self.demand.mean(axis=0)}, index=self.fault_components)
+        if len(percentiles):
+            demand_percentiles = np.percentile(self.demand, percentiles, axis=0, method='higher')
+            for percentile, demand_percentile in zip(percentiles, demand_percentiles):
+                summary['P' + str(percentile)] = demand_percentile.astype(int)
+
+        return summary
+
+    def get_stockout_probabilities(self, stock_levels):
+        """Returns the probability that the demand exceeds the stock of each fault component, stock_levels as
+        {fault component: stock} or one stock for all"""
+
+        if isinstance(stock_levels, dict):
+            stock = np.array([stock_levels.get(fault_component, 0) for fault_component in self.fault_components])
+        else:
+            stock = np.full(len(self.fault_components), stock_levels)
+
+        return pd.Series((self.demand > stock).mean(axis=0), index=self.fault_components,
+                         name='Probability of Stockout')
+
+    def get_stock_for_service_level(self, service_level: float = 0.95):
+        """Returns the smallest stock of each fault component that covers the demand in service_level of trials"""
+
+        return pd.Series(np.quantile(self.demand, service_level, axis=0, method='higher').astype(int),
+                         index=self.fault_components, name='Stock')
+
+
+def simulate_spare_parts_demand(unit_failure_dict, horizon_hours: float, n_trials: int = 10000, seed=None,
+                                reliability_models=None, fault_components=None, max_elements: int = 10000000):
+    """Simulates the spare part demand of the fleet over the next horizon_hours of operation.
+
+    Failure rates are the pooled failures per exposure hour of each fault component in unit_failure_dict (Poisson
+    demand per unit), or the Weibull Shape and Scale of reliability_models (see reliability.fit_reliability_models)
+    where available. With Weibull, the first failure of each component is conditional on its current age and a
+    failed part is replaced by a new one. All trials are drawn as arrays, in chunks of at most max_elements draws.
+    The same seed gives the same demand"""
+
+    rng = np.random.default_rng(seed)
+    fleet_components, fault_component_history = get_fleet_components(unit_failure_dict)
+
+    if fault_components is None:
+        fault_components = sorted(fleet_components['Fault Component'].unique())
+    fleet_components = fleet_components.loc[fleet_components['Fault Component'].isin(fault_components)]
+
+    fault_component_codes = pd.Index(fault_components).get_indexer(fleet_components['Fault Component'])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        failure_rates = (fault_component_history['Failures'] / fault_component_history['Exposure Hours']).reindex(
+            fault_components).fillna(0).to_numpy(dtype=float)
+    n_units = np.bincount(fault_component_codes, minlength=len(fault_components))
+
+    weibull_shape = np.full(len(fault_components), np.nan)
+    weibull_scale = np.full(len(fault_components), np.nan)
+    if reliability_models is not None and 'Weibull Shape' in reliability_models.columns:
+        weibull_shape = reliability_models['Weibull Shape'].reindex(fault_components).to_numpy(dtype=float)
+        weibull_scale = reliability_models['Weibull Scale'].reindex(fault_components).to_numpy(dtype=float)
+    is_weibull = np.isfinite(weibull_shape) & np.isfinite(weibull_scale)
+
+    # Exponential: sum of Poisson demands of the units is Poisson
+    demand = rng.poisson(np.where(is_weibull, 0, failure_rates * horizon_hours * n_units),
+                         size=(n_trials, len(fault_components)))
+
+    # Weibull: renewals of every component, in chunks of trials
+    weibull_components = np.flatnonzero(is_weibull[fault_component_codes])
+    if len(weibull_components):
+        codes = fault_component_codes[weibull_components]
+        ages = fleet_components['Component Age'].to_numpy(dtype=float)[weibull_components]
+        shape, scale = weibull_shape[codes], weibull_scale[codes]
+
+        chunk_size = max(1, max_elements // len(weibull_components))
+        for start in range(0, n_trials, chunk_size):
+            end = min(start + chunk_size, n_trials)
+            failures = _simulate_weibull_renewals(rng, end - start, ages, shape, scale, horizon_hours)
+            for i in np.flatnonzero(is_weibull):
+                demand[start:end, i] = failures[:, codes == i].sum(axis=1)
+
+    return SparePartsDemand(fault_components, demand, horizon_hours)
+
+
+def _simulate_weibull_renewals(rng, n_trials, ages, shape, scale, horizon_hours):
+    """Number of failures of each component in each trial, with shape (trials, components)"""
+
+    # Time to the first failure, given survival up to the current age
+    exponential_draws = rng.standard_exponential((n_trials, len(ages)))
+    time = scale * ((ages / scale) ** shape + exponential_draws) ** (1 / shape) - ages
+
+    failures = np.zeros((n_trials, len(ages)), dtype=np.int64)
+    active = time <= horizon_hours
+    while active.any():
+        failures += active
+        time = np.where(active, time + scale * rng.standard_exponential(time.shape) ** (1 / shape), time)
+        active = active & (time <= horizon_hours)
+
+    return failures
+
+# </editor-fold>
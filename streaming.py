@@ -0,0 +1,172 @@
+import pandas as pd
+import numpy as np
+import perfonitor.calculations as calculations
+import perfonitor.instrumentation as instrumentation
+import perfonitor.sampling as sampling
+import perfonitor.schema as data_schema
+import perfonitor.site_calendar as site_calendar
+
+
+# <editor-fold desc="Streaming PR">
+
+class StreamingPR:
+    """PR of a site from power data read in chunks, e.g. years of history that do not fit in memory. Each chunk is
+    reduced to the energy of raw, corrected and DC focus PR per day and month under analysis and then dropped, so
+    memory depends on the chunk size and the number of periods, not on the length of the history.
+
+    Chunks are Dataframes with a Timestamp column and the power columns of one inverter (add_chunk with the
+    inverter) or of several inverters (columns starting with the inverter name, e.g. 'Inverter 01 AC Power').
+    Chunks of the same inverter, or of the same columns, must be in time order. Energy is integrated with the steps
+    between timestamps, also across chunks (see sampling.ChunkIntervals). get_pr returns the same tables as
+    calculate_pr_inverters with all the data in memory"""
+
+    pr_types = ['raw', 'corrected', 'corrected_DCfocus']
+    periods_under_analysis = {'daily': 'Days', 'monthly': 'Months'}
+    period_columns = {'daily': 'Day', 'monthly': 'Month'}
+    n_quantities = 4
+
+    def __init__(self, inverter_list, site_info, schema=None, sampling_interval=None, max_interval=None):
+        self.inverter_list = list(inverter_list)
+        self.site_info = site_info
+        self.schema = schema if schema is not None else data_schema.PowerDataSchema()
+        self.rows = 0
+
+        component_info = site_info['Component Info'].set_index('Component')
+        self.maxexport_capacity_ac = component_info.loc[self.inverter_list, 'Capacity AC'].to_numpy(
+            dtype=float) * 1.001
+
+        self.periods = {granularity: pd.Index(list(dict.fromkeys(site_info[periods])))
+                        for granularity, periods in self.periods_under_analysis.items()}
+
+        # {granularity: array with shape (periods, inverters, PR types * quantities)}
+        self._energy = {granularity: np.zeros((len(periods), len(self.inverter_list),
+                                               len(self.pr_types) * self.n_quantities))
+                        for granularity, periods in self.periods.items()}
+
+        self._chunk_intervals = sampling.ChunkIntervals(sampling_interval, max_interval)
+
+        # {chunk key: (positions of the inverters of the chunk, their power columns in order)}
+        self._chunk_layouts = {}
+
+    def _get_chunk_layout(self, key, chunk, inverter):
+        if key in self._chunk_layouts:
+            return self._chunk_layouts[key]
+
+        if inverter is not None:
+            chunk_inverters = [inverter]
+            power_columns = list(self.schema.get_columns(inverter, chunk))
+        else:
+            chunk_inverters = []
+            power_columns = []
+            for site_inverter in self.inverter_list:
+                inverter_columns = data_schema.get_inverter_columns(chunk.columns, site_inverter)
+                if inverter_columns:
+                    chunk_inverters.append(site_inverter)
+                    power_columns += list(self.schema.get_columns(site_inverter, chunk[inverter_columns]))
+
+            if not chunk_inverters:
+                raise ValueError('No power data columns of the inverters in the chunk: ' + str(list(chunk.columns)))
+
+        inverter_positions = np.array([self.inverter_list.index(chunk_inverter)
+                                       for chunk_inverter in chunk_inverters])
+        self._chunk_layouts[key] = (inverter_positions, power_columns)
+
+        return self._chunk_layouts[key]
+
+    def add_chunk(self, chunk, inverter=None):
+        """Adds a chunk of power data, of one inverter if given"""
+
+        key = sampling.get_chunk_key(chunk, inverter)
+        inverter_positions, power_columns = self._get_chunk_layout(key, chunk, inverter)
+
+        with instrumentation.span('add_pr_chunk', rows=len(chunk), inverters=len(inverter_positions)):
+            timestamps = pd.DatetimeIndex(pd.to_datetime(chunk['Timestamp']))
+            timestamps, values, hours = self._chunk_intervals.add(key, timestamps, chunk[power_columns])
+            self._add_energy(self._energy, inverter_positions, timestamps, values, hours)
+
+        self.rows += len(chunk)
+
+    def _add_energy(self, energy, inverter_positions, timestamps, values, hours):
+        if len(timestamps) == 0:
+            return
+
+        power = values.reshape(len(timestamps), len(inverter_positions), self.n_quantities)
+        pr_type_values = calculations.stack_pr_type_values(power, self.maxexport_capacity_ac[inverter_positions])
+        pr_type_values = pr_type_values.reshape(len(timestamps), -1)
+
+        calendar_index = site_calendar.CalendarIndex(timestamps)
+        for granularity in energy:
+            period_codes, _ = calendar_index.get_period_codes(
+                self.period_columns[granularity], self.site_info[self.periods_under_analysis[granularity]])
+
+            # Only the periods of the chunk are summed and updated
+            chunk_periods = np.unique(period_codes[period_codes >= 0])
+            if len(chunk_periods) == 0:
+                continue
+            chunk_codes = np.where(period_codes >= 0, np.searchsorted(chunk_periods, period_codes), -1)
+
+            period_energy = calculations.sum_per_period(pr_type_values, chunk_codes, len(chunk_periods), hours)
+            energy[granularity][np.ix_(chunk_periods, inverter_positions)] += period_energy.reshape(
+                len(chunk_periods), len(inverter_positions), -1)
+
+    def get_energy(self, pr_type: str = 'raw', granularity: str = 'daily'):
+        """Returns the energy per period with shape (periods, inverters, quantities) and the periods under analysis.
+        The last datapoint of each inverter counts one sampling interval until more chunks are added"""
+
+        if pr_type not in self.pr_types or granularity not in self.periods:
+            raise ValueError('Combination of PR type and granularity not possible: ' + str(pr_type) + ", " +
+                             str(granularity))
+
+        energy = {granularity: self._energy[granularity].copy()}
+        for key in self._chunk_intervals.keys():
+            inverter_positions, _ = self._chunk_layouts[key]
+            self._add_energy(energy, inverter_positions, *self._chunk_intervals.get_pending(key))
+
+        i = self.pr_types.index(pr_type)
+        pr_type_energy = energy[granularity][:, :, i * self.n_quantities:(i + 1) * self.n_quantities]
+
+        return pr_type_energy, self.periods[granularity]
+
+    def get_pr(self, pr_type: str = 'raw', granularity: str = 'daily'):
+        """Returns the same PR tables as calculate_pr_inverters for all chunks added so far"""
+
+        inverters_with_data = {i for inverter_positions, _ in self._chunk_layouts.values() for i in inverter_positions}
+        missing_inverters = [inverter for i, inverter in enumerate(self.inverter_list) if i not in inverters_with_data]
+        if missing_inverters:
+            raise KeyError('No power data added for ' + str(missing_inverters))
+
+        energy, periods = self.get_energy(pr_type, granularity)
+        power_columns = {inverter: self.schema.get_columns(inverter) for inverter in self.inverter_list}
+
+        return calculations.build_pr_tables(energy, periods, self.inverter_list, power_columns, pr_type, granularity)
+
+    def get_all_pr(self):
+        """Returns the PR tables of all PR types and granularities as {granularity: {pr_type: PR table}}, as the
+        first result of calculate_all_pr_inverters"""
+
+        all_pr_results = {}
+        for granularity in self.periods:
+            all_pr_results[granularity] = {}
+            for pr_type in self.pr_types:
+                pr_df = self.get_pr(pr_type, granularity)
+                all_pr_results[granularity][pr_type] = pr_df[0] if isinstance(pr_df, tuple) else pr_df
+
+        return all_pr_results
+
+
+def calculate_pr_from_chunks(chunks, inverter_list, site_info, pr_type: str = 'raw', granularity: str = 'daily',
+                             schema=None, sampling_interval=None, max_interval=None):
+    """Calculates PR of all inverters from chunks of power data, Dataframes or (inverter, Dataframe) pairs, e.g. from
+    sampling.read_power_data_chunks, holding one chunk in memory at a time. Returns the same tables as
+    calculate_pr_inverters. To get several PR types or granularities from one pass, use StreamingPR"""
+
+    streaming_pr = StreamingPR(inverter_list, site_info, schema, sampling_interval, max_interval)
+    for chunk in chunks:
+        if isinstance(chunk, tuple):
+            streaming_pr.add_chunk(chunk[1], inverter=chunk[0])
+        else:
+            streaming_pr.add_chunk(chunk)
+
+    return streaming_pr.get_pr(pr_type, granularity)
+
+# </editor-fold>